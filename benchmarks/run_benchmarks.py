@@ -0,0 +1,736 @@
+"""
+Benchmark suite for the seaweed growth model. Times and records the peak
+memory of all parts of the pipeline, either on the test datasets shipped
+with the repository or on synthetic data of any size. Every run is appended
+to a history file in the JSON lines format, so runs can be compared over time.
+
+Run it from the main folder of the repository, e.g.:
+    python -m benchmarks.run_benchmarks --datasets US synthetic --cells 86000
+    python -m benchmarks.run_benchmarks --compare
+"""
+import argparse
+import datetime
+import json
+import os
+import pickle
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic_data
+from src.model import lookup_tables, monte_carlo, parameter_sets
+from src.model import seaweed_growth as sg
+from src.model.chunked_model import dataset_from_pickles, run_chunked
+from src.model.ocean_section import OceanSection
+from src.model.seaweed_ensemble import SeaweedEnsemble
+from src.model.seaweed_model import SeaweedModel
+from src.processing import aggregates, ranking, region_weights
+from src.processing.grid_index import GridIndex
+from src.processing.preprocessing import prepare_gridded_data
+from src.processing.read_files import DataGrid
+from src.utilities import weighted_quantile, weighted_quantile_array
+
+HISTORY_FILE = "benchmarks" + os.sep + "results" + os.sep + "history.jsonl"
+
+# The test datasets shipped with the repository
+SHIPPED_DATASETS = {
+    "US": "gridded_data_test_dataset_US_only",
+    "AUS": "gridded_data_test_dataset_AUS_only",
+}
+
+PARAMETERS = [
+    "salinity_factor",
+    "nutrient_factor",
+    "illumination_factor",
+    "temp_factor",
+    "nitrate_subfactor",
+    "ammonium_subfactor",
+    "phosphate_subfactor",
+    "seaweed_growth_rate",
+]
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. A benchmark gets the context of a dataset and returns
+    a function to time and the number of values it processes. If the benchmark
+    cannot run for the dataset, it returns None
+    Arguments:
+        name: the name of the benchmark
+    Returns:
+        the decorator
+    """
+
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+
+    return register
+
+
+@benchmark("factor_functions_series")
+def factor_functions_series(context):
+    """
+    The factor functions for pandas series, on all values of the grid
+    """
+    variables = {
+        variable: pd.Series(values.reshape(-1))
+        for variable, values in context["variables"].items()
+    }
+
+    def run():
+        sg.calculate_illumination_factor(variables["illumination"])
+        sg.calculate_temperature_factor(variables["temperature"])
+        sg.calculate_salinity_factor(variables["salinity"])
+        sg.calculate_nutrient_factor(
+            variables["nitrate"], variables["ammonium"], variables["phosphate"]
+        )
+
+    return run, context["values"]
+
+
+@benchmark("factor_functions_array")
+def factor_functions_array(context):
+    """
+    The vectorized factor functions, on all values of the grid
+    """
+    variables = context["variables"]
+
+    def run():
+        sg.growth_factor_combination_array(
+            sg.illumination_array(variables["illumination"]),
+            sg.temperature_array(variables["temperature"]),
+            sg.nutrient_array(
+                variables["nitrate"], variables["ammonium"], variables["phosphate"]
+            )[0],
+            sg.salinity_array(variables["salinity"]),
+        )
+
+    return run, context["values"]
+
+
+@benchmark("factor_functions_lookup")
+def factor_functions_lookup(context):
+    """
+    The vectorized factor functions with the single variable
+    factors looked up in tables with an error of at most 1e-6
+    """
+    variables = context["variables"]
+    # Build the tables before the timing
+    lookup_tables.error_report(1e-6)
+
+    def run():
+        sg.growth_factor_combination_array(
+            lookup_tables.factor_array(
+                "illumination", variables["illumination"], max_error=1e-6
+            ),
+            lookup_tables.factor_array(
+                "temperature", variables["temperature"], max_error=1e-6
+            ),
+            sg.nutrient_array(
+                variables["nitrate"], variables["ammonium"], variables["phosphate"]
+            )[0],
+            lookup_tables.factor_array(
+                "salinity", variables["salinity"], max_error=1e-6
+            ),
+        )
+
+    return run, context["values"]
+
+
+@benchmark("parameter_sweep")
+def parameter_sweep(context):
+    """
+    The growth rate of 64 sets of the empirical constants in one
+    sweep over the grid, reduced to the mean of every set
+    """
+    variables = context["variables"]
+    sets = parameter_sets.sample_parameter_sets(64)
+
+    def run():
+        parameter_sets.sweep_growth_rate(
+            variables,
+            sets,
+            reduce=lambda growth_rate: np.nanmean(
+                growth_rate.reshape(len(growth_rate), -1), axis=1
+            ),
+        )
+
+    return run, 64 * context["values"]
+
+
+@benchmark("monte_carlo")
+def monte_carlo_benchmark(context):
+    """
+    100 realizations of the growth rate with perturbed data,
+    reduced to the quantiles of every cell and month
+    """
+    variables = context["variables"]
+
+    def run():
+        monte_carlo.monte_carlo_growth_rate(variables, realizations=100)
+
+    return run, 100 * context["values"]
+
+
+@benchmark("ocean_section")
+def ocean_section(context):
+    """
+    Creates an ocean section for every cell and calculates its growth
+    """
+    data_grid = context["data_grid"]
+
+    def run():
+        for lat_lon, cell_df in data_grid.grid_dict.items():
+            section = OceanSection(lat_lon, cell_df)
+            section.calculate_factors()
+            section.calculate_growth_rate()
+            section.create_section_df()
+
+    return run, context["values"]
+
+
+@benchmark("seaweed_model_grid")
+def seaweed_model_grid(context):
+    """
+    A complete run of the model on the grid, including the parameter dataframes
+    """
+
+    def run():
+        model = SeaweedModel()
+        model.add_data_by_grid(context["grid_file"])
+        model.calculate_factors()
+        model.calculate_growth_rate()
+        model.create_section_dfs()
+        for parameter in PARAMETERS:
+            model.construct_df_for_parameter(parameter)
+
+    return run, context["values"]
+
+
+@benchmark("seaweed_model_lme")
+def seaweed_model_lme(context):
+    """
+    A complete run of the model for all LMEs, only run once with the US dataset
+    """
+    lme_file = (
+        "data"
+        + os.sep
+        + "lme_data"
+        + os.sep
+        + "seaweed_environment_data_in_nuclear_war.csv"
+    )
+    if context["name"] != "US" or not os.path.isfile(lme_file):
+        return None
+
+    def run():
+        model = SeaweedModel()
+        model.add_data_by_lme(list(range(1, 67)), lme_file)
+        model.calculate_factors()
+        model.calculate_growth_rate()
+        model.create_section_dfs()
+        for parameter in PARAMETERS:
+            model.construct_df_for_parameter(parameter)
+
+    return run, 66 * 240
+
+
+@benchmark("seaweed_ensemble")
+def seaweed_ensemble(context):
+    """
+    A run of the ensemble with the grid used for two scenarios
+    """
+
+    def run():
+        ensemble = SeaweedEnsemble()
+        ensemble.add_data_by_grid(
+            {"a": context["grid_file"], "b": context["grid_file"]}
+        )
+        ensemble.calculate_factors()
+        ensemble.calculate_growth_rate()
+
+    return run, 2 * context["values"]
+
+
+@benchmark("chunked_model")
+def chunked_model(context):
+    """
+    A run of the chunked backend from the raw data to a netCDF file
+    """
+    path, folder, scenario, file_ending = context["raw_data"]
+    output_file = context["tmp_dir"] + os.sep + "chunked_output.nc"
+
+    def run():
+        data_set = dataset_from_pickles(path, folder, scenario, file_ending, 5000)
+        run_chunked(data_set, output_file)
+
+    return run, context["values"]
+
+
+@benchmark("prepare_gridded_data")
+def prepare_gridded_data_benchmark(context):
+    """
+    The preprocessing of the raw data
+    """
+    path, folder, scenario, file_ending = context["raw_data"]
+
+    def run():
+        prepare_gridded_data(path, folder, scenario, file_ending, "benchmark")
+
+    return run, context["values"]
+
+
+@benchmark("weighted_quantile_loop")
+def weighted_quantile_loop(context):
+    """
+    The weighted median of every month, one month at a time
+    """
+    parameter_df = context["parameter_df"]
+    weights = pd.Series(context["areas"]["TAREA"].values)
+
+    def run():
+        parameter_df.reset_index(drop=True).apply(
+            weighted_quantile, args=(weights, 0.5)
+        )
+
+    return run, parameter_df.size
+
+
+@benchmark("weighted_quantile_array")
+def weighted_quantile_array_benchmark(context):
+    """
+    The weighted median of every month in one vectorized pass
+    """
+    parameter_df = context["parameter_df"]
+    weights = context["areas"]["TAREA"].values
+
+    def run():
+        weighted_quantile_array(parameter_df.values, weights, 0.5)
+
+    return run, parameter_df.size
+
+
+@benchmark("aggregates")
+def aggregates_benchmark(context):
+    """
+    The annual and quarterly aggregates of every cell and the region
+    """
+    parameter_df = context["parameter_df"]
+    weights = context["areas"]["TAREA"].values
+
+    def run():
+        aggregates.aggregate(parameter_df, weights)
+
+    return run, parameter_df.size
+
+
+@benchmark("region_weights")
+def region_weights_benchmark(context):
+    """
+    The area weighted time series of all countries, with the
+    weight matrix built beforehand
+    """
+    parameter_df = context["parameter_df"]
+    weights = region_weights.RegionWeights.from_polygons(
+        GridIndex(parameter_df.index),
+        region_weights.read_polygons("countries"),
+        context["areas"]["TAREA"].values,
+        buffer=1,
+    )
+
+    def run():
+        weights.aggregate(parameter_df)
+
+    return run, parameter_df.size
+
+
+@benchmark("ranking")
+def ranking_benchmark(context):
+    """
+    The 100 cells with the best worst year that are among the
+    best 1000 cells of seven scenarios
+    """
+    parameter_df = context["parameter_df"]
+    rng = np.random.default_rng(42)
+    sources = {
+        scenario: parameter_df * rng.uniform(0.9, 1, (len(parameter_df), 1))
+        for scenario in range(7)
+    }
+
+    def run():
+        ranking.robust_top_cells(sources, 100, 1000, "worst_year")
+
+    return run, parameter_df.size * len(sources)
+
+
+@benchmark("clustering")
+def clustering(context):
+    """
+    The clustering of the growth rate time series
+    """
+    # The postprocessing loads the plotting style from the web on import
+    from src.processing.postprocessing import time_series_analysis
+
+    parameter_df = context["parameter_df"]
+
+    def run():
+        time_series_analysis(parameter_df, 3, context["name"])
+
+    return run, parameter_df.size
+
+
+def plotting_run(context, raster_maps):
+    """
+    Prepares the spatial plots of the clusters and the yearly growth rate
+    Arguments:
+        context: the context of the benchmarks
+        raster_maps: if True, the cells are drawn as raster image with a
+            mapping built beforehand, otherwise as one marker per cell
+    Returns:
+        the function to measure
+    """
+    # The plotting loads the plotting style from the web on import
+    import matplotlib.pyplot as plt
+
+    from src.plotting import plotter_grid
+    from src.plotting.raster import RasterMapping
+    from src.utilities import prepare_geometry
+
+    growth_df = context["parameter_df"].copy()
+    growth_df["cluster"] = np.arange(len(growth_df)) % 3 + 1
+    growth_df = prepare_geometry(growth_df)
+    working_dir = context["plot_dir"]
+    mapping = None
+    if raster_maps:
+        mapping = RasterMapping.from_grid(
+            GridIndex(growth_df.index), plotter_grid.map_extent("global")
+        )
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(working_dir)
+        try:
+            plotter_grid.cluster_spatial(
+                growth_df, "global", "benchmark", mapping=mapping
+            )
+            plotter_grid.growth_rate_spatial_by_year(
+                growth_df, "global", "benchmark", 30, mapping=mapping
+            )
+        finally:
+            plt.close("all")
+            os.chdir(cwd)
+
+    return run
+
+
+@benchmark("plotting")
+def plotting(context):
+    """
+    The spatial plots of the clusters and the yearly growth rate,
+    drawn as raster images
+    """
+    return plotting_run(context, True), context["parameter_df"].size
+
+
+@benchmark("plotting_markers")
+def plotting_markers(context):
+    """
+    The spatial plots of the clusters and the yearly growth rate,
+    with one marker per cell
+    """
+    return plotting_run(context, False), context["parameter_df"].size
+
+
+def create_context(name, tmp_dir, cells, months):
+    """
+    Creates the data needed by the benchmarks for one dataset
+    Arguments:
+        name: the name of the dataset, either a shipped one or "synthetic"
+        tmp_dir: a temporary folder to write files to
+        cells: the number of cells for the synthetic dataset
+        months: the number of months for the synthetic dataset
+    Returns:
+        a dictionary with the data for the benchmarks
+    """
+    context = {"name": name, "tmp_dir": tmp_dir}
+    # Use the same folder structure as the repository in the temporary folder
+    interim_path = (
+        tmp_dir + os.sep + "data" + os.sep + "interim_data" + os.sep + "scenario"
+    )
+    os.makedirs(interim_path, exist_ok=True)
+    if name == "synthetic":
+        grid_file = interim_path + os.sep + "data_gridded_all_parameters_synthetic.pkl"
+        with open(grid_file, "wb") as handle:
+            pickle.dump(
+                synthetic_data.synthetic_grid(cells, months),
+                handle,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        file_ending = str(months) + "_months_synthetic"
+        synthetic_data.write_synthetic_raw_data(
+            tmp_dir, "gridded_data_synthetic", "scenario", file_ending, cells, months
+        )
+        context["raw_data"] = (
+            tmp_dir,
+            "gridded_data_synthetic",
+            "scenario",
+            file_ending,
+        )
+        context["parameter_df"] = synthetic_data.synthetic_parameter_dataframe(
+            cells, months
+        )
+    else:
+        grid_file = (
+            "data"
+            + os.sep
+            + "interim_data"
+            + os.sep
+            + "150tg"
+            + os.sep
+            + "data_gridded_all_parameters_"
+            + name
+            + ".pkl"
+        )
+        # Link the raw data, so the preprocessing writes to the temporary folder
+        os.makedirs(tmp_dir + os.sep + "data" + os.sep + SHIPPED_DATASETS[name])
+        os.symlink(
+            os.path.abspath(
+                "data" + os.sep + SHIPPED_DATASETS[name] + os.sep + "150tg"
+            ),
+            tmp_dir
+            + os.sep
+            + "data"
+            + os.sep
+            + SHIPPED_DATASETS[name]
+            + os.sep
+            + "scenario",
+        )
+        context["raw_data"] = (
+            tmp_dir,
+            SHIPPED_DATASETS[name],
+            "scenario",
+            "36_months_150tg",
+        )
+        context["parameter_df"] = pd.read_pickle(
+            "data"
+            + os.sep
+            + "interim_data"
+            + os.sep
+            + "150tg"
+            + os.sep
+            + "seaweed_growth_rate_"
+            + name
+            + ".pkl"
+        )
+        if not os.path.isfile(grid_file):
+            # The test dataset has not been preprocessed yet
+            prepare_gridded_data(*context["raw_data"], name)
+            grid_file = (
+                interim_path + os.sep + "data_gridded_all_parameters_" + name + ".pkl"
+            )
+    context["grid_file"] = grid_file
+    context["areas"] = synthetic_data.synthetic_areas(context["parameter_df"])
+    data_grid = DataGrid(grid_file)
+    context["data_grid"] = data_grid
+    context["variables"] = data_grid.provide_data_arrays(
+        ["illumination", "temperature", "salinity", "nitrate", "ammonium", "phosphate"]
+    )
+    context["values"] = context["variables"]["salinity"].size
+    # Folder structure needed by the plotting
+    plot_dir = tmp_dir + os.sep + "plots"
+    os.makedirs(plot_dir + os.sep + "results" + os.sep + "grid" + os.sep + "benchmark")
+    os.symlink(os.path.abspath("data"), plot_dir + os.sep + "data")
+    context["plot_dir"] = plot_dir
+    return context
+
+
+def measure(run, repeats):
+    """
+    Measures the wall time and peak memory of a function
+    Arguments:
+        run: the function to measure
+        repeats: how often the time is measured
+    Returns:
+        a dictionary with the measurements
+    """
+    wall_times = []
+    cpu_times = []
+    for _ in range(repeats):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        run()
+        cpu_times.append(time.process_time() - start_cpu)
+        wall_times.append(time.perf_counter() - start_wall)
+    # Measure the memory in a separate run, as tracing slows down the code
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_time_min": min(wall_times),
+        "wall_time_mean": float(np.mean(wall_times)),
+        "cpu_time_mean": float(np.mean(cpu_times)),
+        "peak_memory_mb": peak_memory / 1e6,
+    }
+
+
+def get_commit():
+    """
+    Finds the current git commit, so the results can be assigned to a version
+    Arguments:
+        None
+    Returns:
+        the hash of the commit or None if git is not available
+    """
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def run_benchmarks(datasets, cells, months, repeats, selected, history_file):
+    """
+    Runs the benchmarks for all datasets and appends the results to the history
+    Arguments:
+        datasets: a list of dataset names
+        cells: the number of cells for the synthetic dataset
+        months: the number of months for the synthetic dataset
+        repeats: how often each benchmark is timed
+        selected: a list of benchmark names to run, all if None
+        history_file: the JSON lines file to append the results to
+    Returns:
+        a list with one dictionary per benchmark and dataset
+    """
+    run_info = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": get_commit(),
+        "machine": platform.node(),
+        "python": platform.python_version(),
+    }
+    results = []
+    for dataset in datasets:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            print("Preparing dataset {}".format(dataset))
+            context = create_context(dataset, tmp_dir, cells, months)
+            for name, function in BENCHMARKS.items():
+                if selected is not None and name not in selected:
+                    continue
+                result = dict(run_info)
+                result.update(
+                    {
+                        "benchmark": name,
+                        "dataset": dataset,
+                        "cells": len(context["data_grid"].grid_dict),
+                        "months": context["variables"]["salinity"].shape[1],
+                    }
+                )
+                try:
+                    prepared = function(context)
+                    if prepared is None:
+                        continue
+                    run, number_values = prepared
+                    result.update(measure(run, repeats))
+                    result["values_per_second"] = (
+                        number_values / result["wall_time_min"]
+                    )
+                    result["status"] = "ok"
+                except (ImportError, OSError) as error:
+                    result["status"] = "skipped"
+                    result["reason"] = str(error)
+                print(
+                    "{} on {}: {}".format(
+                        name, dataset, result.get("wall_time_min", result["status"])
+                    )
+                )
+                results.append(result)
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    with open(history_file, "a") as handle:
+        for result in results:
+            handle.write(json.dumps(result) + "\n")
+    return results
+
+
+def compare_runs(history_file):
+    """
+    Compares the latest result of every benchmark with the one before,
+    for the same dataset and size
+    Arguments:
+        history_file: the JSON lines file with the results
+    Returns:
+        a dataframe with the latest and previous wall time and the change in percent
+    """
+    history = pd.read_json(history_file, lines=True)
+    history = history[history["status"] == "ok"]
+    rows = []
+    for key, runs in history.groupby(["benchmark", "dataset", "cells", "months"]):
+        runs = runs.sort_values("timestamp")
+        latest = runs.iloc[-1]
+        previous = runs.iloc[-2] if len(runs) > 1 else None
+        rows.append(
+            {
+                "benchmark": key[0],
+                "dataset": key[1],
+                "cells": key[2],
+                "months": key[3],
+                "latest_commit": latest["commit"],
+                "latest_wall_time": latest["wall_time_min"],
+                "previous_commit": None if previous is None else previous["commit"],
+                "previous_wall_time": (
+                    None if previous is None else previous["wall_time_min"]
+                ),
+            }
+        )
+    comparison = pd.DataFrame(rows)
+    comparison["change_percent"] = (
+        comparison["latest_wall_time"] / comparison["previous_wall_time"] - 1
+    ) * 100
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--datasets", nargs="+", default=["US", "AUS", "synthetic"])
+    parser.add_argument(
+        "--cells",
+        type=int,
+        default=5000,
+        help="cells of the synthetic grid, the global grid has about {}".format(
+            synthetic_data.GLOBAL_CELLS
+        ),
+    )
+    parser.add_argument(
+        "--months", type=int, default=120, help="months of the synthetic grid"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--benchmarks", nargs="+", default=None, choices=list(BENCHMARKS.keys())
+    )
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument(
+        "--compare", action="store_true", help="only compare the last runs"
+    )
+    args = parser.parse_args()
+    if args.compare:
+        print(compare_runs(args.history).to_string(index=False))
+    else:
+        run_benchmarks(
+            args.datasets,
+            args.cells,
+            args.months,
+            args.repeats,
+            args.benchmarks,
+            args.history,
+        )
@@ -0,0 +1,189 @@
+"""
+Creates synthetic gridded data for the benchmarks. The data has the same
+format as the data used by the model, but can be created for any number of
+grid cells and months, e.g. for the size of the global grid. The values
+follow rough latitudinal and seasonal patterns within realistic ranges.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.processing.read_files import RAW_VARIABLES, needed_variables
+
+# Number of ocean cells in the global grid of the climate model
+GLOBAL_CELLS = 86000
+
+
+def synthetic_coordinates(number_cells, seed=42):
+    """
+    Creates random coordinates that are evenly distributed over the sphere,
+    with longitudes in the 0-360 convention of the climate model
+    Arguments:
+        number_cells: the number of grid cells
+        seed: the seed for the random number generator
+    Returns:
+        lats: numpy array of the latitudes
+        lons: numpy array of the longitudes
+    """
+    rng = np.random.default_rng(seed)
+    lats = np.degrees(np.arcsin(rng.uniform(np.sin(np.radians(-78)), 1, number_cells)))
+    lats = np.minimum(lats, 89.9)
+    lons = rng.uniform(0, 360, number_cells)
+    return lats, lons
+
+
+def synthetic_variables(lats, number_months, seed=42):
+    """
+    Creates the environmental variables for all cells and months
+    Arguments:
+        lats: numpy array of the latitudes of the cells
+        number_months: the number of months
+        seed: the seed for the random number generator
+    Returns:
+        a dictionary with one numpy array with the axes (cell, month)
+        per variable, named as in the seaweed model
+    """
+    rng = np.random.default_rng(seed)
+    shape = (len(lats), number_months)
+    abs_lats = np.abs(lats)[:, np.newaxis]
+    # Seasons are opposite on the hemispheres
+    season = np.cos(2 * np.pi * np.arange(number_months) / 12)[np.newaxis, :]
+    season = season * np.sign(lats)[:, np.newaxis]
+    # Slow cooling and darkening after the war, recovering after some years
+    war = np.exp(-(((np.arange(number_months) - 24) / 30) ** 2))[np.newaxis, :]
+    temperature = 29 - 0.38 * abs_lats + 3 * season - 4 * war
+    illumination = (80 - 0.8 * abs_lats) * (1 + 0.6 * season) * (1 - 0.5 * war)
+    nutrient_level = abs_lats / 90 + rng.uniform(0, 0.3, shape)
+    variables = {
+        "temperature": temperature + rng.normal(0, 1, shape),
+        "salinity": 34.5 + rng.normal(0, 1, shape),
+        "illumination": illumination + rng.uniform(0, 20, shape),
+        "nitrate": 18 * nutrient_level,
+        "ammonium": 1.2 * nutrient_level,
+        "phosphate": 1.2 * nutrient_level,
+        "iron": 0.003 * nutrient_level,
+    }
+    limits = {
+        "temperature": (-1.8, 33),
+        "salinity": (28, 38),
+        "illumination": (0, 140),
+        "nitrate": (0, 20),
+        "ammonium": (0, 1.7),
+        "phosphate": (0, 1.3),
+        "iron": (0, 0.04),
+    }
+    return {
+        variable: np.clip(values, *limits[variable]).astype(np.float32)
+        for variable, values in variables.items()
+    }
+
+
+def synthetic_grid(number_cells, number_months, seed=42, extra_variables=None):
+    """
+    Creates synthetic data in the format of the dictionary written
+    by preprocessing.prepare_gridded_data
+    Arguments:
+        number_cells: the number of grid cells
+        number_months: the number of months
+        seed: the seed for the random number generator
+        extra_variables: a list of further variables to store, see
+            read_files.needed_variables
+    Returns:
+        a dictionary with lat_lon tuples as keys and one dataframe per cell
+    """
+    lats, lons = synthetic_coordinates(number_cells, seed)
+    variables = synthetic_variables(lats, number_months, seed)
+    stored = needed_variables(extra_variables=extra_variables)
+    months_since_war = np.arange(-4, number_months - 4)
+    grid_dict = {}
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        cell_df = pd.DataFrame(
+            {variable: variables[variable][i] for variable in stored}
+        )
+        cell_df.insert(0, "TLAT", lat)
+        cell_df.insert(0, "TLONG", lon)
+        cell_df["months_since_war"] = months_since_war
+        cell_df.index.name = "time"
+        grid_dict[(lat, lon)] = cell_df
+    return grid_dict
+
+
+def write_synthetic_raw_data(
+    path, folder, scenario, file_ending, number_cells, number_months
+):
+    """
+    Writes synthetic data in the format of the pickled climate model output,
+    so it can be read by preprocessing.prepare_gridded_data
+    Arguments:
+        path: the path to write the data to, it gets the same folder
+            structure as the repository
+        folder: the folder for the pickled files
+        scenario: the name of the scenario
+        file_ending: the ending of the pickled files
+        number_cells: the number of grid cells
+        number_months: the number of months
+    Returns:
+        None
+    """
+    lats, lons = synthetic_coordinates(number_cells)
+    variables = synthetic_variables(lats, number_months)
+    full_path = path + os.sep + "data" + os.sep + folder + os.sep + scenario
+    os.makedirs(full_path, exist_ok=True)
+    os.makedirs(
+        path + os.sep + "data" + os.sep + "interim_data" + os.sep + scenario,
+        exist_ok=True,
+    )
+    index = pd.MultiIndex.from_arrays(
+        [
+            np.repeat(np.arange(number_months), number_cells),
+            np.tile(lons, number_months),
+            np.tile(lats, number_months),
+        ],
+        names=["time", "TLONG", "TLAT"],
+    )
+    for science_name, variable in RAW_VARIABLES.items():
+        env_df = pd.DataFrame(
+            {science_name: variables[variable].transpose().reshape(-1)}, index=index
+        )
+        env_df.to_pickle(
+            full_path + os.sep + "nw_" + science_name + "_" + file_ending + ".pkl"
+        )
+
+
+def synthetic_parameter_dataframe(number_cells, number_months, seed=42):
+    """
+    Creates a synthetic growth rate in the format of the parameter
+    files written by postprocessing.grid
+    Arguments:
+        number_cells: the number of grid cells
+        number_months: the number of months
+        seed: the seed for the random number generator
+    Returns:
+        a dataframe with the cells as index and the months since war as columns
+    """
+    lats, lons = synthetic_coordinates(number_cells, seed)
+    variables = synthetic_variables(lats, number_months, seed)
+    growth = np.clip(np.exp(-0.01 * (variables["temperature"] - 27) ** 2), 0, 1)
+    parameter_df = pd.DataFrame(
+        growth.astype(float),
+        index=pd.MultiIndex.from_arrays([lats, lons]),
+        columns=pd.Index(range(-3, number_months - 3), name="months_since_war"),
+    )
+    return parameter_df
+
+
+def synthetic_areas(parameter_df):
+    """
+    Creates areas for the cells of a parameter dataframe in the format
+    of read_files.read_area_file
+    Arguments:
+        parameter_df: a dataframe with lat_lon tuples as index
+    Returns:
+        a dataframe with the index TLONG, TLAT and the column TAREA in km²
+    """
+    lats = parameter_df.index.get_level_values(0)
+    lons = parameter_df.index.get_level_values(1)
+    return pd.DataFrame(
+        {"TLONG": lons, "TLAT": lats, "TAREA": 12000 * np.cos(np.radians(lats))}
+    ).set_index(["TLONG", "TLAT"])
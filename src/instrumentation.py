@@ -0,0 +1,259 @@
+"""
+Instrumentation for long model runs. Every stage of a run (loading,
+calculating the factors, clustering, plotting, ...) records its wall time,
+CPU time, memory before and after the stage, peak memory during the stage,
+number of cells and throughput. The records are written as JSON lines
+to a metrics file. Optionally one chosen stage is
+profiled with cProfile and the profile is dumped to a file.
+
+The instrumentation is configured with configure() or with the
+environment variables SEAWEED_METRICS_FILE, SEAWEED_PROFILE_STAGE
+and SEAWEED_PROFILE_FILE.
+"""
+import cProfile
+import collections
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SETTINGS = {
+    "metrics_file": os.environ.get("SEAWEED_METRICS_FILE"),
+    "profile_stage": os.environ.get("SEAWEED_PROFILE_STAGE"),
+    "profile_file": os.environ.get("SEAWEED_PROFILE_FILE"),
+}
+
+# The number of records kept in memory, older ones are dropped,
+# so long runs do not grow. All records are in the metrics file
+MAX_RECORDS = 1000
+
+# The last records of the current process
+RECORDS = collections.deque(maxlen=MAX_RECORDS)
+
+# The seconds between two measurements of the memory, if the peak
+# has to be sampled because it cannot be reset
+SAMPLING_INTERVAL = 0.01
+
+# The running peaks of the stages that are open and measure the peak
+# of the process. Resetting the peak for a nested stage would lose the
+# peak of the outer stages, so it is added to their running peak first
+OPEN_PEAKS = []
+
+
+def configure(metrics_file=None, profile_stage=None, profile_file=None):
+    """
+    Configures where the metrics are written and which stage is profiled
+    Arguments:
+        metrics_file: the JSON lines file to append the records to,
+            if None the records are only kept in RECORDS
+        profile_stage: the name of the stage to profile with cProfile
+        profile_file: the file to dump the profile to, defaults to
+            the name of the stage with the ending .prof
+    Returns:
+        None
+    """
+    SETTINGS["metrics_file"] = metrics_file
+    SETTINGS["profile_stage"] = profile_stage
+    SETTINGS["profile_file"] = profile_file
+
+
+def memory_mb():
+    """
+    Gets the current resident set size of the process
+    Arguments:
+        None
+    Returns:
+        the memory in MB or None if it cannot be measured
+    """
+    try:
+        # Only available on Linux
+        with open("/proc/self/statm") as handle:
+            pages = int(handle.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def peak_memory_mb():
+    """
+    Gets the peak resident set size of the process since it was last reset
+    Arguments:
+        None
+    Returns:
+        the memory in MB or None if it cannot be measured
+    """
+    try:
+        # Only available on Linux
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    # The value is in KiB
+                    return int(line.split()[1]) * 1024 / 1e6
+    except (OSError, IndexError, ValueError):
+        return None
+    return None
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident set size of the process to the current one
+    Arguments:
+        None
+    Returns:
+        True if the peak was reset, False if it cannot be reset
+    """
+    current_peak = peak_memory_mb()
+    if current_peak is None:
+        return False
+    try:
+        # Only available on Linux and not allowed in every container
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+    except OSError:
+        return False
+    for running_peak in OPEN_PEAKS:
+        running_peak[0] = max(running_peak[0], current_peak)
+    return True
+
+
+class MemorySampler:
+    """
+    Samples the resident set size in a thread and keeps the largest value.
+    Used for the peak of a stage if the peak of the process cannot be reset.
+    Allocations that are freed between two samples are missed
+    """
+
+    def __init__(self, interval=SAMPLING_INTERVAL):
+        self.interval = interval
+        self.peak = memory_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        """
+        Measures the memory until the sampler is stopped
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        while not self.stopped.wait(self.interval):
+            self.update()
+
+    def update(self):
+        """
+        Measures the memory once and keeps it, if it is the largest
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        memory = memory_mb()
+        if memory is not None:
+            self.peak = max(self.peak, memory)
+
+    def stop(self):
+        """
+        Stops the sampling
+        Arguments:
+            None
+        Returns:
+            the peak memory in MB
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.update()
+        return self.peak
+
+
+@contextmanager
+def stage(name, cells=None, **info):
+    """
+    Records the metrics of a stage of a run. The record is yielded,
+    so the cell count and further information can be added inside the stage
+    Arguments:
+        name: the name of the stage
+        cells: the number of cells processed in the stage
+        info: further information to add to the record, e.g. the scenario
+    Returns:
+        None, but writes the record when the stage is done
+    """
+    record = {"stage": name, "cells": cells}
+    record.update(info)
+    profiler = None
+    if SETTINGS["profile_stage"] == name:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_memory = memory_mb()
+    running_peak = None
+    sampler = None
+    if reset_peak_memory():
+        running_peak = [peak_memory_mb()]
+        OPEN_PEAKS.append(running_peak)
+    elif start_memory is not None:
+        sampler = MemorySampler()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall_time"] = time.perf_counter() - start_wall
+        record["cpu_time"] = time.process_time() - start_cpu
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(SETTINGS["profile_file"] or name + ".prof")
+        record["memory_before_mb"] = start_memory
+        record["memory_after_mb"] = memory_mb()
+        record["peak_memory_mb"] = None
+        if running_peak is not None:
+            # Remove by identity, the peaks of two stages can be equal
+            OPEN_PEAKS[:] = [peak for peak in OPEN_PEAKS if peak is not running_peak]
+            peak = peak_memory_mb()
+            if peak is not None:
+                record["peak_memory_mb"] = max(running_peak[0], peak)
+        elif sampler is not None:
+            record["peak_memory_mb"] = sampler.stop()
+        if start_memory is not None and record["memory_after_mb"] is not None:
+            record["memory_change_mb"] = record["memory_after_mb"] - start_memory
+        if record["cells"] is not None and record["wall_time"] > 0:
+            record["cells_per_second"] = record["cells"] / record["wall_time"]
+        record["timestamp"] = datetime.datetime.now().isoformat(timespec="seconds")
+        write_record(record)
+
+
+def write_record(record):
+    """
+    Keeps the record and appends it to the metrics file, if one is configured
+    Arguments:
+        record: a dictionary with the metrics of a stage
+    Returns:
+        None
+    """
+    RECORDS.append(record)
+    if SETTINGS["metrics_file"] is not None:
+        with open(SETTINGS["metrics_file"], "a") as handle:
+            handle.write(json.dumps(record, default=str) + "\n")
+
+
+def instrumented(name):
+    """
+    Decorator that records a whole function as stage
+    Arguments:
+        name: the name of the stage
+    Returns:
+        the decorator
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,169 @@
+"""
+Turns the monthly growth rates of the model into biomass. The growth rate
+of the model is the fraction of the optimal growth rate the seaweed can
+reach, so the biomass grows every day by the optimal growth rate times the
+growth rate of the month. Optionally the seaweed is harvested whenever it
+reaches a harvest density, which leaves the initial density to regrow.
+
+All functions work on arrays of any shape with the months as last axis,
+e.g. (cell, month) or (scenario, cell, month). They only loop over the
+months, all cells are calculated at once.
+"""
+import numpy as np
+import pandas as pd
+
+# The optimal growth rate of the seaweed in percent per day
+OPTIMAL_GROWTH_RATE = 30
+
+# The model works in months, which are assumed to have the same length
+DAYS_PER_MONTH = 30
+
+
+def daily_log_growth(growth_rate, optimal_growth_rate=OPTIMAL_GROWTH_RATE):
+    """
+    Calculates the logarithm of the daily growth of the biomass, so the
+    growth over several days is a sum instead of a product
+    Arguments:
+        growth_rate: the growth rate of the model, as fraction of the optimal
+        optimal_growth_rate: the optimal growth rate in percent per day
+    Returns:
+        the logarithm of the factor the biomass grows by every day
+    """
+    return np.log1p(np.asarray(growth_rate) * optimal_growth_rate / 100)
+
+
+def biomass_trajectory(
+    growth_rate,
+    initial_density,
+    harvest_density=None,
+    optimal_growth_rate=OPTIMAL_GROWTH_RATE,
+    days_per_month=DAYS_PER_MONTH,
+):
+    """
+    Calculates the biomass at the end of every month, compounded daily.
+    If a harvest density is given, the seaweed is harvested every time it
+    reaches the harvest density and grows again from the initial density
+    Arguments:
+        growth_rate: array of the growth rate with the months as last axis
+        initial_density: the density the seaweed is planted with
+        harvest_density: the density at which the seaweed is harvested,
+            no harvest if None
+        optimal_growth_rate: the optimal growth rate in percent per day
+        days_per_month: the number of days of every month
+    Returns:
+        biomass: the density at the end of every month
+        harvest: the density harvested in every month, all zero without harvest
+    """
+    log_growth = daily_log_growth(growth_rate, optimal_growth_rate) * days_per_month
+    if harvest_density is None:
+        # Without harvest the growth of all months can simply be summed up
+        biomass = initial_density * np.exp(np.cumsum(log_growth, axis=-1))
+        return biomass, np.zeros_like(biomass)
+    assert harvest_density > initial_density, "Harvest has to be above planting"
+    daily_growth = log_growth / days_per_month
+    # The days it takes to grow from the initial to the harvest density
+    with np.errstate(divide="ignore"):
+        cycle = np.log(harvest_density / initial_density) / daily_growth
+    biomass = np.empty(log_growth.shape)
+    harvest = np.zeros(log_growth.shape)
+    density = np.full(log_growth.shape[:-1], float(initial_density))
+    for month in range(log_growth.shape[-1]):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            first_harvest = np.log(harvest_density / density) / daily_growth[..., month]
+            harvested = first_harvest <= days_per_month
+            # Every further harvest takes one cycle
+            number_of_harvests = np.where(
+                harvested,
+                1 + np.floor((days_per_month - first_harvest) / cycle[..., month]),
+                0,
+            )
+            last_harvest = first_harvest + (number_of_harvests - 1) * cycle[..., month]
+        density = np.where(
+            harvested,
+            initial_density
+            * np.exp(daily_growth[..., month] * (days_per_month - last_harvest)),
+            density * np.exp(log_growth[..., month]),
+        )
+        biomass[..., month] = density
+        harvest[..., month] = number_of_harvests * (harvest_density - initial_density)
+    return biomass, harvest
+
+
+def days_to_density(
+    growth_rate,
+    initial_density,
+    target_density,
+    optimal_growth_rate=OPTIMAL_GROWTH_RATE,
+    days_per_month=DAYS_PER_MONTH,
+):
+    """
+    Calculates the days it takes the seaweed to grow from
+    the initial density to the target density without harvest
+    Arguments:
+        growth_rate: array of the growth rate with the months as last axis
+        initial_density: the density the seaweed is planted with
+        target_density: the density to reach
+        optimal_growth_rate: the optimal growth rate in percent per day
+        days_per_month: the number of days of every month
+    Returns:
+        an array with the months axis removed, with the days to reach the
+        target density. Nan if it is not reached within the data
+    """
+    assert target_density > initial_density, "The target has to be above planting"
+    daily_growth = daily_log_growth(growth_rate, optimal_growth_rate)
+    needed = np.log(target_density / initial_density)
+    cumulative = np.cumsum(daily_growth * days_per_month, axis=-1)
+    reached = cumulative >= needed
+    # The first month in which the target is reached
+    month = np.argmax(reached, axis=-1)
+    month_index = month[..., np.newaxis]
+    # The growth up to the beginning of this month and the growth within it
+    before = np.take_along_axis(
+        cumulative - daily_growth * days_per_month, month_index, axis=-1
+    )[..., 0]
+    growth_in_month = np.take_along_axis(daily_growth, month_index, axis=-1)[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days = month * days_per_month + (needed - before) / growth_in_month
+    return np.where(reached.any(axis=-1), days, np.nan)
+
+
+def biomass_from_growth_df(
+    growth_df,
+    initial_density,
+    harvest_density=None,
+    target_density=None,
+    optimal_growth_rate=OPTIMAL_GROWTH_RATE,
+):
+    """
+    Calculates the biomass outputs for a growth rate dataframe
+    as saved by the postprocessing
+    Arguments:
+        growth_df: a dataframe with the cells as index and the
+            months since war as columns
+        initial_density: the density the seaweed is planted with
+        harvest_density: the density at which the seaweed is harvested
+        target_density: the density to calculate the days to, if None
+            the harvest density is used
+        optimal_growth_rate: the optimal growth rate in percent per day
+    Returns:
+        biomass_df: the density at the end of every month
+        harvest_df: the density harvested in every month
+        days: a series with the days to reach the target density per cell
+    """
+    biomass, harvest = biomass_trajectory(
+        growth_df.values, initial_density, harvest_density, optimal_growth_rate
+    )
+    biomass_df = pd.DataFrame(biomass, index=growth_df.index, columns=growth_df.columns)
+    harvest_df = pd.DataFrame(harvest, index=growth_df.index, columns=growth_df.columns)
+    if target_density is None:
+        target_density = harvest_density
+    days = None
+    if target_density is not None:
+        days = pd.Series(
+            days_to_density(
+                growth_df.values, initial_density, target_density, optimal_growth_rate
+            ),
+            index=growth_df.index,
+            name="days_to_target",
+        )
+    return biomass_df, harvest_df, days
@@ -0,0 +1,292 @@
+"""
+Out of core execution of the seaweed model with xarray and dask.
+The environmental data is represented as chunked xarray DataArrays
+in the time/TLAT/TLONG layout of the climate model output. The growth
+factors are calculated lazily chunk by chunk, in parallel on the local
+cores, and written to disk chunk by chunk. This way the memory needed
+is bounded by the size of the chunks and not by the size of the grid.
+"""
+import functools
+import os
+
+import dask
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.model import seaweed_growth as sg
+from src.model.validation import validate_arrays
+from src.processing import read_files
+from src.processing.read_files import FIRST_MONTH_SINCE_WAR
+
+# Names of the variables the model uses in the climate model output and in
+# the seaweed model, the other variables are never read
+RAW_VARIABLES = {
+    science_name: variable
+    for science_name, variable in read_files.RAW_VARIABLES.items()
+    if variable in read_files.MODEL_VARIABLES
+}
+
+
+def open_raw_dataset(files, chunks):
+    """
+    Lazily opens the netCDF files of the climate model output
+    Arguments:
+        files: a path with wildcards or a list of the netCDF files
+        chunks: a dictionary with the chunk size per dimension, e.g.
+            {"time": -1, "nlat": 64, "nlon": 64}
+    Returns:
+        a chunked xarray dataset with the variables named as in the seaweed model
+    """
+    data_set = xr.open_mfdataset(files, chunks=chunks)
+    data_set = data_set[list(RAW_VARIABLES.keys())].rename(RAW_VARIABLES)
+    return add_months_since_war(data_set)
+
+
+def dataset_from_pickles(
+    path, folder, scenario, file_ending, cells_per_chunk, cache_file=None
+):
+    """
+    Creates a chunked dataset from the pickled dataframes of the environmental
+    parameters, as they are also used by preprocessing.prepare_gridded_data.
+    As the pickles do not contain the nlat and nlon dimensions, all grid
+    cells are put along one cell dimension, with TLAT and TLONG as coordinates.
+    A pickle can only be read as a whole, so without a cache file all
+    variables are held in memory and only the calculation is chunked. With a
+    cache file, every variable is written to it right after it is read, so
+    only one variable is in memory at a time, and the dataset is read lazily
+    from the cache file
+    Arguments:
+        path: the path for the pickled files
+        folder: the folder where the pickled files are
+        scenario: the scenario to use (e.g. 150tg)
+        file_ending: the ending of the pickled files
+        cells_per_chunk: the number of grid cells in one chunk
+        cache_file: a netCDF file to write the variables to, or None
+            to keep them in memory
+    Returns:
+        a chunked xarray dataset with the dimensions time and cell
+    """
+    data_arrays = {}
+    has_data = None
+    cells = None
+    for science_name, variable in RAW_VARIABLES.items():
+        env_df = pd.read_pickle(
+            path
+            + os.sep
+            + "data"
+            + os.sep
+            + folder
+            + os.sep
+            + scenario
+            + os.sep
+            + "nw_"
+            + science_name
+            + "_"
+            + file_ending
+            + ".pkl"
+        )
+        # One row per month and one column per grid cell
+        env_df = env_df.iloc[:, 0].unstack(["TLAT", "TLONG"])
+        data_array = xr.DataArray(
+            env_df.values,
+            dims=["time", "cell"],
+            coords={
+                "time": env_df.index,
+                "TLAT": ("cell", env_df.columns.get_level_values("TLAT")),
+                "TLONG": ("cell", env_df.columns.get_level_values("TLONG")),
+            },
+            name=variable,
+        )
+        del env_df
+        # All variables have to have the same cells
+        if cells is None:
+            cells = (data_array["TLAT"].values, data_array["TLONG"].values)
+            has_data = np.ones(len(cells[0]), dtype=bool)
+        assert np.array_equal(cells[0], data_array["TLAT"].values) and (
+            np.array_equal(cells[1], data_array["TLONG"].values)
+        ), "{} has other cells than the other variables".format(variable)
+        # Cells without any data (e.g. land) can never produce a value,
+        # so they are dropped before they are chunked
+        has_data &= ~np.isnan(data_array.values).all(axis=0)
+        if cache_file is None:
+            data_arrays[variable] = data_array
+            continue
+        if variable == next(iter(RAW_VARIABLES.values())):
+            mode = "w"
+        else:
+            # The coordinates are already in the file
+            mode = "a"
+            data_array = data_array.drop_vars(["time", "TLAT", "TLONG"])
+        data_array.to_dataset().to_netcdf(
+            cache_file,
+            mode=mode,
+            encoding={
+                variable: {
+                    "chunksizes": (
+                        data_array.sizes["time"],
+                        min(cells_per_chunk, data_array.sizes["cell"]),
+                    )
+                }
+            },
+        )
+    if cache_file is None:
+        data_set = xr.Dataset(data_arrays)
+    else:
+        data_set = xr.open_dataset(cache_file, chunks={})
+    data_set = data_set.isel(cell=np.flatnonzero(has_data)).chunk(
+        {"time": -1, "cell": cells_per_chunk}
+    )
+    return add_months_since_war(data_set)
+
+
+def add_months_since_war(data_set):
+    """
+    Adds the months since the beginning of the nuclear war as coordinate
+    Arguments:
+        data_set: an xarray dataset with a time dimension
+    Returns:
+        the dataset with the coordinate months_since_war along time
+    """
+    return data_set.assign_coords(
+        months_since_war=(
+            "time",
+            np.arange(
+                FIRST_MONTH_SINCE_WAR, FIRST_MONTH_SINCE_WAR + data_set.sizes["time"]
+            ),
+        )
+    )
+
+
+def calculate_growth(data_set, dtype=float, policy="strict"):
+    """
+    Lazily calculates all factors and the growth rate. Nothing is computed
+    until the result is written or explicitly computed.
+    Arguments:
+        data_set: a chunked xarray dataset with the environmental variables
+        dtype: the floating point type to calculate in
+        policy: how to handle unreasonable values, see validation.validate_arrays.
+            With "strict" the error is raised when the chunk is computed
+    Returns:
+        a chunked xarray dataset with the factors and the growth rate
+    """
+    # Some of the nutrients go slightly below 0 due to the climate model
+    data_set = data_set.assign(
+        nitrate=data_set["nitrate"].clip(min=0),
+        ammonium=data_set["ammonium"].clip(min=0),
+        phosphate=data_set["phosphate"].clip(min=0),
+    )
+    data_set = validate_chunkwise(data_set, policy)
+    nitrate = data_set["nitrate"]
+    ammonium = data_set["ammonium"]
+    phosphate = data_set["phosphate"]
+    nutrients = xr.apply_ufunc(
+        functools.partial(sg.nutrient_array, dtype=dtype),
+        nitrate,
+        ammonium,
+        phosphate,
+        output_core_dims=[[], [], [], []],
+        dask="parallelized",
+        output_dtypes=[dtype, dtype, dtype, dtype],
+    )
+    factors = {
+        "salinity_factor": apply_chunkwise(
+            functools.partial(sg.salinity_array, dtype=dtype),
+            data_set["salinity"],
+            dtype=dtype,
+        ),
+        "nutrient_factor": nutrients[0],
+        "nitrate_subfactor": nutrients[1],
+        "ammonium_subfactor": nutrients[2],
+        "phosphate_subfactor": nutrients[3],
+        "illumination_factor": apply_chunkwise(
+            functools.partial(sg.illumination_array, dtype=dtype),
+            data_set["illumination"],
+            dtype=dtype,
+        ),
+        "temp_factor": apply_chunkwise(
+            functools.partial(sg.temperature_array, dtype=dtype),
+            data_set["temperature"],
+            dtype=dtype,
+        ),
+    }
+    factors["seaweed_growth_rate"] = apply_chunkwise(
+        sg.growth_factor_combination_array,
+        factors["illumination_factor"],
+        factors["temp_factor"],
+        factors["nutrient_factor"],
+        factors["salinity_factor"],
+        dtype=dtype,
+    )
+    return xr.Dataset(factors)
+
+
+def validate_chunkwise(data_set, policy):
+    """
+    Lazily validates every chunk of the environmental variables
+    Arguments:
+        data_set: a chunked xarray dataset with the environmental variables
+        policy: one of "strict", "clip" or "mask"
+    Returns:
+        the dataset with the policy applied to the unreasonable values
+    """
+    validated = {}
+    for variable in RAW_VARIABLES.values():
+        if variable not in data_set:
+            continue
+        validated[variable] = apply_chunkwise(
+            functools.partial(validate_chunk, variable=variable, policy=policy),
+            data_set[variable],
+            dtype=data_set[variable].dtype,
+        )
+    return data_set.assign(validated)
+
+
+def validate_chunk(values, variable, policy):
+    """
+    Validates one chunk of a variable
+    Arguments:
+        values: numpy array of the chunk
+        variable: the name of the variable
+        policy: one of "strict", "clip" or "mask"
+    Returns:
+        the chunk with the policy applied
+    """
+    return validate_arrays({variable: values}, policy)[0][variable]
+
+
+def apply_chunkwise(function, *data_arrays, dtype=float):
+    """
+    Applies one of the vectorized functions of seaweed_growth to every chunk
+    Arguments:
+        function: the function to apply
+        data_arrays: the data arrays to use as arguments
+        dtype: the floating point type of the result
+    Returns:
+        a lazy data array with the result
+    """
+    return xr.apply_ufunc(
+        function, *data_arrays, dask="parallelized", output_dtypes=[dtype]
+    )
+
+
+def run_chunked(data_set, output_file, num_workers=None, dtype=float, policy="strict"):
+    """
+    Calculates the factors and growth rate chunk by chunk and writes
+    them to a netCDF file. The chunks are processed in parallel
+    Arguments:
+        data_set: a chunked xarray dataset with the environmental variables
+        output_file: the netCDF file to write to
+        num_workers: the number of cores to use, all cores if None
+        dtype: the floating point type to calculate and store in
+        policy: how to handle unreasonable values, see calculate_growth
+    Returns:
+        None
+    """
+    growth = calculate_growth(data_set, dtype, policy)
+    # The time coordinate often consists of cftime objects, which netCDF
+    # can handle, but the months since war are more useful downstream
+    growth = growth.swap_dims({"time": "months_since_war"})
+    growth = growth.drop_vars("time", errors="ignore")
+    with dask.config.set(scheduler="threads", num_workers=num_workers):
+        growth.to_netcdf(output_file)
@@ -0,0 +1,212 @@
+"""
+Lookup tables for the factors that only depend on one environmental variable.
+The illumination, temperature and salinity factors are smooth functions of a
+bounded input, so they can be precomputed on a dense grid over the valid range
+and evaluated by linear interpolation between the two nearest table entries.
+This replaces the exp calls by an index calculation, which is faster for
+large sweeps over many scenarios or parameter sets.
+
+The tables are refined until the interpolation error, measured against the
+exact functions on a grid several times denser than the table, is below the
+requested maximum error. The achieved error is kept with every table.
+"""
+import fractions
+import functools
+import math
+
+import numpy as np
+import pandas as pd
+
+from src.model import seaweed_growth as sg
+from src.model.validation import VALID_RANGES
+
+# The exact functions of the factors that can be tabulated
+FACTOR_FUNCTIONS = {
+    "illumination": sg.illumination_array,
+    "temperature": sg.temperature_array,
+    "salinity": sg.salinity_array,
+}
+
+# The constants of the default parameters at which the exact functions
+# have kinks, where their pieces meet
+KINKS = {
+    "illumination": ["illumination_lower", "illumination_upper"],
+    "temperature": ["temperature_lower", "temperature_upper"],
+    "salinity": ["salinity_lower", "salinity_upper"],
+}
+
+
+def kink_distance(variable):
+    """
+    Finds the largest table step for which every kink of a factor is a
+    table entry, i.e. the greatest common divisor of the distances of the
+    kinks to the lower end of the valid range. The table steps are this
+    distance divided by powers of two, so the interpolation never crosses
+    a kink. The constants are read as decimals, e.g. 21.9 as 219/10
+    Arguments:
+        variable: the environmental variable of the factor
+    Returns:
+        the distance
+    """
+    lower = fractions.Fraction(str(VALID_RANGES[variable][0]))
+    distances = [
+        abs(fractions.Fraction(str(sg.DEFAULT_PARAMETERS[kink])) - lower)
+        for kink in KINKS[variable]
+    ]
+    # The greatest common divisor of two fractions a/b and c/d is
+    # gcd(a * d, c * b) / (b * d)
+    distance = functools.reduce(
+        lambda first, second: fractions.Fraction(
+            math.gcd(
+                first.numerator * second.denominator,
+                second.numerator * first.denominator,
+            ),
+            first.denominator * second.denominator,
+        ),
+        distances,
+    )
+    assert distance > 0, "The kinks of {} are at the lower end".format(variable)
+    return float(distance)
+
+
+# With the default parameters 21.9 for the illumination,
+# 2 for the temperature and 12 for the salinity
+KINK_DISTANCES = {variable: kink_distance(variable) for variable in FACTOR_FUNCTIONS}
+
+# The number of points the error is checked at between two table entries
+CHECK_POINTS = 16
+
+
+class FactorTable:
+    """
+    A table of a factor over the valid range of its variable,
+    evaluated by linear interpolation
+    """
+
+    def __init__(self, variable, max_error=1e-6):
+        assert variable in FACTOR_FUNCTIONS, "No factor function for {}".format(
+            variable
+        )
+        self.variable = variable
+        self.requested_error = max_error
+        self.lower, self.upper = VALID_RANGES[variable]
+        step = KINK_DISTANCES[variable]
+        # Halve the step of the table until the error is small enough
+        while True:
+            self.build(step)
+            self.max_error = self.measure_error()
+            if self.max_error <= max_error:
+                break
+            step /= 2
+
+    def build(self, step):
+        """
+        Calculates the table with the exact function. The table starts at
+        the lower end of the range and reaches at least to the upper end
+        Arguments:
+            step: the distance between two table entries
+        Returns:
+            None
+        """
+        self.step = step
+        self.size = int(np.ceil((self.upper - self.lower) / step)) + 1
+        self.values = FACTOR_FUNCTIONS[self.variable](
+            self.lower + step * np.arange(self.size)
+        )
+        # The slope to the next entry, so the lookup only needs one multiplication
+        self.slopes = np.append(np.diff(self.values), 0)
+
+    def measure_error(self):
+        """
+        Measures the largest interpolation error against the exact function.
+        The check points include the midpoints between the table entries,
+        where the error of the interpolation between two kinks is largest
+        Arguments:
+            None
+        Returns:
+            the largest absolute difference between table and exact function
+        """
+        check_values = self.lower + self.step / CHECK_POINTS * np.arange(
+            (self.size - 1) * CHECK_POINTS + 1
+        )
+        check_values = check_values[check_values <= self.upper]
+        exact = FACTOR_FUNCTIONS[self.variable](check_values)
+        return float(np.max(np.abs(self.lookup(check_values) - exact)))
+
+    def lookup(self, values, dtype=float):
+        """
+        Evaluates the factor for a whole array
+        Arguments:
+            values: numpy array of the variable, within the valid range
+            dtype: the floating point type to return
+        Returns:
+            the factor as a numpy array, nan where the values are nan
+        """
+        # The position in the table, calculated in place to save memory
+        position = np.subtract(values, self.lower, dtype=float)
+        position *= 1 / self.step
+        # Values outside the range are set to the edge of the table
+        np.clip(position, 0, self.size - 1, out=position)
+        # Nan positions get an arbitrary index, but stay nan in the result
+        with np.errstate(invalid="ignore"):
+            index = position.astype(np.intp)
+        np.clip(index, 0, self.size - 1, out=index)
+        position -= index
+        position *= self.slopes.take(index)
+        position += self.values.take(index)
+        return position.astype(dtype, copy=False)
+
+
+@functools.lru_cache(maxsize=None)
+def get_table(variable, max_error=1e-6):
+    """
+    Builds the table of a factor only once per process
+    Arguments:
+        variable: one of the keys of FACTOR_FUNCTIONS
+        max_error: the largest interpolation error allowed
+    Returns:
+        the FactorTable of the variable
+    """
+    return FactorTable(variable, max_error)
+
+
+def factor_array(variable, values, dtype=float, max_error=None):
+    """
+    Calculates a single variable factor for a whole array, either
+    exactly or with a lookup table
+    Arguments:
+        variable: one of the keys of FACTOR_FUNCTIONS
+        values: numpy array of the variable
+        dtype: the floating point type to calculate in
+        max_error: the largest interpolation error allowed. If None,
+            the exact function is used
+    Returns:
+        the factor as a numpy array
+    """
+    if max_error is None:
+        return FACTOR_FUNCTIONS[variable](values, dtype)
+    return get_table(variable, max_error).lookup(values, dtype)
+
+
+def error_report(max_error=1e-6):
+    """
+    Reports the size and the achieved error of all tables
+    Arguments:
+        max_error: the largest interpolation error allowed
+    Returns:
+        a dataframe with one row per variable and the columns size,
+        requested_error and max_error
+    """
+    report = {}
+    for variable in FACTOR_FUNCTIONS:
+        table = get_table(variable, max_error)
+        report[variable] = {
+            "size": table.size,
+            "requested_error": table.requested_error,
+            "max_error": table.max_error,
+        }
+    return pd.DataFrame.from_dict(report, orient="index")
+
+
+if __name__ == "__main__":
+    print(error_report())
@@ -0,0 +1,305 @@
+"""
+Monte Carlo propagation of the uncertainty of the environmental data.
+Every realization perturbs the input data with an error model per variable
+and calculates the growth rate. The realizations are calculated in batches
+of arrays with the axes (realization, cell, month) and are not stored. They
+are only added to a histogram of the growth rate of every cell and month,
+from which the quantiles are read at the end. The growth rate lies between
+0 and 1, so a histogram with a fixed number of bins gives the quantiles
+with an error of at most one bin width, regardless of the number of
+realizations.
+
+The cells are split into tasks, which run in a pool of processes on data
+in shared memory. Every task has its own random number generator, spawned
+from one seed, so the results only depend on the seed and the size of the
+tasks, not on the number of processes.
+
+Works for any data with the months as last axis, e.g. the (cell, month)
+arrays of DataGrid, the (lme, month) arrays of DataLME or the
+(scenario, cell, month) arrays of SeaweedEnsemble.
+"""
+import numpy as np
+
+from src.model import seaweed_growth as sg
+from src.model.validation import VALID_RANGES
+from src.shared_arrays import SharedArrays, parallel_map
+
+# The environmental variables the model needs
+VARIABLES = [
+    "salinity",
+    "temperature",
+    "nitrate",
+    "ammonium",
+    "phosphate",
+    "illumination",
+]
+
+# The error model of every variable, as the distribution and the scale of the
+# error. "normal" adds an error with the scale as standard deviation in the
+# unit of the variable. "lognormal" multiplies with an error whose logarithm
+# has the scale as standard deviation, which keeps concentrations positive.
+# The errors are drawn independently for every cell and month. Variables
+# without an error model are not perturbed
+DEFAULT_ERROR_MODELS = {
+    "temperature": ("normal", 0.5),
+    "illumination": ("lognormal", 0.1),
+    "nitrate": ("lognormal", 0.2),
+    "ammonium": ("lognormal", 0.2),
+    "phosphate": ("lognormal", 0.2),
+}
+
+QUANTILES = [0.05, 0.5, 0.95]
+
+
+def perturb(values, variable, error_model, size, rng, dtype=float):
+    """
+    Draws perturbed realizations of the values of a variable
+    Arguments:
+        values: numpy array of the variable
+        variable: the name of the variable
+        error_model: a tuple of the distribution and the scale of the error
+        size: the number of realizations
+        rng: the numpy random number generator
+        dtype: the floating point type to calculate in
+    Returns:
+        a numpy array with the realizations as first axis, clipped
+        to the valid range of the variable
+    """
+    distribution, scale = error_model
+    # Drawing in single precision is faster, if the calculation allows it
+    noise = rng.standard_normal((size,) + np.shape(values), dtype=np.dtype(dtype))
+    noise *= scale
+    if distribution == "normal":
+        noise += values
+    elif distribution == "lognormal":
+        np.exp(noise, out=noise)
+        noise *= values
+    else:
+        raise ValueError("Unknown error distribution {}".format(distribution))
+    lower, upper = VALID_RANGES[variable]
+    return np.clip(noise, lower, upper, out=noise)
+
+
+class GrowthRateHistogram:
+    """
+    Histogram of the growth rate of every cell and month, to which
+    realizations are added one batch at a time
+    """
+
+    def __init__(self, shape, bins=1000):
+        self.bins = bins
+        # The last bin counts the nan values, so they do not need to be
+        # removed before counting
+        self.counts = np.zeros(tuple(shape) + (bins + 1,), dtype=np.int64)
+        self.sums = np.zeros(shape)
+        # The position of the first bin of every value in the flat counts
+        self.offsets = np.arange(self.sums.size).reshape(shape) * (bins + 1)
+
+    def add(self, growth_rate):
+        """
+        Adds a batch of realizations. Nan values are not counted
+        Arguments:
+            growth_rate: numpy array with the realizations as first axis
+        Returns:
+            None
+        """
+        bin_number = np.clip(growth_rate * self.bins, 0, self.bins - 1)
+        np.nan_to_num(bin_number, copy=False, nan=self.bins)
+        bin_number = bin_number.astype(np.intp)
+        bin_number += self.offsets
+        # Only the bins of the values are touched, a bincount over all bins
+        # would allocate a second array of the size of the counts per batch.
+        # The counts are contiguous, so the flat view writes to them
+        np.add.at(self.counts.reshape(-1), bin_number.ravel(), 1)
+        self.sums += np.nansum(growth_rate, axis=0)
+
+    def mean(self):
+        """
+        Calculates the mean of all realizations
+        Arguments:
+            None
+        Returns:
+            numpy array of the mean, nan where there is no valid realization
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums / self.counts[..., :-1].sum(axis=-1)
+
+    def quantiles(self, quantiles):
+        """
+        Reads quantiles from the histogram, interpolated linearly within a bin
+        Arguments:
+            quantiles: a list of quantiles between 0 and 1
+        Returns:
+            numpy array with the quantiles as first axis,
+            nan where there is no valid realization
+        """
+        counts = self.counts[..., :-1]
+        cumulative = np.cumsum(counts, axis=-1)
+        total = cumulative[..., -1]
+        results = np.empty((len(quantiles),) + total.shape)
+        for number, quantile in enumerate(quantiles):
+            target = quantile * total
+            # The first bin in which the cumulative count reaches the target
+            bin_number = np.minimum(
+                (cumulative < target[..., np.newaxis]).sum(axis=-1), self.bins - 1
+            )
+            after = np.take_along_axis(cumulative, bin_number[..., np.newaxis], -1)
+            in_bin = np.take_along_axis(counts, bin_number[..., np.newaxis], -1)
+            before = after[..., 0] - in_bin[..., 0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                within = np.clip((target - before) / in_bin[..., 0], 0, 1)
+            results[number] = np.where(
+                total > 0, (bin_number + within) / self.bins, np.nan
+            )
+        return results
+
+
+def run_realizations(data, settings, seed_sequence):
+    """
+    Runs all realizations for a part of the data
+    Arguments:
+        data: a dictionary with one array per variable with the axes (cell, month)
+        settings: a dictionary with the realizations, error_models, quantiles,
+            batch_size, bins and dtype
+        seed_sequence: the numpy SeedSequence of this part
+    Returns:
+        quantiles: numpy array with the axes (quantile, cell, month)
+        mean: numpy array with the axes (cell, month)
+    """
+    rng = np.random.default_rng(seed_sequence)
+    dtype = settings["dtype"]
+    histogram = GrowthRateHistogram(data["illumination"].shape, settings["bins"])
+    realizations = settings["realizations"]
+    for start in range(0, realizations, settings["batch_size"]):
+        size = min(settings["batch_size"], realizations - start)
+        batch = {}
+        for variable in VARIABLES:
+            values = np.asarray(data[variable], dtype=dtype)
+            if variable in settings["error_models"]:
+                batch[variable] = perturb(
+                    values,
+                    variable,
+                    settings["error_models"][variable],
+                    size,
+                    rng,
+                    dtype,
+                )
+            else:
+                batch[variable] = values[np.newaxis]
+        growth_rate = sg.growth_factor_combination_array(
+            sg.illumination_array(batch["illumination"], dtype),
+            sg.temperature_array(batch["temperature"], dtype),
+            sg.nutrient_array(
+                batch["nitrate"], batch["ammonium"], batch["phosphate"], dtype
+            )[0],
+            sg.salinity_array(batch["salinity"], dtype),
+        )
+        histogram.add(np.broadcast_to(growth_rate, (size,) + histogram.sums.shape))
+    return histogram.quantiles(settings["quantiles"]), histogram.mean()
+
+
+def run_task(arrays, task):
+    """
+    Runs the realizations of a range of cells in a worker process
+    and writes the results to the shared output arrays
+    Arguments:
+        arrays: a dictionary with the shared arrays of the variables
+            and of the outputs quantiles and mean
+        task: a tuple of the first cell, the cell after the last cell,
+            the settings and the SeedSequence of the task
+    Returns:
+        None
+    """
+    start, stop, settings, seed_sequence = task
+    quantiles, mean = run_realizations(
+        {variable: arrays[variable][start:stop] for variable in VARIABLES},
+        settings,
+        seed_sequence,
+    )
+    arrays["quantiles"][:, start:stop] = quantiles
+    arrays["mean"][start:stop] = mean
+
+
+def monte_carlo_growth_rate(
+    data,
+    realizations=1000,
+    error_models=None,
+    quantiles=None,
+    seed=42,
+    batch_size=200,
+    cells_per_task=64,
+    bins=1000,
+    processes=1,
+    dtype=float,
+):
+    """
+    Calculates the distribution of the growth rate under the uncertainty
+    of the environmental data. Only the quantiles and the mean are kept,
+    so the memory needed does not grow with the number of realizations
+    Arguments:
+        data: a dictionary with one array per environmental variable, all
+            of the same shape with the months as last axis
+        realizations: the number of realizations
+        error_models: a dictionary with the error model of every variable
+            to perturb, DEFAULT_ERROR_MODELS if None
+        quantiles: the quantiles to calculate, QUANTILES if None
+        seed: the seed from which the random numbers of all tasks are spawned
+        batch_size: the number of realizations calculated at once
+        cells_per_task: the number of cells of every task. Together with
+            the seed it determines the random numbers
+        bins: the number of bins of the histograms, the quantiles
+            have an error of at most 1 / bins
+        processes: the number of worker processes, all cores if None
+        dtype: the floating point type to calculate in
+    Returns:
+        quantiles: numpy array with the quantiles as first axis
+            and the shape of the data after it
+        mean: numpy array of the mean with the shape of the data
+    """
+    settings = {
+        "realizations": realizations,
+        "error_models": DEFAULT_ERROR_MODELS if error_models is None else error_models,
+        "quantiles": QUANTILES if quantiles is None else list(quantiles),
+        "batch_size": batch_size,
+        "bins": bins,
+        "dtype": dtype,
+    }
+    unknown = set(settings["error_models"]) - set(VARIABLES)
+    assert not unknown, "No variables {}".format(sorted(unknown))
+    shape = np.shape(data["illumination"])
+    # All axes but the months are treated as cells
+    flat = {
+        variable: np.asarray(data[variable], dtype=dtype).reshape(-1, shape[-1])
+        for variable in VARIABLES
+    }
+    number_cells = len(flat["illumination"])
+    starts = list(range(0, number_cells, cells_per_task))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(starts))
+    tasks = [
+        (start, min(start + cells_per_task, number_cells), settings, seed_sequence)
+        for start, seed_sequence in zip(starts, seed_sequences)
+    ]
+    outputs = {
+        "quantiles": ((len(settings["quantiles"]), number_cells, shape[-1]), float),
+        "mean": ((number_cells, shape[-1]), float),
+    }
+    if processes == 1:
+        arrays = dict(flat)
+        arrays.update(
+            {
+                name: np.empty(*shape_and_type)
+                for name, shape_and_type in outputs.items()
+            }
+        )
+        for task in tasks:
+            run_task(arrays, task)
+        return (
+            arrays["quantiles"].reshape((-1,) + shape),
+            arrays["mean"].reshape(shape),
+        )
+    with SharedArrays(flat, outputs) as shared:
+        parallel_map(run_task, shared.handles, tasks, processes)
+        return (
+            shared.arrays["quantiles"].reshape((-1,) + shape).copy(),
+            shared.arrays["mean"].reshape(shape).copy(),
+        )
@@ -15,9 +15,17 @@ class OceanSection:
     and also saves the single factors for growth
     """
 
-    def __init__(self, name, data):
+    def __init__(self, name, data, months_since_war=None, dtype=float):
         # Add the name
         self.name = name
+        # The floating point type the factors are calculated in
+        self.dtype = dtype
+        # Add the months since war the data covers, if not given
+        # the data is assumed to start three months before the war
+        if months_since_war is None:
+            months_since_war = list(range(-3, data.shape[0] - 3, 1))
+        assert len(months_since_war) == data.shape[0]
+        self.months_since_war = months_since_war
         # Add the data
         self.salinity = data["salinity"]
         self.temperature = data["temperature"]
@@ -37,25 +45,32 @@ class OceanSection:
         # Add the dataframe
         self.section_df = None
 
-    def calculate_factors(self):
+    def calculate_factors(self, validate=True):
         """
         Calculates the factors and growth rate for the ocean section
         Arguments:
-            None
+            validate: if True, the data is checked for unreasonable values.
+                Can be False if the data was already validated
         Returns:
             None
         """
         # Calculate the factors
-        self.salinity_factor = sg.calculate_salinity_factor(self.salinity)
+        self.salinity_factor = sg.calculate_salinity_factor(
+            self.salinity, self.dtype, validate
+        )
         nutrients = sg.calculate_nutrient_factor(
-            self.nitrate, self.ammonium, self.phosphate
+            self.nitrate, self.ammonium, self.phosphate, self.dtype, validate
         )
         self.nutrient_factor = nutrients[0]
         self.nitrate_subfactor = nutrients[1]
         self.ammonium_subfactor = nutrients[2]
         self.phosphate_subfactor = nutrients[3]
-        self.illumination_factor = sg.calculate_illumination_factor(self.illumination)
-        self.temp_factor = sg.calculate_temperature_factor(self.temperature)
+        self.illumination_factor = sg.calculate_illumination_factor(
+            self.illumination, self.dtype, validate
+        )
+        self.temp_factor = sg.calculate_temperature_factor(
+            self.temperature, self.dtype, validate
+        )
 
     def calculate_growth_rate(self):
         """
@@ -109,7 +124,7 @@ class OceanSection:
             }
         )
         # Add a column with the month since war
-        section_df["months_since_war"] = list(range(-3, section_df.shape[0] - 3, 1))
+        section_df["months_since_war"] = self.months_since_war
         section_df.set_index("months_since_war", inplace=True)
         # Add the dataframe to the class
         section_df.columns.name = self.name
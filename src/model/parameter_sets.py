@@ -0,0 +1,177 @@
+"""
+Parameter sweeps over the empirical constants of the model. A parameter set
+is a dictionary with some or all of the constants of
+seaweed_growth.DEFAULT_PARAMETERS, the missing ones keep their default.
+Many sets are stacked to one column per constant and broadcast against the
+environmental data, so all sets are evaluated in vectorized passes over data
+that is only read once. A factor whose constants are the same in all sets
+is only calculated once and shared by all sets.
+"""
+import numpy as np
+import pandas as pd
+
+from src.model import seaweed_growth as sg
+
+# The constants every factor depends on
+FACTOR_CONSTANTS = {
+    "illumination_factor": ["illumination_lower", "illumination_upper"],
+    "temp_factor": ["kt1", "kt2", "temperature_lower", "temperature_upper"],
+    "salinity_factor": ["kS1", "kS2", "salinity_lower", "salinity_upper"],
+    "nutrient_factor": ["kno3", "knh4", "kpo4"],
+}
+
+# The ranges of the optimal conditions, the lower end has to be below the upper
+OPTIMAL_RANGES = [
+    ("illumination_lower", "illumination_upper"),
+    ("temperature_lower", "temperature_upper"),
+    ("salinity_lower", "salinity_upper"),
+]
+
+
+def stack_parameter_sets(parameter_sets):
+    """
+    Stacks parameter sets to one column per constant
+    Arguments:
+        parameter_sets: a list of dictionaries or a dataframe with
+            one row per set and the constants as columns
+    Returns:
+        a dataframe with one row per set and all constants as columns,
+        the constants that are not given have their default value
+    """
+    stacked = pd.DataFrame(parameter_sets)
+    unknown = set(stacked.columns) - set(sg.DEFAULT_PARAMETERS)
+    assert not unknown, "Unknown constants {}".format(sorted(unknown))
+    stacked = (
+        stacked.reindex(columns=list(sg.DEFAULT_PARAMETERS))
+        .fillna(sg.DEFAULT_PARAMETERS)
+        .astype(float)
+    )
+    assert len(stacked) > 0, "No parameter sets given"
+    for lower, upper in OPTIMAL_RANGES:
+        assert (stacked[lower] < stacked[upper]).all(), "{} has to be below {}".format(
+            lower, upper
+        )
+    return stacked
+
+
+def sample_parameter_sets(number_of_sets, relative_spread=0.1, names=None, seed=42):
+    """
+    Draws parameter sets with constants uniformly distributed around
+    their defaults, e.g. for an uncertainty analysis
+    Arguments:
+        number_of_sets: the number of parameter sets
+        relative_spread: the largest relative deviation from the default
+        names: the constants to vary, all if None
+        seed: the seed for the random number generator
+    Returns:
+        a dataframe with one row per set and the varied constants as columns
+    """
+    if names is None:
+        names = list(sg.DEFAULT_PARAMETERS)
+    rng = np.random.default_rng(seed)
+    defaults = np.array([sg.DEFAULT_PARAMETERS[name] for name in names], dtype=float)
+    deviations = rng.uniform(
+        -relative_spread, relative_spread, (number_of_sets, len(names))
+    )
+    return pd.DataFrame(defaults * (1 + deviations), columns=names)
+
+
+def broadcast_constants(stacked, names, ndim):
+    """
+    Shapes the constants of a factor so they broadcast against the data
+    Arguments:
+        stacked: the stacked parameter sets
+        names: the names of the constants of the factor
+        ndim: the number of dimensions of the data
+    Returns:
+        a dictionary of the constants, as float if it is the same in all
+        sets and as array with the shape (set, 1, ..., 1) otherwise
+    """
+    constants = {}
+    for name in names:
+        values = stacked[name].values
+        if (values == values[0]).all():
+            constants[name] = values[0]
+        else:
+            constants[name] = values.reshape((-1,) + (1,) * ndim)
+    return constants
+
+
+def sweep_factors(data, stacked, dtype=float):
+    """
+    Calculates all factors for several parameter sets at once
+    Arguments:
+        data: a dictionary with one array per environmental variable,
+            all of the same shape, e.g. (cell, month)
+        stacked: the stacked parameter sets
+        dtype: the floating point type to calculate in
+    Returns:
+        a dictionary with one array per factor, with the sets as first
+        axis if the constants of the factor differ between the sets
+    """
+    ndim = np.ndim(data["illumination"])
+
+    def constants(factor):
+        return broadcast_constants(stacked, FACTOR_CONSTANTS[factor], ndim)
+
+    nutrients = sg.nutrient_array(
+        data["nitrate"],
+        data["ammonium"],
+        data["phosphate"],
+        dtype,
+        constants("nutrient_factor"),
+    )
+    return {
+        "salinity_factor": sg.salinity_array(
+            data["salinity"], dtype, constants("salinity_factor")
+        ),
+        "nutrient_factor": nutrients[0],
+        "nitrate_subfactor": nutrients[1],
+        "ammonium_subfactor": nutrients[2],
+        "phosphate_subfactor": nutrients[3],
+        "illumination_factor": sg.illumination_array(
+            data["illumination"], dtype, constants("illumination_factor")
+        ),
+        "temp_factor": sg.temperature_array(
+            data["temperature"], dtype, constants("temp_factor")
+        ),
+    }
+
+
+def sweep_growth_rate(
+    data, parameter_sets, dtype=float, sets_per_chunk=16, reduce=None
+):
+    """
+    Calculates the growth rate for many parameter sets. The sets are
+    evaluated in chunks, so at most sets_per_chunk growth rates of the
+    size of the data are held in memory at once
+    Arguments:
+        data: a dictionary with one array per environmental variable,
+            all of the same shape, e.g. (cell, month)
+        parameter_sets: a list of dictionaries or a dataframe with
+            one row per set and the constants as columns
+        dtype: the floating point type to calculate in
+        sets_per_chunk: the number of sets evaluated at once
+        reduce: a function that is applied to the growth rate of every chunk,
+            which has the sets as first axis, e.g. to average over the cells.
+            It has to keep the first axis. If None, the growth rate is returned
+    Returns:
+        a numpy array with the sets as first axis, with the growth rate with
+        the shape of the data or the result of reduce
+    """
+    stacked = stack_parameter_sets(parameter_sets)
+    shape = np.shape(data["illumination"])
+    results = []
+    for start in range(0, len(stacked), sets_per_chunk):
+        chunk = stacked.iloc[start : start + sets_per_chunk]
+        factors = sweep_factors(data, chunk, dtype)
+        growth_rate = sg.growth_factor_combination_array(
+            factors["illumination_factor"],
+            factors["temp_factor"],
+            factors["nutrient_factor"],
+            factors["salinity_factor"],
+        )
+        # If no constant differs within the chunk, there is no set axis yet
+        growth_rate = np.broadcast_to(growth_rate, (len(chunk),) + shape)
+        results.append(growth_rate if reduce is None else reduce(growth_rate))
+    return np.concatenate(results)
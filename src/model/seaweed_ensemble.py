@@ -0,0 +1,457 @@
+"""
+File contains the class SeaweedEnsemble, which evaluates the seaweed model
+for several nuclear war scenarios at once. All scenarios share the same
+grid and the same area weights, so those only have to be read and joined
+once. The data is stored as numpy arrays with the axes (scenario, cell, month).
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.model import biomass as bm
+from src.model import lookup_tables, monte_carlo, parameter_sets
+from src.model import seaweed_growth as sg
+from src.model.validation import validate_arrays
+from src.processing import read_files, results_store
+from src.processing.grid_index import GridIndex
+from src.shared_arrays import SharedArrays, parallel_map
+from src.utilities import weighted_quantile_array
+
+# The environmental variables the model needs
+VARIABLES = [
+    "salinity",
+    "temperature",
+    "nitrate",
+    "ammonium",
+    "phosphate",
+    "illumination",
+]
+
+# The factors calculated from the environmental variables
+FACTORS = [
+    "salinity_factor",
+    "nutrient_factor",
+    "nitrate_subfactor",
+    "ammonium_subfactor",
+    "phosphate_subfactor",
+    "illumination_factor",
+    "temp_factor",
+]
+
+
+def calculate_factor_arrays(data, dtype=float, lookup_error=None):
+    """
+    Calculates all factors from the environmental data
+    Arguments:
+        data: a dictionary with one array per environmental variable
+        dtype: the floating point type to calculate in
+        lookup_error: if given, the single variable factors are looked up
+            in tables with at most this interpolation error
+    Returns:
+        a dictionary with one array per factor
+    """
+    nutrients = sg.nutrient_array(
+        data["nitrate"], data["ammonium"], data["phosphate"], dtype
+    )
+    return {
+        "salinity_factor": lookup_tables.factor_array(
+            "salinity", data["salinity"], dtype, lookup_error
+        ),
+        "nutrient_factor": nutrients[0],
+        "nitrate_subfactor": nutrients[1],
+        "ammonium_subfactor": nutrients[2],
+        "phosphate_subfactor": nutrients[3],
+        "illumination_factor": lookup_tables.factor_array(
+            "illumination", data["illumination"], dtype, lookup_error
+        ),
+        "temp_factor": lookup_tables.factor_array(
+            "temperature", data["temperature"], dtype, lookup_error
+        ),
+    }
+
+
+def calculate_factors_for_cells(arrays, task):
+    """
+    Calculates the factors of a range of cells in a worker process
+    and writes them to the shared factor arrays
+    Arguments:
+        arrays: a dictionary with the shared arrays of the
+            environmental variables and the factors
+        task: a tuple of the first cell, the cell after the last cell,
+            the floating point type and the error of the lookup tables
+    Returns:
+        None
+    """
+    start, stop, dtype, lookup_error = task
+    factors = calculate_factor_arrays(
+        {variable: arrays[variable][:, start:stop] for variable in VARIABLES},
+        dtype,
+        lookup_error,
+    )
+    for factor, values in factors.items():
+        arrays[factor][:, start:stop] = values
+
+
+class SeaweedEnsemble:
+    """
+    Wrapper class that evaluates the model for several
+    scenarios on a shared grid. Cross scenario statistics
+    are reductions over the scenario axis.
+    """
+
+    def __init__(self, dtype=float, lookup_error=None):
+        # The floating point type the factors are calculated in
+        self.dtype = dtype
+        # If given, the illumination, temperature and salinity factors are
+        # looked up in tables with at most this error, which is faster
+        self.lookup_error = lookup_error
+        self.scenarios = []
+        self.grid_index = None
+        self.months_since_war = None
+        self.areas = None
+        # Environmental data, one array per variable
+        self.data = {}
+        # Factors and growth rate, one array per parameter
+        self.parameters = {}
+        # The location of all unreasonable values in the data
+        self.validation_report = None
+        # All grid cells, including the ones dropped as they have no data
+        self.full_grid = []
+        # The days to reach the target density, with the axes (scenario, cell)
+        self.days_to_target = None
+
+    def add_data_by_grid(
+        self, files, bbox=None, cell_ids=None, polygon=None, months=None
+    ):
+        """
+        Adds the gridded data of all scenarios to the ensemble.
+        Cells that have no data in any of the scenarios are dropped.
+        Arguments:
+            files: a dictionary with the scenario names as keys and the files
+                with the gridded data as values
+            bbox: a tuple of (lat_min, lat_max, lon_min, lon_max)
+            cell_ids: a list of lat_lon tuples
+            polygon: a shapely (multi)polygon with longitudes from -180 to 180
+            months: None for all months, an iterable of months since war
+                or a boolean mask with one entry per month
+        Returns:
+            None
+        """
+        # Make sure that the ensemble is empty
+        assert self.grid_index is None
+        scenario_arrays = []
+        for scenario, file in files.items():
+            # Cells are only dropped if they have no data in all scenarios,
+            # so all scenarios keep the same grid
+            data_grid = read_files.DataGrid(
+                file, bbox, cell_ids, polygon, months, drop_missing=False
+            )
+            self.set_grid(
+                scenario, data_grid.grid_index.lat_lons, data_grid.months_since_war
+            )
+            # Use the cell order of the shared grid
+            data_grid.grid_index = self.grid_index
+            scenario_arrays.append(data_grid.provide_data_arrays(VARIABLES))
+        self.data = {
+            variable: np.stack([arrays[variable] for arrays in scenario_arrays])
+            for variable in VARIABLES
+        }
+        self.drop_cells_without_data()
+
+    def drop_cells_without_data(self):
+        """
+        Drops the cells where a variable is missing in all months of all
+        scenarios, as those can never have a growth rate
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        self.full_grid = list(self.grid_index.lat_lons)
+        without_data = np.zeros(len(self.full_grid), dtype=bool)
+        for variable in VARIABLES:
+            # A scenario without any value of a variable has no growth rate
+            without_data |= np.isnan(self.data[variable]).all(axis=2).all(axis=0)
+        if not without_data.any():
+            return
+        for variable in VARIABLES:
+            self.data[variable] = self.data[variable][:, ~without_data]
+        self.grid_index = GridIndex(
+            [lat_lon for lat_lon, drop in zip(self.full_grid, without_data) if not drop]
+        )
+
+    def add_parameter_by_scenario(self, parameter, files):
+        """
+        Adds an already calculated parameter of all scenarios to the ensemble.
+        The files are the results files written by the postprocessing, or
+        pickled dataframes with the cells as index and the months since
+        war as columns
+        Arguments:
+            parameter: the name of the parameter (e.g. seaweed_growth_rate)
+            files: a dictionary with the scenario names as keys and the
+                results files or pickled dataframes as values
+        Returns:
+            None
+        """
+        scenario_arrays = []
+        for scenario, file in files.items():
+            if os.path.splitext(file)[1] == ".nc":
+                # Only the parameter is read from the results file
+                parameter_df = results_store.read_parameter(file, parameter)
+            else:
+                parameter_df = pd.read_pickle(file)
+            parameter_df = parameter_df.drop(columns="cluster", errors="ignore")
+            if scenario not in self.scenarios:
+                self.set_grid(
+                    scenario, list(parameter_df.index), list(parameter_df.columns)
+                )
+            assert list(parameter_df.columns) == self.months_since_war
+            # Use the cell order of the shared grid
+            scenario_arrays.append(
+                parameter_df.loc[self.grid_index.lat_lons].values.astype(
+                    self.dtype, copy=False
+                )
+            )
+        assert (
+            list(files.keys()) == self.scenarios
+        ), "The scenarios have to be in the same order"
+        self.parameters[parameter] = np.stack(scenario_arrays)
+
+    def set_grid(self, scenario, lat_lons, months_since_war):
+        """
+        Adds a scenario and makes sure it has the same grid as the others
+        Arguments:
+            scenario: the name of the scenario
+            lat_lons: the cells of the scenario
+            months_since_war: the months of the scenario
+        Returns:
+            None
+        """
+        if self.grid_index is None:
+            self.grid_index = GridIndex(lat_lons)
+            self.months_since_war = list(months_since_war)
+        else:
+            assert set(lat_lons) == set(
+                self.grid_index.lat_lons
+            ), "Scenario {} has a different grid".format(scenario)
+            assert list(months_since_war) == self.months_since_war
+        self.scenarios.append(scenario)
+
+    def add_areas(self, areas):
+        """
+        Adds the area of every grid cell. This is only done once for all scenarios.
+        Arguments:
+            areas: a dataframe with the index TLONG, TLAT and the column TAREA
+                as read by read_files.read_area_file
+        Returns:
+            None
+        """
+        # Cells without an area get nan and are left out of weighted statistics
+        self.areas = read_files.match_areas(areas, self.grid_index.lat_lons)
+
+    def calculate_factors(self, policy="strict", processes=None):
+        """
+        Calculates the growth factors for all scenarios in one pass.
+        The data is validated beforehand, the location of all unreasonable
+        values is saved in self.validation_report
+        Arguments:
+            policy: "strict" raises a ValidationError for unreasonable values,
+                "clip" sets them to the closest reasonable value and
+                "mask" sets them to nan
+            processes: if more than 1, the cells are split between this many
+                worker processes, which share the data instead of copying it
+        Returns:
+            None
+        """
+        self.data, self.validation_report = validate_arrays(
+            self.data,
+            policy,
+            [
+                ("scenario", self.scenarios),
+                ("cell", self.grid_index.lat_lons),
+                ("months_since_war", self.months_since_war),
+            ],
+        )
+        if processes is None or processes == 1:
+            self.parameters.update(
+                calculate_factor_arrays(self.data, self.dtype, self.lookup_error)
+            )
+            return
+        # The workers read the data from shared memory and write the
+        # factors of their cells to shared memory, so no worker gets a copy
+        shape = self.data[VARIABLES[0]].shape
+        with SharedArrays(
+            self.data,
+            {factor: (shape, self.dtype) for factor in FACTORS},
+        ) as shared:
+            cells = np.array_split(np.arange(shape[1]), processes)
+            parallel_map(
+                calculate_factors_for_cells,
+                shared.handles,
+                [
+                    (cell[0], cell[-1] + 1, self.dtype, self.lookup_error)
+                    for cell in cells
+                    if len(cell)
+                ],
+                processes,
+            )
+            for factor in FACTORS:
+                self.parameters[factor] = shared.arrays[factor].copy()
+
+    def calculate_growth_rate(self):
+        """
+        Calculates the growth rate for all scenarios in one pass
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        self.parameters["seaweed_growth_rate"] = sg.growth_factor_combination_array(
+            self.parameters["illumination_factor"],
+            self.parameters["temp_factor"],
+            self.parameters["nutrient_factor"],
+            self.parameters["salinity_factor"],
+        )
+
+    def sweep_growth_rate(self, sets, sets_per_chunk=16, reduce=None):
+        """
+        Calculates the growth rate of all scenarios for many sets of the
+        empirical constants, without reading the data again
+        Arguments:
+            sets: a list of dictionaries or a dataframe with one row per
+                parameter set, see src/model/parameter_sets.py
+            sets_per_chunk: the number of sets evaluated at once
+            reduce: a function applied to the growth rate of every chunk, which
+                has the axes (set, scenario, cell, month). If None, the growth
+                rate is returned
+        Returns:
+            a numpy array with the growth rate with the axes (set, scenario,
+            cell, month) or the result of reduce with the sets as first axis
+        """
+        assert self.data, "Add data before sweeping over parameter sets"
+        return parameter_sets.sweep_growth_rate(
+            self.data, sets, self.dtype, sets_per_chunk, reduce
+        )
+
+    def monte_carlo(
+        self, realizations=1000, error_models=None, quantiles=None, processes=1
+    ):
+        """
+        Calculates the distribution of the growth rate of all scenarios
+        under the uncertainty of the environmental data, see
+        src/model/monte_carlo.py. The realizations are not stored
+        Arguments:
+            realizations: the number of realizations
+            error_models: a dictionary with the error model of every variable
+                to perturb, monte_carlo.DEFAULT_ERROR_MODELS if None
+            quantiles: the quantiles to calculate, monte_carlo.QUANTILES if None
+            processes: the number of worker processes, all cores if None
+        Returns:
+            quantiles: numpy array with the axes (quantile, scenario, cell, month)
+            mean: numpy array with the axes (scenario, cell, month)
+        """
+        assert self.data, "Add data before running the Monte Carlo simulation"
+        return monte_carlo.monte_carlo_growth_rate(
+            self.data,
+            realizations,
+            error_models,
+            quantiles,
+            processes=processes,
+            dtype=self.dtype,
+        )
+
+    def calculate_biomass(
+        self,
+        initial_density,
+        harvest_density=None,
+        target_density=None,
+        optimal_growth_rate=bm.OPTIMAL_GROWTH_RATE,
+    ):
+        """
+        Calculates the biomass of all scenarios and cells from the growth rate,
+        compounded daily. The biomass and harvest are added to the parameters,
+        the days to reach the target density are saved in self.days_to_target
+        Arguments:
+            initial_density: the density the seaweed is planted with
+            harvest_density: the density at which the seaweed is harvested,
+                no harvest if None
+            target_density: the density to calculate the days to, if None
+                the harvest density is used
+            optimal_growth_rate: the optimal growth rate in percent per day
+        Returns:
+            None
+        """
+        growth_rate = self.parameters["seaweed_growth_rate"]
+        biomass, harvest = bm.biomass_trajectory(
+            growth_rate, initial_density, harvest_density, optimal_growth_rate
+        )
+        self.parameters["biomass"] = biomass
+        self.parameters["harvest"] = harvest
+        if target_density is None:
+            target_density = harvest_density
+        if target_density is not None:
+            self.days_to_target = bm.days_to_density(
+                growth_rate, initial_density, target_density, optimal_growth_rate
+            )
+
+    def construct_df_for_parameter(self, parameter, scenario):
+        """
+        Constructs a dataframe for one parameter and scenario, in the same
+        shape as the files written by the postprocessing
+        Arguments:
+            parameter: the parameter to construct the dataframe for
+            scenario: the scenario to construct the dataframe for
+        Returns:
+            a dataframe with the cells as index and the months since war as columns
+        """
+        parameter_df = pd.DataFrame(
+            self.parameters[parameter][self.scenarios.index(scenario)],
+            index=pd.MultiIndex.from_tuples(self.grid_index.lat_lons),
+            columns=self.months_since_war,
+        )
+        parameter_df.columns.name = "months_since_war"
+        return parameter_df
+
+    def weighted_quantile(self, parameter, quantile, cells=None):
+        """
+        Calculates the area weighted quantile over all cells for every
+        scenario and month. Cells without an area are left out.
+        Arguments:
+            parameter: the parameter to calculate the quantile for
+            quantile: the quantile to calculate
+            cells: an optional boolean mask of the cells to use
+        Returns:
+            a dataframe with the months since war as index
+            and the scenarios as columns
+        """
+        assert self.areas is not None, "The areas have to be added first"
+        use_cells = ~np.isnan(self.areas)
+        if cells is not None:
+            use_cells &= cells
+        quantiles = weighted_quantile_array(
+            self.parameters[parameter][:, use_cells, :],
+            self.areas[use_cells],
+            quantile,
+            axis=1,
+        )
+        return pd.DataFrame(
+            quantiles.transpose(), index=self.months_since_war, columns=self.scenarios
+        )
+
+    def scenario_statistic(self, parameter, statistic):
+        """
+        Reduces a parameter over the scenario axis
+        Arguments:
+            parameter: the parameter to reduce
+            statistic: one of "mean", "median", "min", "max" or "std"
+        Returns:
+            a dataframe with the cells as index and the months since war as columns
+        """
+        assert statistic in ["mean", "median", "min", "max", "std"]
+        reduced = getattr(np, "nan" + statistic)(self.parameters[parameter], axis=0)
+        return pd.DataFrame(
+            reduced,
+            index=pd.MultiIndex.from_tuples(self.grid_index.lat_lons),
+            columns=self.months_since_war,
+        )
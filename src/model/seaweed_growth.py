@@ -2,11 +2,28 @@
 Contains all functions needed to calculate the growth of
 seaweed.
 
-The calculation for each factor is split into two functions.
+The calculation for each factor is split into three functions.
 The first function with "single_value" in the name calculates
-the factor for a single value. While the second function with
-"calculate" in the name calculates the factor for a whole pandas series,
-for which it uses the first function.
+the factor for a single value. The second function with "array"
+in the name calculates the factor for a whole numpy array of any shape
+in one vectorized pass. The third function with "calculate" in the name
+calculates the factor for a whole pandas series, for which it uses the
+array function.
+
+The array functions do not check their input, so they can be used in the
+hot path. The input is meant to be checked once beforehand with
+src/model/validation.py. The series functions check their input, unless
+they are called with validate=False.
+
+The array and series functions compute in double precision by default.
+They can also compute in single precision by passing dtype=np.float32,
+which halves the memory needed. See src/processing/precision_report.py
+for the deviation this causes.
+
+The empirical constants of the model are collected in DEFAULT_PARAMETERS.
+The array functions take an optional parameter set, whose constants can
+also be arrays, e.g. with the shape (set, 1, 1) to evaluate many parameter
+sets at once by broadcasting. See src/model/parameter_sets.py.
 
 The actual based is based on the publication:
 James, S.C. and Boriah, V. (2010), Modeling algae growth
@@ -21,6 +38,53 @@ import math
 import numpy as np
 import pandas as pd
 
+from src.model.validation import VALID_RANGES, validate_arrays
+
+# The empirical constants of James and Boriah (2010)
+DEFAULT_PARAMETERS = {
+    # Below the lower illumination in W/m² the seaweed is limited by light,
+    # above the upper illumination it is inhibited by too much light
+    "illumination_lower": 21.9,
+    "illumination_upper": 109.5,
+    # The range of the optimal temperature in °C and how fast the growth drops
+    # below (kt1) and above (kt2) it in °C⁻². The coefficients were determined
+    # by fitting the factor such that g(15°C) = 0.25 and g(36°C) = 0.1
+    "temperature_lower": 24,
+    "temperature_upper": 30,
+    "kt1": 0.017,
+    "kt2": 0.064,
+    # The range of the optimal salinity in ppt and how fast the growth
+    # drops below (kS1) and above (kS2) it in ppt⁻²
+    "salinity_lower": 24,
+    "salinity_upper": 36,
+    "kS1": 0.007,
+    "kS2": 0.063,
+    # The half saturation constants of the nutrients in mmol/m³
+    "kno3": 0.4,
+    "knh4": 0.3,
+    "kpo4": 0.1,
+}
+
+
+def get_constants(parameters, names, dtype=float):
+    """
+    Gets constants from a parameter set, in the floating point type of the
+    calculation. Constants that are not in the set have their default value
+    Arguments:
+        parameters: a dictionary of constants, which can be floats or arrays.
+            If None, DEFAULT_PARAMETERS is used
+        names: the names of the constants
+        dtype: the floating point type to calculate in
+    Returns:
+        a list of the constants as numpy arrays
+    """
+    if parameters is None:
+        parameters = DEFAULT_PARAMETERS
+    return [
+        np.asarray(parameters.get(name, DEFAULT_PARAMETERS[name]), dtype=dtype)
+        for name in names
+    ]
+
 
 def growth_factor_combination_single_value(
     illumination_factor: float,
@@ -77,27 +141,36 @@ def growth_factor_combination(
     Returns:
         fraction of the actual production rate the seaweed could
     """
-    factors_combined_df = pd.concat(
-        [illumination_factor, temperature_factor, nutrient_factor, salinity_factor],
-        axis=1,
+    growth_factor = growth_factor_combination_array(
+        illumination_factor.values,
+        temperature_factor.values,
+        nutrient_factor.values,
+        salinity_factor.values,
+    )
+    return pd.Series(
+        growth_factor, index=illumination_factor.index, name="growth_factor_combination"
     )
-    factors_combined_df.columns = [
-        "illumination_factor",
-        "temperature_factor",
-        "nutrient_factor",
-        "salinity_factor",
-    ]  # Rename the columns
 
-    factors_combined_df["growth_factor_combination"] = factors_combined_df.apply(
-        lambda x: growth_factor_combination_single_value(
-            x["illumination_factor"],
-            x["temperature_factor"],
-            x["nutrient_factor"],
-            x["salinity_factor"],
-        ),
-        axis=1,
-    )  # Calculate the growth factor combination
-    return pd.Series(factors_combined_df["growth_factor_combination"])
+
+def growth_factor_combination_array(
+    illumination_factor: np.ndarray,
+    temperature_factor: np.ndarray,
+    nutrient_factor: np.ndarray,
+    salinity_factor: np.ndarray,
+):
+    """
+    Calculates the actual production rate of the seaweed for whole arrays
+    of factors. All arrays need to have the same shape
+    Arguments:
+        illumination_factor: the illumination factor
+        temperature_factor: the temperature factor
+        nutrient_factor: the nutrient factor
+        salinity_factor: the salinity factor
+    Returns:
+        numpy array of the fraction of the actual production rate the seaweed could
+        reach in optimal circumstances, nan where any of the factors is nan
+    """
+    return illumination_factor * temperature_factor * nutrient_factor * salinity_factor
 
 
 def illumination_single_value(illumination: float):
@@ -112,27 +185,65 @@ def illumination_single_value(illumination: float):
     if np.isnan(illumination):
         return np.nan
     # Make sure the values are in a reasonable range
-    # 1361 is the maximum illumination that reaches the atmosphere
-    assert 0 <= illumination <= 1361, "illumination has the value {}".format(
+    lower, upper = VALID_RANGES["illumination"]
+    assert lower <= illumination <= upper, "illumination has the value {}".format(
         illumination
     )
-    if illumination < 21.9:
-        return (illumination / 21.9) * math.exp(1 - (illumination / 21.9))
-    elif illumination > 109.5:
-        return 109.5 / illumination
+    lower = DEFAULT_PARAMETERS["illumination_lower"]
+    upper = DEFAULT_PARAMETERS["illumination_upper"]
+    if illumination < lower:
+        return (illumination / lower) * math.exp(1 - (illumination / lower))
+    elif illumination > upper:
+        return upper / illumination
     else:
         return 1
 
 
-def calculate_illumination_factor(illumination: pd.Series):
+def calculate_illumination_factor(
+    illumination: pd.Series, dtype=float, validate: bool = True
+):
     """
     Calculates the illumination factor for a whole series
     Arguments:
         illumination: the illumination of the algae in W/m²
+        dtype: the floating point type to calculate in
+        validate: if True, raises a ValidationError for unreasonable values
     Returns:
         The illumination factor as a pandas series
     """
-    return pd.Series(illumination.apply(illumination_single_value))
+    if validate:
+        validate_arrays({"illumination": illumination.values})
+    return pd.Series(
+        illumination_array(illumination.values, dtype),
+        index=illumination.index,
+        name=illumination.name,
+    )
+
+
+def illumination_array(illumination: np.ndarray, dtype=float, parameters=None):
+    """
+    Calculates the illumination factor for a whole array
+    Arguments:
+        illumination: the illumination of the algae in W/m²
+        dtype: the floating point type to calculate in
+        parameters: a parameter set, DEFAULT_PARAMETERS if None
+    Returns:
+        The illumination factor as a numpy array, nan where the illumination is nan
+    """
+    illumination = np.asarray(illumination, dtype=dtype)
+    lower, upper = get_constants(
+        parameters, ["illumination_lower", "illumination_upper"], dtype
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.where(
+            illumination < lower,
+            (illumination / lower) * np.exp(1 - (illumination / lower)),
+            np.where(illumination > upper, upper / illumination, 1),
+        )
+    # The maximum of the curve is 1, but rounding in single
+    # precision can push it slightly above
+    factor = np.minimum(factor, 1)
+    return np.where(np.isnan(illumination), np.nan, factor)
 
 
 def temperature_single_value(temperature: float):
@@ -147,70 +258,107 @@ def temperature_single_value(temperature: float):
     if np.isnan(temperature):
         return np.nan
     # make sure the temperature is in a reasonable range
-    assert -20 <= temperature <= 50, "temperature has the value {}".format(temperature)
-    # where Kt1 = 0.017°C−2 and Kt2 = 0.06°C−2. These coefficients were determined by
-    # fitting the preceding equation such that g(15°C) = 0.25 and g(36°C) = 0.1
-    kt1 = 0.017
-    kt2 = 0.064
-
-    if temperature < 24:
-        return math.exp(-kt1 * (24 - temperature) ** 2)
-    elif temperature > 30:
-        return math.exp(-kt2 * (temperature - 30) ** 2)
+    lower, upper = VALID_RANGES["temperature"]
+    assert lower <= temperature <= upper, "temperature has the value {}".format(
+        temperature
+    )
+    kt1 = DEFAULT_PARAMETERS["kt1"]
+    kt2 = DEFAULT_PARAMETERS["kt2"]
+    lower = DEFAULT_PARAMETERS["temperature_lower"]
+    upper = DEFAULT_PARAMETERS["temperature_upper"]
+    if temperature < lower:
+        return math.exp(-kt1 * (lower - temperature) ** 2)
+    elif temperature > upper:
+        return math.exp(-kt2 * (temperature - upper) ** 2)
     else:
         return 1
 
 
-def calculate_temperature_factor(temperature: pd.Series):
+def calculate_temperature_factor(
+    temperature: pd.Series, dtype=float, validate: bool = True
+):
     """
     Calculates the temperature factor for a whole dataframe column
     Arguments:
         temperature: the temperature of the water in celcius
+        dtype: the floating point type to calculate in
+        validate: if True, raises a ValidationError for unreasonable values
     Returns:
         The temperature factor as a pandas series
     """
-    # Apply the function to the salinity dataframe
-    return pd.Series(temperature.apply(temperature_single_value))
+    if validate:
+        validate_arrays({"temperature": temperature.values})
+    return pd.Series(
+        temperature_array(temperature.values, dtype),
+        index=temperature.index,
+        name=temperature.name,
+    )
+
+
+def temperature_array(temperature: np.ndarray, dtype=float, parameters=None):
+    """
+    Calculates the temperature factor for a whole array
+    Arguments:
+        temperature: the temperature of the water in °C
+        dtype: the floating point type to calculate in
+        parameters: a parameter set, DEFAULT_PARAMETERS if None
+    Returns:
+        The temperature factor as a numpy array, nan where the temperature is nan
+    """
+    temperature = np.asarray(temperature, dtype=dtype)
+    kt1, kt2, lower, upper = get_constants(
+        parameters, ["kt1", "kt2", "temperature_lower", "temperature_upper"], dtype
+    )
+    # At most one of the distances to the optimal range is not zero, so both
+    # sides of the curve are calculated with one exp instead of two
+    below = np.maximum(lower - temperature, 0)
+    above = np.maximum(temperature - upper, 0)
+    factor = np.exp(-(kt1 * below**2 + kt2 * above**2))
+    return np.where(np.isnan(temperature), np.nan, factor)
 
 
-def nitrate_subfactor(nitrate):
+def nitrate_subfactor(nitrate, kno3=DEFAULT_PARAMETERS["kno3"]):
     """
-    Calculates the nitrate subfactor for a single value
+    Calculates the nitrate subfactor for a single value or an array
     Arguments:
         nitrate: the nitrate concentration in mmol/m³
+        kno3: the half saturation constant of nitrate
     Returns:
-        The nitrate subfactor as a float
+        The nitrate subfactor as a float or array
     """
-    kno3 = 0.4  # empirical constant
     return nitrate / (kno3 + nitrate)
 
 
-def phosphate_subfactor(phosphate):
+def phosphate_subfactor(phosphate, kpo4=DEFAULT_PARAMETERS["kpo4"]):
     """
-    Calculates the phosphate subfactor for a single value
+    Calculates the phosphate subfactor for a single value or an array
     Arguments:
         phosphate: the phosphate concentration in mmol/m³
+        kpo4: the half saturation constant of phosphate
     Returns:
-        The phosphate subfactor as a float
+        The phosphate subfactor as a float or array
     """
-    kpo4 = 0.1  # empirical constant
     return phosphate / (kpo4 + phosphate)
 
 
-def ammonium_subfactor(ammonium):
+def ammonium_subfactor(ammonium, knh4=DEFAULT_PARAMETERS["knh4"]):
     """
-    Calculates the ammonium subfactor for a single value
+    Calculates the ammonium subfactor for a single value or an array
     Arguments:
         ammonium: the ammonium concentration in mmol/m³
+        knh4: the half saturation constant of ammonium
     Returns:
-        The ammonium subfactor as a float
+        The ammonium subfactor as a float or array
     """
-    knh4 = 0.3  # empirical constant
     return ammonium / (knh4 + ammonium)
 
 
 def calculate_nutrient_factor(
-    nitrate: pd.Series, ammonium: pd.Series, phosphate: pd.Series
+    nitrate: pd.Series,
+    ammonium: pd.Series,
+    phosphate: pd.Series,
+    dtype=float,
+    validate: bool = True,
 ):
     """
     Calculates the nutrient factor for a whole series
@@ -219,6 +367,8 @@ def calculate_nutrient_factor(
         nitrate: the nitrate concentration in mmol/m³
         ammonium: the ammonium concentration in mmol/m³
         phosphate: the phosphate concentration in mmol/m³
+        dtype: the floating point type to calculate in
+        validate: if True, raises a ValidationError for unreasonable values
     Returns:
         List of:
             nutrient_factor: The nutrient factor as a pd.Series
@@ -226,30 +376,60 @@ def calculate_nutrient_factor(
             ammonium_subfactor: The ammonium subfactor as a pd.Series
             phosphate_subfactor: The phosphate subfactor as a pd.Series
     """
-    nutrient_df = pd.concat([nitrate, ammonium, phosphate], axis=1)
-    nutrient_df.columns = ["nitrate", "ammonium", "phosphate"]
-    nutrient_df["nitrate_subfactor"] = nutrient_df["nitrate"].apply(nitrate_subfactor)
-    nutrient_df["ammonium_subfactor"] = nutrient_df["ammonium"].apply(
-        ammonium_subfactor
-    )
-    nutrient_df["phosphate_subfactor"] = nutrient_df["phosphate"].apply(
-        phosphate_subfactor
-    )
-    # Calculate the nutrient factor as the minimum available nutrient
-    nutrient_df["nutrient_factor"] = nutrient_df.apply(
-        lambda x: min(
-            x["nitrate_subfactor"], x["ammonium_subfactor"], x["phosphate_subfactor"]
-        ),
-        axis=1,
-    )
+    if validate:
+        validate_arrays(
+            {
+                "nitrate": nitrate.values,
+                "ammonium": ammonium.values,
+                "phosphate": phosphate.values,
+            }
+        )
+    factors = nutrient_array(nitrate.values, ammonium.values, phosphate.values, dtype)
+    names = [
+        "nutrient_factor",
+        "nitrate_subfactor",
+        "ammonium_subfactor",
+        "phosphate_subfactor",
+    ]
     return [
-        pd.Series(nutrient_df["nutrient_factor"]),
-        pd.Series(nutrient_df["nitrate_subfactor"]),
-        pd.Series(nutrient_df["ammonium_subfactor"]),
-        pd.Series(nutrient_df["phosphate_subfactor"]),
+        pd.Series(factor, index=nitrate.index, name=name)
+        for factor, name in zip(factors, names)
     ]
 
 
+def nutrient_array(
+    nitrate: np.ndarray,
+    ammonium: np.ndarray,
+    phosphate: np.ndarray,
+    dtype=float,
+    parameters=None,
+):
+    """
+    Calculates the nutrient factor for whole arrays of the same shape
+    Arguments:
+        nitrate: the nitrate concentration in mmol/m³
+        ammonium: the ammonium concentration in mmol/m³
+        phosphate: the phosphate concentration in mmol/m³
+        dtype: the floating point type to calculate in
+        parameters: a parameter set, DEFAULT_PARAMETERS if None
+    Returns:
+        List of numpy arrays of:
+            nutrient_factor: The nutrient factor
+            nitrate_subfactor: The nitrate subfactor
+            ammonium_subfactor: The ammonium subfactor
+            phosphate_subfactor: The phosphate subfactor
+    """
+    kno3, knh4, kpo4 = get_constants(parameters, ["kno3", "knh4", "kpo4"], dtype)
+    nitrate_factor = nitrate_subfactor(np.asarray(nitrate, dtype=dtype), kno3)
+    ammonium_factor = ammonium_subfactor(np.asarray(ammonium, dtype=dtype), knh4)
+    phosphate_factor = phosphate_subfactor(np.asarray(phosphate, dtype=dtype), kpo4)
+    # Calculate the nutrient factor as the minimum available nutrient
+    nutrient_factor = np.minimum(
+        np.minimum(nitrate_factor, ammonium_factor), phosphate_factor
+    )
+    return [nutrient_factor, nitrate_factor, ammonium_factor, phosphate_factor]
+
+
 def salinity_single_value(salinity: float):
     """
     Calculates the salinity factor for a single salinity value based on an empirical model
@@ -262,25 +442,53 @@ def salinity_single_value(salinity: float):
     if np.isnan(salinity):
         return np.nan
     # Make sure the salinity is in a reasonable range
-    assert 0 <= salinity <= 100, "salinity has the value {}".format(salinity)
-    # with  = 0.007 ppt−2 and = 0.063 ppt−2.
-    kS1 = 0.007
-    kS2 = 0.063
-    if salinity < 24:
-        return math.exp(-kS1 * (24 - salinity) ** 2)
-    elif salinity > 36:
-        return math.exp(-kS2 * (salinity - 36) ** 2)
+    lower, upper = VALID_RANGES["salinity"]
+    assert lower <= salinity <= upper, "salinity has the value {}".format(salinity)
+    kS1 = DEFAULT_PARAMETERS["kS1"]
+    kS2 = DEFAULT_PARAMETERS["kS2"]
+    lower = DEFAULT_PARAMETERS["salinity_lower"]
+    upper = DEFAULT_PARAMETERS["salinity_upper"]
+    if salinity < lower:
+        return math.exp(-kS1 * (lower - salinity) ** 2)
+    elif salinity > upper:
+        return math.exp(-kS2 * (salinity - upper) ** 2)
     else:
         return 1
 
 
-def calculate_salinity_factor(salinity: pd.Series):
+def calculate_salinity_factor(salinity: pd.Series, dtype=float, validate: bool = True):
     """
     Calculates the salinity factor for a whole dataframe
     Arguments:
         salinity: the salinity of the water in ppt
+        dtype: the floating point type to calculate in
+        validate: if True, raises a ValidationError for unreasonable values
     Returns:
         The salinity factor as a pandas series
     """
-    # Apply the function to the salinity dataframe
-    return pd.Series(salinity.apply(salinity_single_value))
+    if validate:
+        validate_arrays({"salinity": salinity.values})
+    return pd.Series(
+        salinity_array(salinity.values, dtype), index=salinity.index, name=salinity.name
+    )
+
+
+def salinity_array(salinity: np.ndarray, dtype=float, parameters=None):
+    """
+    Calculates the salinity factor for a whole array
+    Arguments:
+        salinity: the salinity of the water in ppt
+        dtype: the floating point type to calculate in
+        parameters: a parameter set, DEFAULT_PARAMETERS if None
+    Returns:
+        The salinity factor as a numpy array, nan where the salinity is nan
+    """
+    salinity = np.asarray(salinity, dtype=dtype)
+    kS1, kS2, lower, upper = get_constants(
+        parameters, ["kS1", "kS2", "salinity_lower", "salinity_upper"], dtype
+    )
+    # Both sides of the curve with one exp, as for the temperature
+    below = np.maximum(lower - salinity, 0)
+    above = np.maximum(salinity - upper, 0)
+    factor = np.exp(-(kS1 * below**2 + kS2 * above**2))
+    return np.where(np.isnan(salinity), np.nan, factor)
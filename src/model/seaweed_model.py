@@ -1,75 +1,194 @@
 """
 Main Interface
 """
+import numpy as np
 import pandas as pd
 
+from src import instrumentation
 from src.model import ocean_section as oc_se
+from src.model.validation import VALID_RANGES, validate_arrays
 from src.processing import read_files
 
+# The factors and the growth rate calculated for every ocean section
+PARAMETERS = [
+    "salinity_factor",
+    "nutrient_factor",
+    "illumination_factor",
+    "temp_factor",
+    "nitrate_subfactor",
+    "ammonium_subfactor",
+    "phosphate_subfactor",
+    "seaweed_growth_rate",
+]
+
 
 class SeaweedModel:
     """
     Wrapper class that encapsulates the model
     and is meant to provide a simple interface.
+    The model calculates in double precision by default,
+    dtype=np.float32 halves the memory needed
     """
 
-    def __init__(self):
+    def __init__(self, dtype=float):
+        self.dtype = dtype
         self.sections = {}
         self.lme_or_grid = None
         self.data = None
+        self.validation_report = None
+        # The missing months of the grid cells that only have some months missing
+        self.missing_mask = {}
 
-    def add_data_by_lme(self, lme_names, file):
+    def add_data_by_lme(self, lme_names, file, months=None):
         """
         Adds data from the database to the model.
         Based on a LME.
         Arguments:
             lme_names: a list of LME names
+            file: the file to read the data from
+            months: None for all months, an iterable of months since war
+                or a boolean mask with one entry per month
         Returns:
             None
         """
         # Make sure that the model is empty
         assert self.lme_or_grid is None
-        # Add the data to the model
-        data_lme = read_files.DataLME(file)
-        # Add the sections to the model
-        for lme_name in lme_names:
-            self.sections[lme_name] = oc_se.OceanSection(
-                lme_name, data_lme.provide_data_lme(lme_name)
-            )
+        with instrumentation.stage("load", cells=len(lme_names), lme_or_grid="lme"):
+            # Add the data to the model
+            data_lme = read_files.DataLME(file, months, self.dtype)
+            # Add the sections to the model
+            for lme_name in lme_names:
+                self.sections[lme_name] = oc_se.OceanSection(
+                    lme_name,
+                    data_lme.provide_data_lme(lme_name),
+                    data_lme.months_since_war,
+                    self.dtype,
+                )
         self.lme_or_grid = "lme"
 
-    def add_data_by_grid(self, file):
+    def add_data_by_grid(
+        self, file, bbox=None, cell_ids=None, polygon=None, months=None
+    ):
         """
         Adds data from the database to the model.
-        Based on a grid.
+        Based on a grid. Only the cells matching the selection
+        are added, if no selection is given all cells are added.
         Arguments:
-            lat_lons: a list of lat_lon tuples
             file: the file to read the data from
+            bbox: a tuple of (lat_min, lat_max, lon_min, lon_max)
+            cell_ids: a list of lat_lon tuples
+            polygon: a shapely (multi)polygon with longitudes from -180 to 180
+            months: None for all months, an iterable of months since war
+                or a boolean mask with one entry per month
+        Returns:
+            None
+        """
+        # Make sure that the model is empty
+        assert self.lme_or_grid is None
+        with instrumentation.stage("load", lme_or_grid="grid") as record:
+            # Add the data to the model
+            # The gridded data is already in single precision, so it is
+            # only converted to the model's type when the factors are calculated
+            data_grid = read_files.DataGrid(file, bbox, cell_ids, polygon, months)
+            self.add_data_by_data_grid(data_grid)
+            record["cells"] = len(self.sections)
+
+    def add_data_by_data_grid(self, data_grid, cell_ids=None):
+        """
+        Adds data from an already loaded grid to the model.
+        This way a large grid can be split into several models
+        without reading it again for every model.
+        Arguments:
+            data_grid: a read_files.DataGrid object
+            cell_ids: a list of lat_lon tuples to add, all cells if None.
+                Cells that were dropped by the grid as they have no data are skipped
         Returns:
             None
         """
         # Make sure that the model is empty
         assert self.lme_or_grid is None
-        # Add the data to the model
-        data_grid = read_files.DataGrid(file)
+        if cell_ids is None:
+            cell_ids = data_grid.full_grid
         # Add the sections to the model
-        for lat_lon in data_grid.grid_dict.keys():
+        for lat_lon in cell_ids:
+            if lat_lon not in data_grid.grid_dict:
+                continue
+            if lat_lon in data_grid.missing_mask:
+                self.missing_mask[lat_lon] = data_grid.missing_mask[lat_lon]
             self.sections[lat_lon] = oc_se.OceanSection(
-                lat_lon, data_grid.provide_data_grid(lat_lon)
+                lat_lon,
+                data_grid.provide_data_grid(lat_lon),
+                data_grid.months_since_war,
+                self.dtype,
             )
         self.lme_or_grid = "grid"
 
-    def calculate_factors(self):
+    def validate(self, policy="strict"):
+        """
+        Checks the data of all ocean sections for unreasonable values
+        in one pass and applies the policy to them. The location of all
+        unreasonable values is saved in self.validation_report
+        Arguments:
+            policy: "strict" raises a ValidationError, "clip" sets the values
+                to the closest reasonable value and "mask" sets them to nan
+        Returns:
+            None
+        """
+        if len(self.sections) == 0:
+            # An empty model has nothing to validate
+            self.validation_report = validate_arrays({}, policy)[1]
+            return
+        with instrumentation.stage("validate", cells=len(self.sections)):
+            names = list(self.sections.keys())
+            sections = list(self.sections.values())
+            arrays = {
+                variable: np.stack(
+                    [getattr(section, variable).values for section in sections]
+                )
+                for variable in VALID_RANGES
+            }
+            validated, self.validation_report = validate_arrays(
+                arrays,
+                policy,
+                [
+                    ("section", names),
+                    ("months_since_war", sections[0].months_since_war),
+                ],
+            )
+            # Only the sections with unreasonable values have to be changed
+            changed = set(self.validation_report.get("section", []))
+            for position, section in enumerate(sections):
+                if section.name not in changed:
+                    continue
+                for variable in VALID_RANGES:
+                    old_values = getattr(section, variable)
+                    setattr(
+                        section,
+                        variable,
+                        pd.Series(
+                            validated[variable][position],
+                            index=old_values.index,
+                            name=old_values.name,
+                        ),
+                    )
+
+    def calculate_factors(self, policy="strict", validate=True):
         """
         Calculates the growth factors for the model
         for all ocean sections (either grid or LME).
+        The data is validated once for all sections beforehand
         Arguments:
-            None
+            policy: how to handle unreasonable values, see validate
+            validate: if False, the data is not validated again,
+                e.g. because the whole grid was validated before
         Returns:
             None
         """
-        for section in self.sections.values():
-            section.calculate_factors()
+        if validate:
+            self.validate(policy)
+        with instrumentation.stage("calculate_factors", cells=len(self.sections)):
+            for section in self.sections.values():
+                section.calculate_factors(validate=False)
 
     def calculate_growth_rate(self):
         """
@@ -80,8 +199,9 @@ class SeaweedModel:
         Returns:
             None
         """
-        for section in self.sections.values():
-            section.calculate_growth_rate()
+        with instrumentation.stage("calculate_growth_rate", cells=len(self.sections)):
+            for section in self.sections.values():
+                section.calculate_growth_rate()
 
     def create_section_dfs(self):
         """
@@ -91,8 +211,9 @@ class SeaweedModel:
         Returns:
             None
         """
-        for section in self.sections.values():
-            section.create_section_df()
+        with instrumentation.stage("create_section_dfs", cells=len(self.sections)):
+            for section in self.sections.values():
+                section.create_section_df()
 
     def construct_df_from_sections_for_date(self, months):
         """
@@ -105,10 +226,13 @@ class SeaweedModel:
         Returns:
             a dataframe for the values at the given month
         """
-        date_dict = {}
-        for section_name, section_object in self.sections.items():
-            date_dict[section_name] = section_object.select_section_df_date(months)
-        return pd.DataFrame.from_dict(date_dict, orient="index")
+        with instrumentation.stage(
+            "construct_df_from_sections_for_date", cells=len(self.sections)
+        ):
+            date_dict = {}
+            for section_name, section_object in self.sections.items():
+                date_dict[section_name] = section_object.select_section_df_date(months)
+            return pd.DataFrame.from_dict(date_dict, orient="index")
 
     def construct_df_for_parameter(self, parameter):
         """
@@ -119,7 +243,10 @@ class SeaweedModel:
         Returns:
             a dataframe with the date as index and the sections as columns
         """
-        parameter_dict = {}
-        for section_name, section_object in self.sections.items():
-            parameter_dict[section_name] = section_object.section_df[parameter]
-        return pd.DataFrame.from_dict(parameter_dict)
+        with instrumentation.stage(
+            "construct_df_for_parameter", cells=len(self.sections), parameter=parameter
+        ):
+            parameter_dict = {}
+            for section_name, section_object in self.sections.items():
+                parameter_dict[section_name] = section_object.section_df[parameter]
+            return pd.DataFrame.from_dict(parameter_dict)
@@ -0,0 +1,77 @@
+"""
+Registry of the seaweed species the model can be evaluated for. Every
+species is a parameter set of the empirical constants of the model, i.e.
+the illumination thresholds, the optimal temperature and salinity ranges
+with the decline around them and the half saturation constants of the
+nutrients (see seaweed_growth.DEFAULT_PARAMETERS).
+
+The model is only calibrated for Gracilaria tikvahiae. Other species can be
+registered with register_species once their constants are known. All
+registered species are evaluated against the same data in one pass, with
+the species as first axis of the results.
+"""
+import pandas as pd
+
+from src.model import parameter_sets
+from src.model import seaweed_growth as sg
+
+# The parameter sets of all species, by name of the species
+SPECIES = {
+    # James and Boriah (2010)
+    "gracilaria_tikvahiae": dict(sg.DEFAULT_PARAMETERS),
+}
+
+
+def register_species(name, parameters, replace=False):
+    """
+    Adds a species to the registry
+    Arguments:
+        name: the name of the species
+        parameters: a dictionary with the constants of the species, the
+            constants that are not given have the value of Gracilaria
+        replace: if True, an already registered species is replaced
+    Returns:
+        None
+    """
+    assert replace or name not in SPECIES, "{} is already registered".format(name)
+    # Stacking checks the names and the ranges of the constants
+    stacked = parameter_sets.stack_parameter_sets([parameters])
+    SPECIES[name] = stacked.iloc[0].to_dict()
+
+
+def species_parameters(species=None):
+    """
+    Collects the parameter sets of several species
+    Arguments:
+        species: a list of the names of the species, all registered if None
+    Returns:
+        a dataframe with one row per species and the constants as columns
+    """
+    if species is None:
+        species = list(SPECIES)
+    unknown = [name for name in species if name not in SPECIES]
+    assert not unknown, "Species {} are not registered".format(unknown)
+    return parameter_sets.stack_parameter_sets(
+        [SPECIES[name] for name in species]
+    ).set_index(pd.Index(species, name="species"))
+
+
+def evaluate_species(data, species=None, dtype=float, reduce=None):
+    """
+    Calculates the growth rate of several species on the same data
+    Arguments:
+        data: a dictionary with one array per environmental variable,
+            all of the same shape, e.g. (cell, month)
+        species: a list of the names of the species, all registered if None
+        dtype: the floating point type to calculate in
+        reduce: a function applied to the growth rate of the species, see
+            parameter_sets.sweep_growth_rate
+    Returns:
+        growth_rate: a numpy array with the species as first axis
+        species: a list of the names of the species in the order of the axis
+    """
+    parameters = species_parameters(species)
+    growth_rate = parameter_sets.sweep_growth_rate(
+        data, parameters, dtype, sets_per_chunk=len(parameters), reduce=reduce
+    )
+    return growth_rate, list(parameters.index)
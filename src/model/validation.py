@@ -0,0 +1,114 @@
+"""
+Validation of the environmental data before the model is run.
+All values of a variable are checked against its reasonable range
+in one vectorized pass over the whole array, so the functions that
+calculate the factors do not have to check every value again.
+Values out of range are handled by a policy:
+    strict: raise a ValidationError that lists where the values are
+    clip: set the values to the closest value within the range
+    mask: set the values to nan, so they are ignored downstream
+In all cases a report with the location of every offending value is returned.
+"""
+import numpy as np
+import pandas as pd
+
+# The reasonable range of every environmental variable
+VALID_RANGES = {
+    # 1361 is the maximum illumination that reaches the atmosphere
+    "illumination": (0, 1361),
+    "temperature": (-20, 50),
+    "salinity": (0, 100),
+    "nitrate": (0, np.inf),
+    "ammonium": (0, np.inf),
+    "phosphate": (0, np.inf),
+}
+
+POLICIES = ["strict", "clip", "mask"]
+
+
+class ValidationError(AssertionError):
+    """
+    Raised when values are out of range and the policy is strict.
+    Is an AssertionError, as the range checks used to be asserts.
+    The report with the location of all values out of range is kept
+    in self.report
+    """
+
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+
+def validate_arrays(arrays, policy="strict", axes=None):
+    """
+    Checks all arrays against the ranges of their variable
+    and applies the policy to the values out of range
+    Arguments:
+        arrays: a dictionary with the variable names as keys and numpy
+            arrays of any shape as values. Variables without a range are ignored
+        policy: one of "strict", "clip" or "mask"
+        axes: a list with a tuple of (name, labels) for every axis of the arrays,
+            used to report the location of the values. If None, the
+            position along every axis is reported
+    Returns:
+        validated: a dictionary with the arrays after the policy is applied,
+            arrays without values out of range are not copied
+        report: a dataframe with one row per value out of range and the
+            columns variable, value and one column per axis
+    """
+    assert policy in POLICIES, "policy has to be one of {}".format(POLICIES)
+    validated = dict(arrays)
+    reports = []
+    for variable, values in arrays.items():
+        if variable not in VALID_RANGES:
+            continue
+        lower, upper = VALID_RANGES[variable]
+        values = np.asarray(values)
+        # nan is never out of range, as the comparisons are False
+        out_of_range = (values < lower) | (values > upper)
+        if not out_of_range.any():
+            continue
+        positions = np.nonzero(out_of_range)
+        report = pd.DataFrame({"variable": variable, "value": values[positions]})
+        if axes is None:
+            axes_values = [
+                ("axis_{}".format(axis), np.arange(length))
+                for axis, length in enumerate(values.shape)
+            ]
+        else:
+            axes_values = axes
+        for (name, labels), position in zip(axes_values, positions):
+            report[name] = [labels[i] for i in position]
+        reports.append(report)
+        if policy == "clip":
+            validated[variable] = np.clip(values, lower, upper)
+        elif policy == "mask":
+            validated[variable] = np.where(out_of_range, np.nan, values)
+    if reports:
+        report = pd.concat(reports, ignore_index=True)
+    else:
+        report = pd.DataFrame(columns=["variable", "value"])
+    if policy == "strict" and len(report) > 0:
+        raise ValidationError(summarize_report(report), report)
+    return validated, report
+
+
+def summarize_report(report):
+    """
+    Summarizes a validation report in a few lines
+    Arguments:
+        report: a dataframe as returned by validate_arrays
+    Returns:
+        a string with the number of values out of range per variable
+        and the location of the first one
+    """
+    lines = ["{} values are out of range".format(len(report))]
+    for variable, variable_report in report.groupby("variable", sort=False):
+        lower, upper = VALID_RANGES[variable]
+        first = variable_report.iloc[0].drop("variable").to_dict()
+        lines.append(
+            "{}: {} values outside [{}, {}], e.g. {}".format(
+                variable, len(variable_report), lower, upper, first
+            )
+        )
+    return "\n".join(lines)
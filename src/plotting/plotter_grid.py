@@ -12,20 +12,87 @@ import pandas as pd
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.lines import Line2D
 
+from src import instrumentation
+from src.model.biomass import OPTIMAL_GROWTH_RATE
+from src.model.seaweed_ensemble import SeaweedEnsemble
+from src.model.seaweed_model import PARAMETERS
+from src.plotting import raster
+from src.processing import aggregates, results_store
 from src.processing import read_files as rf
-from src.utilities import prepare_geometry, weighted_quantile
+from src.utilities import prepare_geometry, weighted_quantile, weighted_quantile_array
 
 plt.style.use(
     "https://raw.githubusercontent.com/allfed/ALLFED-matplotlib-style-sheet/main/ALLFED.mplstyle"
 )
 
+# The extent of the maps as (lon_min, lon_max, lat_min, lat_max)
+MAP_EXTENTS = {
+    "US": (-130, -65, 18, 55),
+    "AUS": (105, 180, -47, -10),
+    "global": (-180, 180, -75, 85),
+}
 
-def cluster_spatial(growth_df, global_or_country, scenario, admin_1=False):
+
+def map_extent(global_or_country):
+    """
+    Finds the extent of the maps of a region, the global extent
+    for regions without their own
+    Arguments:
+        global_or_country: the name of the region
+    Returns:
+        a tuple of (lon_min, lon_max, lat_min, lat_max)
+    """
+    return MAP_EXTENTS.get(global_or_country, MAP_EXTENTS["global"])
+
+
+def number_clusters(clusters):
     """
-    Creates a spatial plot of the clusters
+    Numbers the clusters starting at 1 for the plots. The cells without a
+    cluster, as they have missing months, keep the label NO_CLUSTER
+    Arguments:
+        clusters: a series with the cluster labels as saved by the postprocessing
+    Returns:
+        a series with the numbered clusters
+    """
+    return clusters.where(clusters == results_store.NO_CLUSTER, clusters + 1)
+
+
+def raster_mapping(growth_df, global_or_country):
+    """
+    Loads the mapping of the cells to the raster of the maps of a region,
+    which is built and cached the first time it is needed for a grid
+    Arguments:
+        growth_df: a dataframe with the cells as index
+        global_or_country: the name of the region
+    Returns:
+        the RasterMapping
+    """
+    return raster.load_or_build(
+        "data"
+        + os.sep
+        + "interim_data"
+        + os.sep
+        + "raster_mapping_"
+        + global_or_country
+        + ".npz",
+        growth_df.index,
+        map_extent(global_or_country),
+    )
+
+
+@instrumentation.instrumented("plot_cluster_spatial")
+def cluster_spatial(
+    growth_df, global_or_country, scenario, admin_1=False, mapping=None
+):
+    """
+    Creates a spatial plot of the clusters. The cells
+    without a cluster are left out
     Arguments:
         growth_df: a dataframe of the growth rate
         global_or_country: a string of either "global" or "US" that indicates the scale
+        mapping: the RasterMapping of the cells of growth_df, the cells
+            are drawn as raster image. If None, every cell is drawn
+            as a marker, which is much slower for the global grid
     Returns:
         None, but saves the plot
     """
@@ -44,10 +111,40 @@ def cluster_spatial(growth_df, global_or_country, scenario, admin_1=False):
     global_map = gpd.read_file(
             "data/geospatial_information/Countries/ne_50m_admin_0_countries.shp"
         )
-    growth_df.set_crs(epsg=4326, inplace=True)
-    growth_df.to_crs(global_map.crs, inplace=True)
-    growth_df["cluster"] = growth_df["cluster"].astype(str)
-    ax = growth_df.plot(column="cluster", legend=True, cmap=custom_map, marker='s', markersize=85)
+    clustered = (growth_df["cluster"] != results_store.NO_CLUSTER).values
+    if mapping is None:
+        growth_df = growth_df[clustered]
+        growth_df.set_crs(epsg=4326, inplace=True)
+        growth_df.to_crs(global_map.crs, inplace=True)
+        growth_df["cluster"] = growth_df["cluster"].astype(str)
+        ax = growth_df.plot(
+            column="cluster", legend=True, cmap=custom_map, marker="s", markersize=85
+        )
+    else:
+        # Every cluster gets its own color, as with the categories of the markers
+        clusters = np.sort(growth_df["cluster"][clustered].unique())
+        cluster_map = LinearSegmentedColormap.from_list(
+            "custom", colors, N=len(clusters)
+        )
+        ax = plt.figure().add_subplot(111)
+        # The cells without a cluster are nan, so they are not drawn
+        mapping.draw(
+            ax,
+            np.where(
+                clustered,
+                np.searchsorted(clusters, growth_df["cluster"].values),
+                np.nan,
+            ),
+            cmap=cluster_map,
+            vmin=-0.5,
+            vmax=len(clusters) - 0.5,
+        )
+        ax.legend(
+            handles=[
+                mpatches.Patch(color=cluster_map(number), label=str(cluster))
+                for number, cluster in enumerate(clusters)
+            ]
+        )
     fig = plt.gcf()
     fig.set_size_inches(12, 12)
     global_map.plot(ax=ax, color="lightgrey", edgecolor="black", linewidth=0.2)
@@ -56,15 +153,9 @@ def cluster_spatial(growth_df, global_or_country, scenario, admin_1=False):
     ax.set_xlabel("Longitude")
     ax.set_ylabel("Latitude")
     ax.get_legend().set_title("Cluster")
-    if global_or_country == "US":
-        ax.set_ylim(18, 55)
-        ax.set_xlim(-130, -65)
-    elif global_or_country == "AUS":
-        ax.set_ylim(-47, -10)
-        ax.set_xlim(105, 180)
-    else:
-        ax.set_ylim(-75, 85)
-        ax.set_xlim(-180, 180)
+    lon_min, lon_max, lat_min, lat_max = map_extent(global_or_country)
+    ax.set_ylim(lat_min, lat_max)
+    ax.set_xlim(lon_min, lon_max)
     plt.savefig(
         "results"
         + os.sep
@@ -80,12 +171,26 @@ def cluster_spatial(growth_df, global_or_country, scenario, admin_1=False):
     )
 
 
-def growth_rate_spatial_by_year(growth_df, global_or_country, scenario, optimal_growth_rate):
+@instrumentation.instrumented("plot_growth_rate_spatial_by_year")
+def growth_rate_spatial_by_year(
+    growth_df,
+    global_or_country,
+    scenario,
+    optimal_growth_rate,
+    annual_means=None,
+    mapping=None,
+):
     """
     Plots the growth rate by year. This includes the first
     three months without nuclear war, in the case of the first year
     Arguments:
         growth_df: a dataframe of the growth rate
+        annual_means: a dataframe with the mean growth rate of every cell
+            and year, as saved by the postprocessing. Calculated from
+            growth_df if None
+        mapping: the RasterMapping of the cells of growth_df, the cells
+            are drawn as raster image. If None, every cell is drawn
+            as a marker, which is much slower for the global grid
     Returns:
         None, but saves the plot
     """
@@ -93,48 +198,63 @@ def growth_rate_spatial_by_year(growth_df, global_or_country, scenario, optimal_
     global_map = gpd.read_file(
         "data/geospatial_information/Countries/ne_50m_admin_0_countries.shp"
     )
-    for year, i in enumerate(np.arange(-4, len(growth_df.columns) - 10, 12)):
-        # Calculate the mean growth rate per year
-        growth_df_year = growth_df.loc[:, i + 1 : i + 12]
-        growth_df_year = growth_df_year.mean(axis=1)
-        growth_df_year = growth_df_year.to_frame()
+    if annual_means is None:
+        months = [
+            column
+            for column in growth_df.columns
+            if isinstance(column, (int, np.integer))
+        ]
+        annual_means = aggregates.aggregate_cells(growth_df[months], "annual")["mean"]
+    annual_means = annual_means.reindex(growth_df.index)
+    for year in annual_means.columns:
+        growth_df_year = annual_means[[year]].copy()
         growth_df_year.columns = ["growth_rate"]
         # Multiply it by optimal_growth_rate to get the actual growth rate
         growth_df_year["growth_rate"] = (
             growth_df_year["growth_rate"] * optimal_growth_rate
         )
-        # Make it a geodataframe
-        growth_df_year["geometry"] = growth_df["geometry"]
-        growth_df_year = gpd.GeoDataFrame(growth_df_year)
-        growth_df_year.set_crs(epsg=4326, inplace=True)
-        growth_df_year.to_crs(global_map.crs, inplace=True)
-        # Plot it
-        ax = growth_df_year.plot(
-            column="growth_rate",
-            legend=True,
-            cmap="viridis",
-            marker='s',
-            markersize=85,
-            vmin=0,
-            vmax=optimal_growth_rate,
-            legend_kwds={
-                "label": "Mean Daily Growth Rate [%]",
-                "orientation": "vertical",
-            },
-        )
+        if mapping is None:
+            # Make it a geodataframe
+            growth_df_year["geometry"] = growth_df["geometry"]
+            growth_df_year = gpd.GeoDataFrame(growth_df_year)
+            growth_df_year.set_crs(epsg=4326, inplace=True)
+            growth_df_year.to_crs(global_map.crs, inplace=True)
+            # Plot it
+            ax = growth_df_year.plot(
+                column="growth_rate",
+                legend=True,
+                cmap="viridis",
+                marker='s',
+                markersize=85,
+                vmin=0,
+                vmax=optimal_growth_rate,
+                legend_kwds={
+                    "label": "Mean Daily Growth Rate [%]",
+                    "orientation": "vertical",
+                },
+            )
+        else:
+            fig, ax = plt.subplots()
+            image = mapping.draw(
+                ax,
+                growth_df_year["growth_rate"].values,
+                cmap="viridis",
+                vmin=0,
+                vmax=optimal_growth_rate,
+            )
+            fig.colorbar(
+                image,
+                ax=ax,
+                label="Mean Daily Growth Rate [%]",
+                orientation="vertical",
+            )
         global_map.plot(ax=ax, color="lightgrey", edgecolor="black", linewidth=0.2)
         ax.set_xlabel("Longitude")
         ax.set_ylabel("Latitude")
-        ax.set_title("Year " + str(year + 1))
-        if global_or_country == "US":
-            ax.set_ylim(18, 55)
-            ax.set_xlim(-130, -65)
-        elif global_or_country == "AUS":
-            ax.set_ylim(-47, -10)
-            ax.set_xlim(105, 180)
-        else:
-            ax.set_ylim(-75, 85)
-            ax.set_xlim(-180, 180)
+        ax.set_title("Year " + str(year))
+        lon_min, lon_max, lat_min, lat_max = map_extent(global_or_country)
+        ax.set_ylim(lat_min, lat_max)
+        ax.set_xlim(lon_min, lon_max)
         plt.savefig(
             "results"
             + os.sep
@@ -143,20 +263,24 @@ def growth_rate_spatial_by_year(growth_df, global_or_country, scenario, optimal_
             + scenario
             + os.sep
             + "growth_rate_spatial_year_"
-            + str(year + 1)
+            + str(year)
             + "_"
             + global_or_country
             + ".png",
             dpi=350,
             bbox_inches="tight",
         )
+        if mapping is not None:
+            plt.close()
 
 
+@instrumentation.instrumented("plot_cluster_timeseries_all_parameters_q_lines")
 def cluster_timeseries_all_parameters_q_lines(
     parameters, global_or_country, scenario, areas
 ):
     """
-    Plots line plots for all clusters and all parameters
+    Plots line plots for all clusters and all parameters.
+    The cells without a cluster are left out
     Arguments:
         parameters: a dictionary of dataframes of all parameters
     Returns:
@@ -183,6 +307,7 @@ def cluster_timeseries_all_parameters_q_lines(
     # Iterate over all parameters and cluster to make all the subplots
     for parameter, parameter_df in parameters.items():
         j = 0
+        parameter_df = parameter_df[parameter_df["cluster"] != results_store.NO_CLUSTER]
         for cluster, cluster_df in parameter_df.groupby("cluster"):
             # Combine area and cluster into one dataframe, merge by index
             # Reset the index, so we can join on column instead of index
@@ -291,6 +416,7 @@ def cluster_timeseries_all_parameters_q_lines(
     plt.close()
 
 
+@instrumentation.instrumented("plot_compare_nw_scenarios")
 def compare_nw_scenarios(areas, optimal_growth_rate):
     """
     Compares the results of the nuclear war scenarios as weigthed median
@@ -311,75 +437,41 @@ def compare_nw_scenarios(areas, optimal_growth_rate):
         "5 Tg": "#E6FFE6",
         "Control": "#95c091",
     }
-    # have a list that is used to save the scenario results
-    median_weighted_list = []
-    for scenario in [str(i) + "tg" for i in [150, 47, 37, 27, 16, 5]] + ["control"]:
-        print("Starting scenario: " + scenario)
-        # Read the data
-        growth_df_scenario = pd.read_pickle(
-            "data"
-            + os.sep
-            + "interim_data"
-            + os.sep
-            + scenario
-            + os.sep
-            + "seaweed_growth_rate_global.pkl"
-        )
-        # Reset the index, so we can join on column instead of
-        areas_reset = areas.reset_index()
-        growth_df_scenario = growth_df_scenario.reset_index()
-        # Only use those grid cells that are between -45 and 45 degrees latitude
-        # This is because the areas above and below have 0 growth either way
-        growth_df_scenario = growth_df_scenario[growth_df_scenario["level_0"] > -45]
-        growth_df_scenario = growth_df_scenario[growth_df_scenario["level_0"] < 45]
-        # Combine area and cluster into one dataframe, merge by index
-        # Round the level and lat lon values to 4 decimals to make sure they match
-        # level just refers to the level of the multi index, but contains the same
-        # information as the lat lon
-        growth_df_scenario["level_0"] = growth_df_scenario["level_0"].round(4)
-        growth_df_scenario["level_1"] = growth_df_scenario["level_1"].round(4)
-        areas_reset["TLAT"] = areas_reset["TLAT"].round(4)
-        areas_reset["TLONG"] = areas_reset["TLONG"].round(4)
-        # Merge the dataframes, so that we have the area for each grid cell
-        # And remove the grid cells without data.
-        growth_df_scenario = pd.merge(
-            growth_df_scenario,
-            areas_reset,
-            left_on=["level_0", "level_1"],
-            right_on=["TLAT", "TLONG"],
-        )
-        # Remove the columsn we don't need anymore
-        areas_reset = growth_df_scenario["TAREA"]
-        # Drop additional geospacial columns if we used a eez
-        growth_df_scenario = growth_df_scenario.drop(
-            columns=["TLAT", "TLONG", "level_0", "level_1", "TAREA"]
-        )
-        # Calculate the weighted median
-        median_weighted = growth_df_scenario.apply(
-            weighted_quantile, args=(areas_reset, 0.5)
-        ).transpose()
-        # Save it in a list
-        median_weighted_list.append(median_weighted.values)
-    all_medians = pd.DataFrame(
-        np.concatenate(median_weighted_list, axis=1),
-        columns=[
-            "150 Tg",
-            "47 Tg",
-            "37 Tg",
-            "27 Tg",
-            "16 Tg",
-            "5 Tg",
-            "Control",
-        ],
+    scenarios = {
+        str(i) + "tg": str(i) + " Tg" for i in [150, 47, 37, 27, 16, 5]
+    }
+    scenarios["control"] = "Control"
+    # Load all scenarios into one ensemble, so the grid and the areas
+    # are only read and joined once
+    ensemble = SeaweedEnsemble()
+    ensemble.add_parameter_by_scenario(
+        "seaweed_growth_rate",
+        {
+            scenario: results_store.open_results(
+                "data" + os.sep + "interim_data" + os.sep + scenario,
+                "global",
+                PARAMETERS,
+            )
+            for scenario in scenarios.keys()
+        },
     )
+    ensemble.add_areas(areas)
+    # Only use those grid cells that are between -45 and 45 degrees latitude
+    # This is because the areas above and below have 0 growth either way
+    lats = ensemble.grid_index.lats
+    # Calculate the weighted median for all scenarios at once
+    all_medians = ensemble.weighted_quantile(
+        "seaweed_growth_rate", 0.5, cells=(lats > -45) & (lats < 45)
+    )
+    all_medians.columns = [scenarios[scenario] for scenario in all_medians.columns]
     # Remove the first three months, because they are before the nuclear war
-    all_medians = all_medians.iloc[3:]
+    all_medians = all_medians[all_medians.index >= 0]
     # Multiply the values in the columns by optimal_growth_rate, which is the maximum growth rate
     all_medians = all_medians * optimal_growth_rate
-    # Calculate the median for each year
-    all_medians = all_medians.groupby(all_medians.index // 12).median()
-    # Add one to the years, so that the first year is 1
-    all_medians.index = all_medians.index + 1
+    # Calculate the median for each year, with the same years as the aggregates
+    all_medians = all_medians.groupby(
+        aggregates.period_labels(all_medians.index, "annual")
+    ).median()
     # plot them all in the same subplot as bar plots
     ax = all_medians.plot.bar(color=colors, edgecolor="black", linewidth=0.1, legend=False)
     # Create a custom legend for the plot with 7 columns
@@ -412,10 +504,12 @@ def compare_nw_scenarios(areas, optimal_growth_rate):
     )
 
 
+@instrumentation.instrumented("plot_compare_nutrient_subfactors")
 def compare_nutrient_subfactors(nitrate, ammonium, phosphate, scenario, areas):
     """
     Takes the weighted average of the nutrient subfactors globally and plots them
-    in the same plot to be able to compare them.
+    in the same plot to be able to compare them. The missing months
+    of the cells are ignored
     Arguments:
         nitrate: The nitrate subfactor
         ammonium: The ammonium subfactor
@@ -453,10 +547,11 @@ def compare_nutrient_subfactors(nitrate, ammonium, phosphate, scenario, areas):
         nutrient_merged = nutrient_merged.drop(
             columns=["TLAT", "TLONG", "level_0", "level_1", "TAREA", "cluster"]
         )
-        # Calculate the weighted median
-        median_weighted = nutrient_merged.apply(
-            weighted_quantile, args=(areas_reset, 0.5)
-        ).transpose()
+        # Calculate the weighted median of every month, nan is ignored
+        median_weighted = pd.Series(
+            weighted_quantile_array(nutrient_merged.values, areas_reset.values, 0.5),
+            index=nutrient_merged.columns,
+        )
         # Plot the median
         ax.plot(median_weighted, color="black", linewidth=2)
         ax.plot(median_weighted, label=labels[i], color=colors[i], linewidth=1.5)
@@ -495,30 +590,48 @@ def plot(scenario, global_or_country, optimal_growth_rate, admin_1=False):
     areas = rf.read_area_file(
         "data" + os.sep + "geospatial_information" + os.sep + "grid", "area_grid.csv"
     )
-    # File with the seaweed growth rate
+    # File with all parameters and the cluster labels of the cells
+    results_file = results_store.open_results(
+        "data" + os.sep + "interim_data" + os.sep + scenario,
+        global_or_country,
+        PARAMETERS,
+    )
     growth_df = gpd.GeoDataFrame(
-        pd.read_pickle(
-            "data"
-            + os.sep
-            + "interim_data"
-            + os.sep
-            + scenario
-            + os.sep
-            + "seaweed_growth_rate_clustered_"
-            + global_or_country
-            + ".pkl"
+        results_store.read_parameter(
+            results_file, "seaweed_growth_rate", with_clusters=True
         )
     )
-    # Add one to the cluster to make it start at 1
-    growth_df["cluster"] = growth_df["cluster"] + 1
-    # Make sure that each entry has a value
-    num_nan = growth_df.isna().sum().sum()
-    assert num_nan == 0, "The dataframe has {} nan".format(num_nan)
+    # Make the clusters start at 1
+    growth_df["cluster"] = number_clusters(growth_df["cluster"])
     # Fix the geometry
     growth_df = prepare_geometry(growth_df)
+    # The maps are drawn as raster images, the mapping is cached per grid
+    mapping = raster_mapping(growth_df, global_or_country)
     # Make the spatial plots
-    cluster_spatial(growth_df, global_or_country, scenario, admin_1)
-    growth_rate_spatial_by_year(growth_df, global_or_country, scenario, optimal_growth_rate)
+    cluster_spatial(growth_df, global_or_country, scenario, admin_1, mapping)
+    # Use the precomputed annual means, if the postprocessing saved them
+    aggregates_file = (
+        "data"
+        + os.sep
+        + "interim_data"
+        + os.sep
+        + scenario
+        + os.sep
+        + "seaweed_growth_rate_aggregates_"
+        + global_or_country
+        + ".pkl"
+    )
+    annual_means = None
+    if os.path.isfile(aggregates_file):
+        annual_means = pd.read_pickle(aggregates_file)["annual"]["mean"]
+    growth_rate_spatial_by_year(
+        growth_df,
+        global_or_country,
+        scenario,
+        optimal_growth_rate,
+        annual_means,
+        mapping,
+    )
     # Read in the other parameters for the line plots
     parameters = {}
     parameter_names = [
@@ -531,24 +644,15 @@ def plot(scenario, global_or_country, optimal_growth_rate, admin_1=False):
         "phosphate_subfactor",
         "ammonium_subfactor",
     ]
-    # Read in the data to plot
+    # Read in the data to plot, only the parameters needed are read
     for parameter in parameter_names:
-        parameters[parameter] = pd.DataFrame(
-            pd.read_pickle(
-                "data"
-                + os.sep
-                + "interim_data"
-                + os.sep
-                + scenario
-                + os.sep
-                + parameter
-                + "_clustered_"
-                + global_or_country
-                + ".pkl"
-            )
+        parameters[parameter] = results_store.read_parameter(
+            results_file, parameter, with_clusters=True
+        )
+        # Make the clusters start at 1
+        parameters[parameter]["cluster"] = number_clusters(
+            parameters[parameter]["cluster"]
         )
-        # Add one to the cluster
-        parameters[parameter]["cluster"] = parameters[parameter]["cluster"] + 1
     # Plot the nutrient subfactors comparison
     compare_nutrient_subfactors(
         parameters["nitrate_subfactor"],
@@ -567,7 +671,7 @@ def plot(scenario, global_or_country, optimal_growth_rate, admin_1=False):
 
 
 if __name__ == "__main__":
-    optimal_growth_rate = 30  # %/day
+    optimal_growth_rate = OPTIMAL_GROWTH_RATE  # %/day
     # Call this seperately, as it needs to access all scenarios
     # Compare the nuclear war scenarios
     areas = rf.read_area_file(
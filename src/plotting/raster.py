@@ -0,0 +1,194 @@
+"""
+Draws the values of the grid cells as a raster image instead of one marker
+per cell. The cells of the climate model lie on a curvilinear grid, so they
+are mapped onto a regular latitude/longitude raster: every pixel shows the
+value of the nearest cell, as long as it is close enough. This leaves no
+gaps or overlaps at any zoom. The mapping only depends on the grid, so it
+is built once, cached in a file and reused for every parameter, year and
+scenario. Drawing a map is then one fancy index and one imshow call.
+"""
+import os
+
+import numpy as np
+
+from src.processing.grid_index import GridIndex
+
+# The extent of the global raster as (lon_min, lon_max, lat_min, lat_max)
+GLOBAL_EXTENT = (-180, 180, -90, 90)
+
+# The size of a pixel in degrees
+RESOLUTION = 0.25
+
+# The largest distance in km between a pixel and its cell. The cells of the
+# global grid are about 1° apart, so every ocean pixel has a cell closer than
+# this, while pixels far from any cell stay empty
+MAX_DISTANCE = 100
+
+
+class RasterMapping:
+    """
+    The position of the cell shown by every pixel of a regular raster.
+    Meant to be built once per grid and then used for all maps
+    """
+
+    def __init__(self, pixels, extent, lat_lons, max_distance=MAX_DISTANCE):
+        # The position of the cell of every pixel with the axes (lat, lon),
+        # starting in the south west. -1 for pixels without a cell
+        self.pixels = pixels
+        self.extent = tuple(float(edge) for edge in extent)
+        self.lat_lons = list(lat_lons)
+        self.max_distance = float(max_distance)
+
+    @classmethod
+    def from_grid(
+        cls,
+        grid_index,
+        extent=GLOBAL_EXTENT,
+        resolution=RESOLUTION,
+        max_distance=MAX_DISTANCE,
+    ):
+        """
+        Maps every pixel of a raster to its nearest cell
+        Arguments:
+            grid_index: the GridIndex of the cells
+            extent: the extent of the raster as (lon_min, lon_max, lat_min,
+                lat_max), with longitudes from -180 to 180
+            resolution: the size of a pixel in degrees
+            max_distance: the largest distance in km between a pixel and its cell
+        Returns:
+            the RasterMapping
+        """
+        lon_min, lon_max, lat_min, lat_max = extent
+        number_lons = int(round((lon_max - lon_min) / resolution))
+        number_lats = int(round((lat_max - lat_min) / resolution))
+        # The centers of the pixels
+        lons = np.linspace(lon_min, lon_max, number_lons, endpoint=False)
+        lats = np.linspace(lat_min, lat_max, number_lats, endpoint=False)
+        lons += (lon_max - lon_min) / number_lons / 2
+        lats += (lat_max - lat_min) / number_lats / 2
+        pixel_lats, pixel_lons = np.meshgrid(lats, lons, indexing="ij")
+        positions, distances = grid_index.query_nearest(pixel_lats, pixel_lons)
+        pixels = np.where(distances <= max_distance, positions, -1).astype(np.int32)
+        return cls(
+            pixels.reshape(number_lats, number_lons),
+            extent,
+            grid_index.lat_lons,
+            max_distance,
+        )
+
+    def save(self, file):
+        """
+        Saves the mapping as compressed numpy file
+        Arguments:
+            file: the path of the file, ending in .npz
+        Returns:
+            None
+        """
+        coordinates = np.array(self.lat_lons, dtype=float).reshape(-1, 2)
+        np.savez_compressed(
+            file,
+            pixels=self.pixels,
+            extent=np.array(self.extent),
+            lats=coordinates[:, 0],
+            lons=coordinates[:, 1],
+            max_distance=self.max_distance,
+        )
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads a mapping saved with save
+        Arguments:
+            file: the path of the file
+        Returns:
+            the RasterMapping
+        """
+        with np.load(file) as saved:
+            lat_lons = list(zip(saved["lats"].tolist(), saved["lons"].tolist()))
+            return cls(
+                saved["pixels"],
+                saved["extent"].tolist(),
+                lat_lons,
+                float(saved["max_distance"]),
+            )
+
+    @property
+    def resolution(self):
+        """
+        The size of a pixel in degrees
+        """
+        lon_min, lon_max, _, _ = self.extent
+        return (lon_max - lon_min) / self.pixels.shape[1]
+
+    def fill(self, values):
+        """
+        Places the values of the cells onto the raster
+        Arguments:
+            values: a numpy array with one value per cell,
+                in the order of the cells of the mapping
+        Returns:
+            a masked numpy array with the axes (lat, lon),
+            masked where a pixel has no cell or the cell is nan
+        """
+        values = np.asarray(values, dtype=float)
+        assert len(values) == len(self.lat_lons), "Expected {} values".format(
+            len(self.lat_lons)
+        )
+        raster = values[self.pixels]
+        return np.ma.masked_invalid(np.where(self.pixels >= 0, raster, np.nan))
+
+    def draw(self, ax, values, **kwargs):
+        """
+        Draws the values of the cells as an image
+        Arguments:
+            ax: the matplotlib axes to draw on
+            values: a numpy array with one value per cell,
+                in the order of the cells of the mapping
+            kwargs: further arguments of imshow, e.g. cmap, vmin and vmax
+        Returns:
+            the matplotlib AxesImage, e.g. for a colorbar
+        """
+        return ax.imshow(
+            self.fill(values),
+            extent=self.extent,
+            origin="lower",
+            interpolation="nearest",
+            **kwargs,
+        )
+
+
+def load_or_build(
+    file,
+    lat_lons,
+    extent=GLOBAL_EXTENT,
+    resolution=RESOLUTION,
+    max_distance=MAX_DISTANCE,
+):
+    """
+    Loads the mapping from a file, or builds and saves it if the file
+    does not exist or was built for a different grid or raster
+    Arguments:
+        file: the path of the cache file, ending in .npz
+        lat_lons: a list of the lat_lon tuples of the cells
+        extent: the extent of the raster, see RasterMapping.from_grid
+        resolution: the size of a pixel in degrees
+        max_distance: the largest distance in km between a pixel and its cell
+    Returns:
+        the RasterMapping
+    """
+    lat_lons = list(lat_lons)
+    if os.path.isfile(file):
+        mapping = RasterMapping.load(file)
+        if (
+            mapping.lat_lons == lat_lons
+            and mapping.extent == tuple(float(edge) for edge in extent)
+            and np.isclose(mapping.resolution, resolution)
+            and mapping.max_distance == max_distance
+        ):
+            return mapping
+        print("The cached raster mapping does not match, rebuilding")
+    mapping = RasterMapping.from_grid(
+        GridIndex(lat_lons), extent, resolution, max_distance
+    )
+    mapping.save(file)
+    return mapping
@@ -0,0 +1,173 @@
+"""
+Aggregates the monthly model output over time. For every grid cell the
+mean, minimum and maximum of every year and quarter are calculated, and for
+the whole region the area weighted mean and quantiles of the cell means.
+All periods are reduced in one vectorized pass over the monthly values, so
+the plotting and analysis can read the small aggregate tables instead of
+reducing the full monthly tables again.
+"""
+import numpy as np
+import pandas as pd
+
+from src.processing.read_files import FIRST_MONTH_SINCE_WAR
+from src.utilities import weighted_quantile_array
+
+# The number of months in every period. The output does not carry calendar
+# dates, so the periods are blocks of months counted from the first month of
+# the data. This means the first year includes the months before the war and
+# the quarters are the four three month blocks of every such year. They are
+# not the meteorological seasons (DJF, MAM, JJA, SON)
+PERIODS = {"annual": 12, "quarterly": 3}
+
+# How the periods are aligned, saved in the attrs of the aggregates.
+# Period n of a period type starts at the month since war
+# first_month_since_war + (n - 1) * months_per_period
+ALIGNMENT = {
+    "months_per_period": PERIODS,
+    "first_month_since_war": FIRST_MONTH_SINCE_WAR,
+}
+
+# The quantiles of the cell means that are calculated for every region
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def period_labels(months_since_war, period):
+    """
+    Calculates the period every month belongs to
+    Arguments:
+        months_since_war: the months since war of the data
+        period: one of the keys of PERIODS
+    Returns:
+        a numpy array with the number of the period of every month,
+        starting with 1 for the first period of the data
+    """
+    assert period in PERIODS, "period has to be one of {}".format(list(PERIODS))
+    positions = np.asarray(months_since_war) - FIRST_MONTH_SINCE_WAR
+    return positions // PERIODS[period] + 1
+
+
+def aggregate_cells(parameter_df, period):
+    """
+    Calculates the mean, minimum and maximum of every cell and period.
+    Nan values are ignored
+    Arguments:
+        parameter_df: a dataframe with the cells as index and the
+            months since war as columns, as saved by the postprocessing
+        period: one of the keys of PERIODS
+    Returns:
+        a dataframe with the cells as index and the columns
+        (statistic, period) for the statistics mean, min and max
+    """
+    labels = period_labels(parameter_df.columns, period)
+    assert (np.diff(labels) >= 0).all(), "The months have to be sorted"
+    periods, starts = np.unique(labels, return_index=True)
+    values = parameter_df.values
+    valid = ~np.isnan(values)
+    # Sum up all months of a period at once, nan is counted as 0
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=1)
+    counts = np.add.reduceat(valid, starts, axis=1)
+    with np.errstate(invalid="ignore"):
+        means = (sums / counts).astype(values.dtype)
+    # fmin and fmax ignore nan, unless all values of the period are nan
+    statistics = {
+        "mean": means,
+        "min": np.fmin.reduceat(values, starts, axis=1),
+        "max": np.fmax.reduceat(values, starts, axis=1),
+    }
+    aggregates = pd.concat(
+        {
+            statistic: pd.DataFrame(
+                statistic_values, index=parameter_df.index, columns=periods
+            )
+            for statistic, statistic_values in statistics.items()
+        },
+        axis=1,
+    )
+    aggregates.columns.names = ["statistic", period]
+    return aggregates
+
+
+def aggregate_region(cell_aggregates, weights=None, quantiles=QUANTILES):
+    """
+    Aggregates the cell aggregates of one period type over all cells
+    Arguments:
+        cell_aggregates: a dataframe as returned by aggregate_cells
+        weights: the area of every cell in the order of the cells. If None,
+            all cells are weighted the same. Cells without a weight are left out
+        quantiles: the quantiles of the cell means to calculate
+    Returns:
+        a dataframe with the periods as index and the columns mean, min, max
+        and one column per quantile. The mean and quantiles are weighted by
+        the area of the cells, min and max are the extremes over all cells
+    """
+    means = cell_aggregates["mean"].values
+    if weights is None:
+        weights = np.ones(len(means))
+    weights = np.asarray(weights, dtype=float)
+    use_cells = ~np.isnan(weights)
+    means = means[use_cells]
+    weights = weights[use_cells]
+    valid = ~np.isnan(means)
+    weighted_sums = (np.where(valid, means, 0) * weights[:, np.newaxis]).sum(axis=0)
+    weight_sums = (valid * weights[:, np.newaxis]).sum(axis=0)
+    with np.errstate(invalid="ignore"):
+        weighted_means = weighted_sums / weight_sums
+    region = pd.DataFrame(
+        {
+            "mean": weighted_means,
+            "min": np.nanmin(cell_aggregates["min"].values[use_cells], axis=0),
+            "max": np.nanmax(cell_aggregates["max"].values[use_cells], axis=0),
+        },
+        index=cell_aggregates["mean"].columns,
+    )
+    # All quantiles at once, so the cell means are only sorted once
+    quantiles = [float(quantile) for quantile in quantiles]
+    for quantile, values in zip(
+        quantiles, weighted_quantile_array(means, weights, quantiles)
+    ):
+        region[quantile] = values
+    return region
+
+
+def aggregate(parameter_df, weights=None, quantiles=QUANTILES):
+    """
+    Calculates the aggregates of all period types for the cells and the region
+    Arguments:
+        parameter_df: a dataframe with the cells as index and the
+            months since war as columns, as saved by the postprocessing
+        weights: the area of every cell in the order of the cells,
+            if None all cells are weighted the same
+        quantiles: the quantiles of the cell means to calculate for the region
+    Returns:
+        cell_aggregates: a dataframe with the cells as index and the columns
+            (period type, statistic, period)
+        region_aggregates: a dataframe with the index (period type, period)
+            and the statistics as columns.
+        Both have the ALIGNMENT of the periods as attrs
+    """
+    cell_aggregates = {}
+    region_aggregates = {}
+    for period in PERIODS:
+        cell_aggregates[period] = aggregate_cells(parameter_df, period)
+        region_aggregates[period] = aggregate_region(
+            cell_aggregates[period], weights, quantiles
+        )
+        cell_aggregates[period].columns.names = ["statistic", "period"]
+    cell_aggregates = pd.concat(cell_aggregates, axis=1, names=["period_type"])
+    region_aggregates = pd.concat(region_aggregates, names=["period_type", "period"])
+    cell_aggregates.attrs.update(ALIGNMENT)
+    region_aggregates.attrs.update(ALIGNMENT)
+    return cell_aggregates, region_aggregates
+
+
+def has_alignment(file):
+    """
+    Checks that saved aggregates have the periods of this version,
+    older versions saved other period types
+    Arguments:
+        file: the pickle of the cell or region aggregates
+    Returns:
+        True if the aggregates are aligned as described by ALIGNMENT
+    """
+    attrs = pd.read_pickle(file).attrs
+    return all(attrs.get(key) == value for key, value in ALIGNMENT.items())
@@ -0,0 +1,196 @@
+"""
+Checkpoints for long runs of the model. Every finished step of a run
+(e.g. a chunk of grid cells or the clustering) is written to a checkpoint
+folder and recorded in a manifest. The manifest and all files are written
+atomically, by first writing a temporary file and then replacing the
+final file with it. This way an interrupted run never leaves a half written
+file behind and a rerun can continue after the last finished step.
+A step only counts as done as long as its output files exist, and the
+checkpoint starts over if one of the input files of the run has changed.
+Once a run is finished, its checkpoint is cleared.
+"""
+import json
+import os
+import pickle
+import shutil
+
+
+class Checkpoint:
+    """
+    A folder with the finished steps of a run and a manifest
+    that lists them. Meant to be created at the start of a run,
+    which then skips all steps that are already done
+    """
+
+    def __init__(self, directory, inputs=None, **settings):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_file = os.path.join(self.directory, "manifest.json")
+        fingerprints = {file: fingerprint(file) for file in (inputs or [])}
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as handle:
+                self.manifest = json.load(handle)
+            # A checkpoint can only be resumed with the same settings
+            assert self.manifest["settings"] == settings, (
+                "The checkpoint in {} was created with the settings {}, "
+                "but {} were given. Delete the folder to start over".format(
+                    self.directory, self.manifest["settings"], settings
+                )
+            )
+            # The finished steps are stale if an input has changed since
+            if self.manifest.get("inputs", {}) != fingerprints:
+                print(
+                    "The inputs of the checkpoint in {} have changed, "
+                    "starting over".format(self.directory)
+                )
+                self.clear()
+                os.makedirs(self.directory)
+                self.manifest = None
+        else:
+            self.manifest = None
+        if self.manifest is None:
+            self.manifest = {"settings": settings, "inputs": fingerprints, "done": []}
+            self.write_manifest()
+
+    def is_done(self, step, *outputs):
+        """
+        Checks if a step of the run is already done
+        Arguments:
+            step: the name of the step
+            outputs: the files the step writes, the step is only done
+                if all of them still exist
+        Returns:
+            True if the step is done
+        """
+        return step in self.manifest["done"] and all(
+            os.path.isfile(output) for output in outputs
+        )
+
+    def mark_done(self, step):
+        """
+        Records a step as done in the manifest
+        Arguments:
+            step: the name of the step
+        Returns:
+            None
+        """
+        if not self.is_done(step):
+            self.manifest["done"].append(step)
+            self.write_manifest()
+
+    def write_manifest(self):
+        """
+        Writes the manifest atomically
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w") as handle:
+            json.dump(self.manifest, handle, indent=1)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_file, self.manifest_file)
+
+    def file(self, name):
+        """
+        Finds the file of a step in the checkpoint folder
+        Arguments:
+            name: the name of the file without ending
+        Returns:
+            the path of the file
+        """
+        return os.path.join(self.directory, name + ".pkl")
+
+    def save(self, name, data):
+        """
+        Pickles the data of a step atomically to the checkpoint folder
+        Arguments:
+            name: the name of the file without ending
+            data: the data to pickle
+        Returns:
+            None
+        """
+        save_atomic(data, self.file(name))
+
+    def load(self, name):
+        """
+        Loads the data of a step from the checkpoint folder
+        Arguments:
+            name: the name of the file without ending
+        Returns:
+            the unpickled data
+        """
+        with open(self.file(name), "rb") as handle:
+            return pickle.load(handle)
+
+    def remove(self, name):
+        """
+        Removes the data of a step, that is not needed anymore
+        Arguments:
+            name: the name of the file without ending
+        Returns:
+            None
+        """
+        file = self.file(name)
+        if os.path.isfile(file):
+            os.remove(file)
+
+    def clear(self):
+        """
+        Removes the checkpoint folder, once the run is finished
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def fingerprint(file):
+    """
+    Describes the state of an input file by its size and modification time
+    Arguments:
+        file: the path of the file
+    Returns:
+        a list of the size in bytes and the modification time in nanoseconds,
+        None if the file does not exist
+    """
+    if not os.path.isfile(file):
+        return None
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_up_to_date(outputs, input_file):
+    """
+    Checks if output files exist and were written after an input file
+    Arguments:
+        outputs: a list of the paths of the output files
+        input_file: the path of the input file
+    Returns:
+        True if all outputs exist and are newer than the input
+    """
+    if not all(os.path.isfile(output) for output in outputs):
+        return False
+    input_time = os.stat(input_file).st_mtime_ns
+    return all(os.stat(output).st_mtime_ns >= input_time for output in outputs)
+
+
+def save_atomic(data, file):
+    """
+    Pickles data to a file atomically, so the file is either
+    complete or not there at all
+    Arguments:
+        data: the data to pickle
+        file: the file to write to
+    Returns:
+        None
+    """
+    tmp_file = file + ".tmp"
+    with open(tmp_file, "wb") as handle:
+        pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_file, file)
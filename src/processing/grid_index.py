@@ -0,0 +1,168 @@
+"""
+Spatial index over the grid cells of the gridded data. The grid cells
+are identified by a tuple of floats of the latitude and longitude, which
+makes it expensive to look up cells by scanning the keys. This index
+is built once per grid and allows to select cells by a bounding box,
+a list of cell ids or a polygon, and to find the nearest cells of
+arbitrary coordinates.
+"""
+import geopandas as gpd
+import numpy as np
+from sklearn.neighbors import KDTree
+
+# The mean radius of the earth in km
+EARTH_RADIUS = 6371.0
+
+
+def convert_longitude(longitude):
+    """
+    Converts longitudes from the 0-360 convention used by the climate model
+    to the -180 to 180 convention used by the geospatial data
+    Arguments:
+        longitude: a float or numpy array of longitudes
+    Returns:
+        the longitude(s) in the -180 to 180 convention
+    """
+    longitude = np.asarray(longitude, dtype=float)
+    return np.where(longitude > 180, longitude - 360, longitude)
+
+
+def unit_vectors(lats, lons):
+    """
+    Converts coordinates to points on the unit sphere, so the distance
+    between two points grows with the distance on the earth. This works for
+    both longitude conventions and across the antimeridian and the poles
+    Arguments:
+        lats: numpy array of latitudes in degrees
+        lons: numpy array of longitudes in degrees
+    Returns:
+        a numpy array with the axes (point, xyz)
+    """
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    return np.stack(
+        [np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)],
+        axis=-1,
+    )
+
+
+class GridIndex:
+    """
+    Index over the coordinates of the grid cells.
+    Meant to be built once per grid and then used to find
+    the cells that belong to a region
+    """
+
+    def __init__(self, lat_lons):
+        # The cell ids in the order they were provided
+        self.lat_lons = list(lat_lons)
+        self.positions = {lat_lon: i for i, lat_lon in enumerate(self.lat_lons)}
+        self.lats = np.array([lat_lon[0] for lat_lon in self.lat_lons], dtype=float)
+        self.lons = convert_longitude(
+            np.array([lat_lon[1] for lat_lon in self.lat_lons], dtype=float)
+        )
+        # Sort by latitude, so bounding boxes can be found with a binary search
+        self.lat_order = np.argsort(self.lats, kind="stable")
+        self.sorted_lats = self.lats[self.lat_order]
+        # The tree for the nearest cells is only built when it is first needed
+        self.tree = None
+
+    def __len__(self):
+        return len(self.lat_lons)
+
+    def query_bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Finds all cells within a bounding box. Longitudes can be given in either
+        convention. If lon_min is larger than lon_max, the box crosses the antimeridian
+        Arguments:
+            lat_min: the southern edge of the box
+            lat_max: the northern edge of the box
+            lon_min: the western edge of the box
+            lon_max: the eastern edge of the box
+        Returns:
+            a sorted numpy array of the positions of the cells in the box
+        """
+        assert lat_min <= lat_max, "lat_min has to be smaller than lat_max"
+        start = np.searchsorted(self.sorted_lats, lat_min, side="left")
+        end = np.searchsorted(self.sorted_lats, lat_max, side="right")
+        candidates = self.lat_order[start:end]
+        lon_min, lon_max = convert_longitude([lon_min, lon_max])
+        lons = self.lons[candidates]
+        if lon_min <= lon_max:
+            in_box = (lons >= lon_min) & (lons <= lon_max)
+        else:
+            in_box = (lons >= lon_min) | (lons <= lon_max)
+        return np.sort(candidates[in_box])
+
+    def query_polygon(self, polygon):
+        """
+        Finds all cells whose center lies within a polygon
+        Arguments:
+            polygon: a shapely (multi)polygon in EPSG:4326 with longitudes
+                from -180 to 180
+        Returns:
+            a sorted numpy array of the positions of the cells in the polygon
+        """
+        # Use the bounds of the polygon to only test the cells nearby
+        lon_min, lat_min, lon_max, lat_max = polygon.bounds
+        candidates = self.query_bbox(lat_min, lat_max, lon_min, lon_max)
+        points = gpd.GeoSeries(
+            gpd.points_from_xy(self.lons[candidates], self.lats[candidates])
+        )
+        return candidates[points.within(polygon).values]
+
+    def query_cell_ids(self, cell_ids):
+        """
+        Finds the positions of a list of cell ids
+        Arguments:
+            cell_ids: a list of lat_lon tuples
+        Returns:
+            a sorted numpy array of the positions of the cells
+        """
+        missing = [cell_id for cell_id in cell_ids if cell_id not in self.positions]
+        assert not missing, "{} cell ids are not in the grid, e.g. {}".format(
+            len(missing), missing[:3]
+        )
+        return np.sort(
+            np.array([self.positions[cell_id] for cell_id in cell_ids], dtype=int)
+        )
+
+    def query_nearest(self, lats, lons):
+        """
+        Finds the nearest cell of every point. The cells are put on the unit
+        sphere in a KD-tree, which is built once per index
+        Arguments:
+            lats: a float or numpy array of latitudes
+            lons: a float or numpy array of longitudes, in either convention
+        Returns:
+            positions: a numpy array of the positions of the nearest cells
+            distances: a numpy array of the great circle distances in km
+        """
+        if self.tree is None:
+            self.tree = KDTree(unit_vectors(self.lats, self.lons))
+        points = unit_vectors(np.ravel(lats), np.ravel(lons))
+        chords, positions = self.tree.query(points, k=1)
+        # Convert the straight distance through the sphere to the arc length
+        distances = 2 * np.arcsin(np.minimum(chords[:, 0] / 2, 1)) * EARTH_RADIUS
+        return positions[:, 0], distances
+
+    def select(self, bbox=None, cell_ids=None, polygon=None):
+        """
+        Selects the cells that match all the given criteria.
+        If no criterion is given, all cells are selected
+        Arguments:
+            bbox: a tuple of (lat_min, lat_max, lon_min, lon_max)
+            cell_ids: a list of lat_lon tuples
+            polygon: a shapely (multi)polygon
+        Returns:
+            a list of the lat_lon tuples of the selected cells,
+            in the order of the grid
+        """
+        selected = np.arange(len(self.lat_lons))
+        if bbox is not None:
+            selected = np.intersect1d(selected, self.query_bbox(*bbox))
+        if cell_ids is not None:
+            selected = np.intersect1d(selected, self.query_cell_ids(cell_ids))
+        if polygon is not None:
+            selected = np.intersect1d(selected, self.query_polygon(polygon))
+        return [self.lat_lons[i] for i in selected]
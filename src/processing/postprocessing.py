@@ -11,7 +11,16 @@ from sklearn.preprocessing import MinMaxScaler
 from tslearn.clustering import TimeSeriesKMeans
 from tslearn.utils import to_time_series_dataset
 
-from src.model.seaweed_model import SeaweedModel
+from src import instrumentation
+from src.model.seaweed_model import PARAMETERS, SeaweedModel
+from src.model.validation import (
+    VALID_RANGES,
+    ValidationError,
+    summarize_report,
+    validate_arrays,
+)
+from src.processing import aggregates, read_files, regions, results_store
+from src.processing.checkpoint import Checkpoint, is_up_to_date, save_atomic
 
 # Import the ALLFED stle
 plt.style.use(
@@ -22,8 +31,11 @@ plt.style.use(
 random.seed(42)
 np.random.seed(42)
 
+# elbow method says 3 is the optimal number of clusters
+NUMBER_OF_CLUSTERS = {"global": 3, "US": 4, "AUS": 2}
+
 
-def get_parameter_dataframe(parameter, path, file):
+def get_parameter_dataframe(parameter, path, file, months=None, dtype=float):
     """
     Initializes the seaweed model and returns the dataframe with the parameter
     for all the grid sections
@@ -31,11 +43,14 @@ def get_parameter_dataframe(parameter, path, file):
         parameter: the parameter to construct the dataframe for
         path: The path to the file
         file: The file name
+        months: None for all months, an iterable of months since war
+            or a boolean mask with one entry per month
+        dtype: the floating point type to calculate in
     Returns:
         df: pandas.DataFrame
     """
-    model = SeaweedModel()
-    model.add_data_by_grid(path + os.sep + file)
+    model = SeaweedModel(dtype)
+    model.add_data_by_grid(path + os.sep + file, months=months)
     model.calculate_factors()
     model.calculate_growth_rate()
     model.create_section_dfs()
@@ -43,6 +58,18 @@ def get_parameter_dataframe(parameter, path, file):
     return param_df
 
 
+def complete_cells(growth_df):
+    """
+    Finds the cells that have a value in every month. Only these
+    cells can be clustered, the others get the label NO_CLUSTER
+    Arguments:
+        growth_df: a dataframe with the cells as index and the months as columns
+    Returns:
+        a boolean numpy array with one entry per cell
+    """
+    return growth_df.notna().all(axis=1).values
+
+
 def time_series_analysis(growth_df, n_clusters, global_or_country):
     """
     Does time series analysis on the dataframe
@@ -59,17 +86,24 @@ def time_series_analysis(growth_df, n_clusters, global_or_country):
     """
     # Make sure that each entry has a value
     assert growth_df.notna().all().all(), "The dataframe has nan"
-    # Normalize the data
-    scaler = MinMaxScaler()
-    growth_df_scaled = pd.DataFrame(
-        scaler.fit_transform(growth_df), columns=growth_df.columns
-    )
-    # A good rule of thumb is choosing k as the square root of the number
-    # of points in the training data set in kNN
-    cores = -1  # define the cores to use
-    km = TimeSeriesKMeans(n_clusters=n_clusters, metric="dtw", n_jobs=cores)
-    timeseries_ds = to_time_series_dataset(growth_df_scaled)
-    labels = km.fit_predict(timeseries_ds)
+    # Keep the precision of the data, so single precision runs stay small
+    dtype = growth_df.values.dtype
+    with instrumentation.stage(
+        "clustering", cells=len(growth_df), n_clusters=n_clusters
+    ):
+        # Normalize the data
+        scaler = MinMaxScaler()
+        growth_df_scaled = pd.DataFrame(
+            scaler.fit_transform(growth_df), columns=growth_df.columns
+        )
+        # A good rule of thumb is choosing k as the square root of the number
+        # of points in the training data set in kNN
+        # tslearn computes the distances in threads of this process, so the
+        # workers share the data and need no shared memory handles
+        cores = -1  # define the cores to use
+        km = TimeSeriesKMeans(n_clusters=n_clusters, metric="dtw", n_jobs=cores)
+        timeseries_ds = to_time_series_dataset(growth_df_scaled, dtype=dtype)
+        labels = km.fit_predict(timeseries_ds)
     return labels, km
 
 
@@ -138,17 +172,6 @@ def lme(scenario):
     model.calculate_factors()
     model.calculate_growth_rate()
     model.create_section_dfs()
-    # Define the parameters we look at
-    parameters = [
-        "salinity_factor",
-        "nutrient_factor",
-        "illumination_factor",
-        "temp_factor",
-        "nitrate_subfactor",
-        "ammonium_subfactor",
-        "phosphate_subfactor",
-        "seaweed_growth_rate",
-    ]
     # only run this if the file does not exist
     if not os.path.isfile(
         "data" + os.sep + "interim_data" + os.sep + "seaweed_growth_rate_LME.pkl"
@@ -156,7 +179,7 @@ def lme(scenario):
         print("Creating the dataframe")
         # Transpose the dataframe so that the time serieses are the columns
         # Get all the parameters
-        for parameter in parameters:
+        for parameter in PARAMETERS:
             print("Getting parameter {}".format(parameter))
             growth_df = model.construct_df_for_parameter(parameter).transpose()
             growth_df.to_pickle(
@@ -171,152 +194,365 @@ def lme(scenario):
             )
 
 
-def grid(scenario, global_or_country, with_elbow_method=False):
+def calculate_parameters_chunked(
+    path,
+    file,
+    parameters,
+    checkpoint,
+    cells_per_chunk,
+    dtype=float,
+    policy="strict",
+    report_file=None,
+):
     """
-    Calculates growth rate and all the factors for the grid
-    and saves it in files appropriate for the plotting functions
+    Calculates the parameters for the grid in chunks of grid cells.
+    Every finished chunk is saved to the checkpoint, so an interrupted
+    run continues with the first chunk that is not done yet.
+    The whole grid is validated once before the first chunk is calculated,
+    so unreasonable values are found before any time is spent. The chunks
+    are calculated from the validated values and are not validated again
+    Arguments:
+        path: the path to the file
+        file: the file name of the gridded data
+        parameters: list of the parameters to calculate
+        checkpoint: a Checkpoint object to save the chunks to
+        cells_per_chunk: the number of grid cells in one chunk
+        dtype: the floating point type to calculate in
+        policy: how to handle unreasonable values, see validation.validate_arrays
+        report_file: the csv file to save the location of unreasonable values to
+    Returns:
+        the number of chunks
+    """
+    data_grid = read_files.DataGrid(path + os.sep + file)
+    lat_lons = list(data_grid.grid_dict.keys())
+    validate_grid(data_grid, policy, report_file)
+    chunks = [
+        lat_lons[start : start + cells_per_chunk]
+        for start in range(0, len(lat_lons), cells_per_chunk)
+    ]
+    for chunk_number, chunk in enumerate(chunks):
+        chunk_files = [
+            checkpoint.file("chunk_{}_{}".format(chunk_number, parameter))
+            for parameter in parameters
+        ]
+        if checkpoint.is_done("chunk_{}".format(chunk_number), *chunk_files):
+            continue
+        print("Calculating chunk {} of {}".format(chunk_number + 1, len(chunks)))
+        model = SeaweedModel(dtype)
+        model.add_data_by_data_grid(data_grid, chunk)
+        model.calculate_factors(policy, validate=False)
+        model.calculate_growth_rate()
+        model.create_section_dfs()
+        for parameter in parameters:
+            # Transpose the dataframe so that the time serieses are the columns
+            checkpoint.save(
+                "chunk_{}_{}".format(chunk_number, parameter),
+                model.construct_df_for_parameter(parameter).transpose(),
+            )
+        checkpoint.mark_done("chunk_{}".format(chunk_number))
+    return len(chunks)
+
+
+def validate_grid(data_grid, policy="strict", report_file=None):
+    """
+    Validates the whole grid in one pass and writes the validated values
+    back to the cells with unreasonable values. The report is printed and
+    saved before a ValidationError of the strict policy is raised
     Arguments:
+        data_grid: a read_files.DataGrid object
+        policy: how to handle unreasonable values, see validation.validate_arrays
+        report_file: the csv file to save the location of unreasonable values to
+    Returns:
         None
+    """
+    arrays = data_grid.provide_data_arrays(list(VALID_RANGES))
+    axes = [
+        ("cell", list(data_grid.grid_index.lat_lons)),
+        ("months_since_war", data_grid.months_since_war),
+    ]
+    with instrumentation.stage("validate", cells=len(axes[0][1])):
+        try:
+            validated, report = validate_arrays(arrays, policy, axes)
+        except ValidationError as error:
+            save_report(error.report, report_file)
+            raise
+    save_report(report, report_file)
+    if len(report) > 0:
+        data_grid.update_data_arrays(validated, report["cell"].unique())
+
+
+def save_report(report, report_file=None):
+    """
+    Prints the summary of a validation report and saves the report
+    Arguments:
+        report: a dataframe as returned by validation.validate_arrays
+        report_file: the csv file to save the report to
     Returns:
         None
     """
-    print("Working with the gridded data")
-    # Define the parameters we look at
-    parameters = [
-        "salinity_factor",
-        "nutrient_factor",
-        "illumination_factor",
-        "temp_factor",
-        "nitrate_subfactor",
-        "ammonium_subfactor",
-        "phosphate_subfactor",
-        "seaweed_growth_rate",
+    if len(report) == 0:
+        return
+    print(summarize_report(report))
+    if report_file is not None:
+        report.to_csv(report_file, sep=";")
+
+
+def aggregate_files(path, global_or_country):
+    """
+    Lists the files of the aggregates of all parameters
+    Arguments:
+        path: the path of the monthly data
+        global_or_country: the region of the gridded data
+    Returns:
+        a list of the paths of the files
+    """
+    return [
+        path + os.sep + parameter + kind + global_or_country + ".pkl"
+        for parameter in PARAMETERS
+        for kind in ["_aggregates_", "_region_aggregates_"]
     ]
+
+
+def aggregates_up_to_date(path, global_or_country, results_file):
+    """
+    Checks that the aggregates are newer than the results file
+    and have the periods of this version
+    Arguments:
+        path: the path of the monthly data
+        global_or_country: the region of the gridded data
+        results_file: the results file the aggregates are calculated from
+    Returns:
+        True if the aggregates do not have to be calculated again
+    """
+    files = aggregate_files(path, global_or_country)
+    return is_up_to_date(files, results_file) and all(
+        aggregates.has_alignment(file) for file in files
+    )
+
+
+def save_aggregates(path, global_or_country):
+    """
+    Calculates the annual and quarterly aggregates of all parameters and
+    saves them next to the results file. The region aggregates are weighted
+    by the area of the cells, if the area file exists
+    Arguments:
+        path: the path of the monthly data
+        global_or_country: the region of the gridded data
+    Returns:
+        None
+    """
+    area_path = "data" + os.sep + "geospatial_information" + os.sep + "grid"
+    areas = None
+    if os.path.isfile(area_path + os.sep + "area_grid.csv"):
+        areas = read_files.read_area_file(area_path, "area_grid.csv")
+    else:
+        print("No area file found, the region aggregates are not area weighted")
+    file = results_store.results_file(path, global_or_country)
+    for parameter in PARAMETERS:
+        print("Aggregating parameter {}".format(parameter))
+        parameter_df = results_store.read_parameter(file, parameter)
+        with instrumentation.stage("aggregate", cells=len(parameter_df)):
+            weights = None
+            if areas is not None:
+                weights = read_files.match_areas(areas, parameter_df.index)
+            cell_aggregates, region_aggregates = aggregates.aggregate(
+                parameter_df, weights
+            )
+        save_atomic(
+            cell_aggregates,
+            path + os.sep + parameter + "_aggregates_" + global_or_country + ".pkl",
+        )
+        save_atomic(
+            region_aggregates,
+            path
+            + os.sep
+            + parameter
+            + "_region_aggregates_"
+            + global_or_country
+            + ".pkl",
+        )
+
+
+def grid(
+    scenario,
+    global_or_country,
+    with_elbow_method=False,
+    cells_per_chunk=1000,
+    dtype=float,
+    policy="strict",
+):
+    """
+    Calculates growth rate and all the factors for the grid
+    and saves them with the cluster labels in one results file
+    (see results_store), from which the plotting reads what it needs.
+    The grid is calculated in chunks and every finished chunk and
+    step is checkpointed, so an interrupted run can simply be restarted.
+    The checkpoint is removed once the run is finished, so deleting the
+    results file is enough to calculate the grid again.
+    The annual and quarterly aggregates are saved next to the results file
+    Arguments:
+        scenario: the scenario to use (e.g. 150tg)
+        global_or_country: the region of the gridded data
+        with_elbow_method: if True, the elbow method is run before clustering
+        cells_per_chunk: the number of grid cells calculated at once
+        dtype: the floating point type to calculate and store in,
+            np.float32 halves the memory and disk space needed
+        policy: how to handle unreasonable values in the data, "strict" stops
+            the run, "clip" and "mask" continue with clipped or masked values.
+            The location of all unreasonable values is saved in a csv file
+    Returns:
+        None
+    """
+    print("Working with the gridded data")
+    path = "data" + os.sep + "interim_data" + os.sep + scenario
+    file = "data_gridded_all_parameters_" + global_or_country + ".pkl"
+    # A changed input file starts the checkpoint over
+    checkpoint = Checkpoint(
+        path + os.sep + "checkpoint_" + global_or_country,
+        inputs=[path + os.sep + file],
+        file=file,
+        cells_per_chunk=cells_per_chunk,
+        dtype=np.dtype(dtype).name,
+        policy=policy,
+    )
+    results_file = results_store.results_file(path, global_or_country)
     # only run this if the file does not exist as creating it takes a long time
-    if not os.path.isfile(
-        "data"
-        + os.sep
-        + "interim_data"
-        + os.sep
-        + scenario
-        + os.sep
-        + "seaweed_growth_rate_"
-        + global_or_country
-        + ".pkl"
+    if not os.path.isfile(results_file) and not results_store.has_pickles(
+        path, global_or_country, PARAMETERS
     ):
         print("Creating the dataframe")
-        path = "data" + os.sep + "interim_data" + os.sep + scenario
-        file = "data_gridded_all_parameters_" + global_or_country + ".pkl"
-        # Get all the parameters
-        for parameter in parameters:
-            print("Getting parameter {}".format(parameter))
-            # Transpose the dataframe so that the time serieses are the columns
-            growth_df = get_parameter_dataframe(parameter, path, file).transpose()
-            growth_df.to_pickle(
-                "data"
-                + os.sep
-                + "interim_data"
-                + os.sep
-                + scenario
-                + os.sep
-                + parameter
-                + "_"
-                + global_or_country
-                + ".pkl"
-            )
+        number_of_chunks = calculate_parameters_chunked(
+            path,
+            file,
+            PARAMETERS,
+            checkpoint,
+            cells_per_chunk,
+            dtype,
+            policy,
+            path + os.sep + "validation_report_" + global_or_country + ".csv",
+        )
+        # Combine the chunks to one dataframe per parameter, one at a time
+        results_store.save_results(
+            results_file,
+            (
+                (
+                    parameter,
+                    pd.concat(
+                        [
+                            checkpoint.load(
+                                "chunk_{}_{}".format(chunk_number, parameter)
+                            )
+                            for chunk_number in range(number_of_chunks)
+                        ]
+                    ),
+                )
+                for parameter in PARAMETERS
+            ),
+        )
+        # The chunks are not needed anymore once all parameters are saved
+        for chunk_number in range(number_of_chunks):
+            for parameter in PARAMETERS:
+                checkpoint.remove("chunk_{}_{}".format(chunk_number, parameter))
+    # The pickles of older versions are converted once
+    results_store.open_results(path, global_or_country, PARAMETERS)
     if with_elbow_method:
         # Do the time series analysis
-        growth_df = pd.read_pickle(
-            "data"
-            + os.sep
-            + "interim_data"
-            + os.sep
-            + scenario
-            + os.sep
-            + "seaweed_growth_rate_"
-            + global_or_country
-            + ".pkl"
+        growth_df = results_store.read_parameter(results_file, "seaweed_growth_rate")
+        # Only the cells that can be clustered
+        elbow_method(
+            growth_df[complete_cells(growth_df)], 7, global_or_country, scenario
         )
-        elbow_method(growth_df, 7, global_or_country, scenario)
-    # elbow method says 3 is the optimal number of clusters
-    num_clusters = {"global": 3, "US": 4, "AUS": 2}
-    number_of_clusters = num_clusters[global_or_country]
-    # Check if the files already exist
-    if not os.path.isfile(
-        "data"
-        + os.sep
-        + "interim_data"
-        + os.sep
-        + scenario
-        + os.sep
-        + "seaweed_growth_rate_clustered_"
-        + global_or_country
-        + ".pkl"
-    ):
+    cluster_grid(
+        path, global_or_country, checkpoint, NUMBER_OF_CLUSTERS[global_or_country]
+    )
+    # The aggregates come last, so they are newer than the results file
+    if not aggregates_up_to_date(path, global_or_country, results_file):
+        save_aggregates(path, global_or_country)
+    checkpoint.clear()
+
+
+def derive_region(scenario, region, number_of_clusters=None, source="global"):
+    """
+    Creates the output of a country or region by slicing it from the
+    output of the global run, which has to be done already. Only the
+    aggregates and the clustering are calculated for the region.
+    The files are the same as if the region was calculated on its own.
+    The region is sliced again whenever the output of the global run
+    is newer than the one of the region
+    Arguments:
+        scenario: the scenario to use (e.g. 150tg)
+        region: one of the keys of regions.REGIONS
+        number_of_clusters: the number of clusters, if None the
+            one in NUMBER_OF_CLUSTERS is used
+        source: the region to slice from
+    Returns:
+        None
+    """
+    print("Deriving {} from the {} run".format(region, source))
+    path = "data" + os.sep + "interim_data" + os.sep + scenario
+    if number_of_clusters is None:
+        number_of_clusters = NUMBER_OF_CLUSTERS[region]
+    source_file = results_store.open_results(path, source, PARAMETERS)
+    # A recalculated global run starts the checkpoint over
+    checkpoint = Checkpoint(
+        path + os.sep + "checkpoint_" + region,
+        inputs=[source_file],
+        source=source,
+        selection=repr(regions.REGIONS[region]),
+    )
+    results_file = results_store.results_file(path, region)
+    # Slicing is cheap, so it is simply done again for a newer global run
+    if not is_up_to_date([results_file], source_file):
+        cells = regions.slice_region(path, PARAMETERS, region, source=source)
+        print("Sliced {} cells".format(cells))
+    cluster_grid(path, region, checkpoint, number_of_clusters)
+    # The aggregates come last, so they are newer than the results file
+    if not aggregates_up_to_date(path, region, results_file):
+        save_aggregates(path, region)
+    checkpoint.clear()
+
+
+def cluster_grid(path, global_or_country, checkpoint, number_of_clusters):
+    """
+    Clusters the growth rate of the grid and saves the cluster labels
+    to the results file, once for all parameters
+    Arguments:
+        path: the path of the output
+        global_or_country: the region of the output
+        checkpoint: the Checkpoint of the run
+        number_of_clusters: the number of clusters
+    Returns:
+        None
+    """
+    results_file = results_store.results_file(path, global_or_country)
+    # The labels are stored in the results file, so a new results file
+    # is always clustered again
+    if results_store.has_cluster_labels(results_file):
+        return
+    if not checkpoint.is_done("clustering", checkpoint.file("cluster_labels")):
         # Cluster the data
         print("Clustering the data")
-        growth_df = pd.read_pickle(
-            "data"
-            + os.sep
-            + "interim_data"
-            + os.sep
-            + scenario
-            + os.sep
-            + "seaweed_growth_rate_"
-            + global_or_country
-            + ".pkl"
-        )
+        growth_df = results_store.read_parameter(results_file, "seaweed_growth_rate")
         # Cluster only the growth data, as the other parameters all have the same shape
-        labels, km = time_series_analysis(growth_df, number_of_clusters, global_or_country)
-        growth_df["cluster"] = labels
-        for parameter in parameters:
-            print("Getting parameter {} for clustering".format(parameter))
-            param_df = pd.read_pickle(
-                "data"
-                + os.sep
-                + "interim_data"
-                + os.sep
-                + scenario
-                + os.sep
-                + parameter
-                + "_"
-                + global_or_country
-                + ".pkl"
-            )
-            # Add the cluster labels to the dataframe
-            param_df["cluster"] = labels
-            param_df.to_pickle(
-                "data"
-                + os.sep
-                + "interim_data"
-                + os.sep
-                + scenario
-                + os.sep
-                + parameter
-                + "_clustered_"
-                + global_or_country
-                + ".pkl"
-            )
-    else:
-        growth_df = pd.read_pickle(
-            "data"
-            + os.sep
-            + "interim_data"
-            + os.sep
-            + scenario
-            + os.sep
-            + "seaweed_growth_rate_clustered_"
-            + global_or_country
-            + ".pkl"
+        # Cells with missing months cannot be clustered and get the label -1
+        complete = complete_cells(growth_df)
+        labels = np.full(len(growth_df), results_store.NO_CLUSTER)
+        labels[complete], km = time_series_analysis(
+            growth_df[complete], number_of_clusters, global_or_country
         )
+        checkpoint.save("cluster_labels", labels)
+        checkpoint.mark_done("clustering")
+    results_store.save_cluster_labels(results_file, checkpoint.load("cluster_labels"))
 
 
 if __name__ == "__main__":
     lme("150tg")
-    grid("150tg", "US")
     # # Iterate over all scenarios
     for scenario in [str(i) + "tg" for i in [5, 16, 27, 37, 47, 150]]:
         print("Preparing scenario: " + scenario)
         grid(scenario, "global")
+    # The country studies are views of the global run
+    for region in regions.REGIONS:
+        derive_region("150tg", region)
     # # also run the control scenario
     grid("control", "global")
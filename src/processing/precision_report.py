@@ -0,0 +1,95 @@
+"""
+Validates the single precision mode of the model. Runs the model once in
+double and once in single precision on the shipped datasets and reports
+the maximum deviation of every parameter and the memory needed to store it.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.model.seaweed_model import PARAMETERS, SeaweedModel
+
+
+def run_model(dtype, file, lme_or_grid):
+    """
+    Runs the model in the given precision
+    Arguments:
+        dtype: the floating point type to calculate in
+        file: the file with the data
+        lme_or_grid: "lme" or "grid", the type of the data
+    Returns:
+        the model with the growth rate calculated
+    """
+    model = SeaweedModel(dtype)
+    if lme_or_grid == "lme":
+        model.add_data_by_lme([i for i in range(1, 67)], file)
+    else:
+        model.add_data_by_grid(file)
+    model.calculate_factors()
+    model.calculate_growth_rate()
+    model.create_section_dfs()
+    return model
+
+
+def compare_precision(file, lme_or_grid):
+    """
+    Compares the parameters calculated in single precision
+    with the ones calculated in double precision
+    Arguments:
+        file: the file with the data
+        lme_or_grid: "lme" or "grid", the type of the data
+    Returns:
+        a dataframe with one row per parameter and the maximum
+        absolute deviation, maximum relative deviation and the
+        memory of the parameter in both precisions in MB
+    """
+    model_64 = run_model(np.float64, file, lme_or_grid)
+    model_32 = run_model(np.float32, file, lme_or_grid)
+    report = {}
+    for parameter in PARAMETERS:
+        values_64 = model_64.construct_df_for_parameter(parameter)
+        values_32 = model_32.construct_df_for_parameter(parameter)
+        deviation = (values_32.astype(np.float64) - values_64).abs()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relative_deviation = (deviation / values_64.abs()).where(values_64 > 0)
+        report[parameter] = {
+            "max_abs_deviation": np.nanmax(deviation.values),
+            "max_rel_deviation": np.nanmax(relative_deviation.values),
+            "memory_float64_mb": values_64.memory_usage().sum() / 1e6,
+            "memory_float32_mb": values_32.memory_usage().sum() / 1e6,
+        }
+    return pd.DataFrame.from_dict(report, orient="index")
+
+
+def main():
+    """
+    Writes the precision report for all shipped datasets
+    to results/precision_report.csv
+    Arguments:
+        None
+    Returns:
+        None
+    """
+    datasets = {
+        "LME": ("data/lme_data/seaweed_environment_data_in_nuclear_war.csv", "lme"),
+        "US": ("data/interim_data/150tg/data_gridded_all_parameters_US.pkl", "grid"),
+        "AUS": ("data/interim_data/150tg/data_gridded_all_parameters_AUS.pkl", "grid"),
+    }
+    reports = []
+    for name, (file, lme_or_grid) in datasets.items():
+        if not os.path.isfile(file):
+            print("Skipping {}, {} does not exist".format(name, file))
+            continue
+        print("Comparing the precision for {}".format(name))
+        report = compare_precision(file, lme_or_grid)
+        report.insert(0, "dataset", name)
+        reports.append(report)
+    report = pd.concat(reports)
+    report.index.name = "parameter"
+    print(report)
+    report.to_csv("results" + os.sep + "precision_report.csv", sep=";")
+
+
+if __name__ == "__main__":
+    main()
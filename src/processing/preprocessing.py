@@ -7,6 +7,14 @@ import pickle
 import pandas as pd
 import xarray as xr
 
+from src import instrumentation
+from src.processing.read_files import (
+    FIRST_MONTH_SINCE_WAR,
+    MODEL_VARIABLES,
+    RAW_VARIABLES,
+    needed_variables,
+)
+
 
 def get_area(path, file):
     """
@@ -28,18 +36,25 @@ def get_area(path, file):
     area.to_csv("area_grid.csv", sep=";")
 
 
-def prepare_gridded_data(path, folder, scenario, file_ending, global_or_country):
+@instrumentation.instrumented("prepare_gridded_data")
+def prepare_gridded_data(
+    path, folder, scenario, file_ending, global_or_country, extra_variables=None
+):
     """
     Reads in the pickles of the geodataframes of the
     different environmental paramters. Checks if they
     all have the same geometry and reorders them to fit
-    the rest of the code.
+    the rest of the code. Only the variables the model uses
+    are read and stored. Cells where a variable is missing
+    in all months (e.g. land) are not stored.
     Arguments:
         path: the path for the pickled files
         folder: the folder where the pickled files are
         file_ending: the ending of the pickled files
         global_or_country: if "global", the global data is used
         scenario: the scenario to use (e.g. 150tg)
+        extra_variables: a list of further variables to store,
+            e.g. ["iron"] for research
     Returns:
         None, but saves a pickle of the dictionary of geo
         dataframes. Each geodataframe is assigned a key
@@ -47,14 +62,11 @@ def prepare_gridded_data(path, folder, scenario, file_ending, global_or_country)
         and longitude.
     """
     # Read in all the geopandas dataframes for the environmental parameters
+    variables = needed_variables(extra_variables=extra_variables)
     env_params = {
-        "NO3": "nitrate",
-        "NH4": "ammonium",
-        "PAR_avg": "illumination",
-        "PO4": "phosphate",
-        "SALT": "salinity",
-        "TEMP": "temperature",
-        "Fe": "iron",
+        science_name: variable
+        for science_name, variable in RAW_VARIABLES.items()
+        if variable in variables
     }
     dict_env_dfs = {}
     for science_name in env_params.keys():
@@ -99,17 +111,27 @@ def prepare_gridded_data(path, folder, scenario, file_ending, global_or_country)
         concat_latlon_dfs = concat_latlon_dfs.loc[
             :, ~concat_latlon_dfs.columns.duplicated()
         ].copy()
+        # Cells without any data for a variable can never have a value
+        if concat_latlon_dfs[MODEL_VARIABLES].isna().all().any():
+            continue
         # Add a column with the month since war. This replaces the
         # time column, which only contains arbitrary numbers and not real dates
         concat_latlon_dfs["months_since_war"] = list(
-            range(-4, concat_latlon_dfs.shape[0] - 4, 1)
+            range(
+                FIRST_MONTH_SINCE_WAR,
+                FIRST_MONTH_SINCE_WAR + concat_latlon_dfs.shape[0],
+            )
         )
         # Convert back to geodataframe before saving
         data_dict[lat_lon] = concat_latlon_dfs
     # Make pickle out of it, so we don't have to run this every time
     full_path = path + os.sep + "data" + os.sep + "interim_data" + os.sep + scenario
     with open(
-        full_path + os.sep + "data_gridded_all_parameters_" + global_or_country + ".pkl",
+        full_path
+        + os.sep
+        + "data_gridded_all_parameters_"
+        + global_or_country
+        + ".pkl",
         "wb",
     ) as handle:
         pickle.dump(data_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
@@ -122,10 +144,15 @@ if __name__ == "__main__":
         prepare_gridded_data(
             ".", "gridded_data_global", scenario, "120_months_" + scenario, "global"
         )
-    # Also prepare the test dataset with only the US
-    prepare_gridded_data(
-        ".", "gridded_data_test_dataset_US_only", "150tg", "36_months_150tg", "US"
-    )
+    # Also prepare the test datasets with only the US and Australia
+    for country in ["US", "AUS"]:
+        prepare_gridded_data(
+            ".",
+            "gridded_data_test_dataset_" + country + "_only",
+            "150tg",
+            "36_months_150tg",
+            country,
+        )
     # Prepare the control run
     prepare_gridded_data(
         ".", "gridded_data_global", "control", "120_months_control", "global"
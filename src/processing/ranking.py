@@ -0,0 +1,258 @@
+"""
+Finds the best grid cells for seaweed farming. Every cell is scored by a
+metric of its growth rate, e.g. the mean over a window of months or the
+mean of its worst year, and the k cells with the highest score are kept.
+The cells are read in chunks and only the current top k survive a chunk,
+which is found by partial selection instead of sorting. This way the
+memory needed is one chunk plus the top k, regardless of the size of the
+grid or the number of scenarios.
+
+Optionally the cells have to be among the best min_rank cells of every
+scenario. They are then ranked by their worst score over all scenarios.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.processing.aggregates import period_labels
+
+
+def window_mean(values, months_since_war):
+    """
+    Calculates the mean of every cell, ignoring nan
+    Arguments:
+        values: numpy array with the axes (cell, month)
+        months_since_war: the months since war of the columns
+    Returns:
+        numpy array of the score of every cell
+    """
+    valid = ~np.isnan(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(valid, values, 0).sum(axis=1) / valid.sum(axis=1)
+
+
+def worst_month(values, months_since_war):
+    """
+    Finds the lowest value of every cell, ignoring nan
+    Arguments:
+        values: numpy array with the axes (cell, month)
+        months_since_war: the months since war of the columns
+    Returns:
+        numpy array of the score of every cell
+    """
+    return np.fmin.reduce(values, axis=1)
+
+
+def worst_year(values, months_since_war):
+    """
+    Finds the lowest annual mean of every cell, ignoring nan
+    Arguments:
+        values: numpy array with the axes (cell, month)
+        months_since_war: the months since war of the columns
+    Returns:
+        numpy array of the score of every cell
+    """
+    labels = period_labels(months_since_war, "annual")
+    annual_means = [
+        window_mean(values[:, labels == year], None) for year in np.unique(labels)
+    ]
+    return np.fmin.reduce(np.stack(annual_means, axis=1), axis=1)
+
+
+# The metrics the cells can be ranked by, higher is better
+METRICS = {"mean": window_mean, "worst_month": worst_month, "worst_year": worst_year}
+
+
+class TopK:
+    """
+    The k cells with the highest scores seen so far
+    """
+
+    def __init__(self, k):
+        assert k > 0, "k has to be positive"
+        self.k = k
+        self.scores = np.empty(0)
+        self.lats = np.empty(0)
+        self.lons = np.empty(0)
+
+    def add(self, scores, lats, lons):
+        """
+        Adds the scores of a chunk of cells and keeps the k best.
+        Cells with a nan score are ignored
+        Arguments:
+            scores: numpy array of the scores
+            lats: numpy array of the latitudes of the cells
+            lons: numpy array of the longitudes of the cells
+        Returns:
+            None
+        """
+        valid = ~np.isnan(scores)
+        self.scores = np.concatenate([self.scores, scores[valid]])
+        self.lats = np.concatenate([self.lats, np.asarray(lats)[valid]])
+        self.lons = np.concatenate([self.lons, np.asarray(lons)[valid]])
+        if len(self.scores) > self.k:
+            # Only the best k are selected, they are not sorted
+            best = np.argpartition(-self.scores, self.k - 1)[: self.k]
+            self.scores = self.scores[best]
+            self.lats = self.lats[best]
+            self.lons = self.lons[best]
+
+    def result(self):
+        """
+        Sorts the best cells
+        Arguments:
+            None
+        Returns:
+            a series of the scores, sorted from the best cell, with the
+            cells as index
+        """
+        order = np.argsort(-self.scores, kind="stable")
+        return pd.Series(
+            self.scores[order],
+            index=pd.MultiIndex.from_arrays(
+                [self.lats[order], self.lons[order]], names=["lat", "lon"]
+            ),
+            name="score",
+        )
+
+
+def iterate_chunks(source, parameter, cells_per_chunk):
+    """
+    Reads the values of a parameter chunk by chunk
+    Arguments:
+        source: a dataframe with the cells as index and the months since war
+            as columns, a pickle of such a dataframe, or a netCDF file
+            as written by chunked_model.run_chunked or results_store, with
+            TLAT and TLONG as coordinates. Only the netCDF file is read
+            chunk by chunk, a pickle has to be loaded at once
+        parameter: the parameter to read from a netCDF file
+        cells_per_chunk: the number of cells in one chunk
+    Returns:
+        a generator of tuples of the lats, the lons, the values with the
+        axes (cell, month) and the months since war of one chunk
+    """
+    if isinstance(source, str) and os.path.splitext(source)[1] == ".nc":
+        with xr.open_dataset(source) as data_set:
+            data_array = data_set[parameter]
+            months_since_war = data_array["months_since_war"].values
+            # The cells are either along one dimension or on a grid,
+            # e.g. (nlat, nlon), which is read in blocks of rows
+            cell_dims = [dim for dim in data_array.dims if dim != "months_since_war"]
+            row_size = int(np.prod([data_array.sizes[dim] for dim in cell_dims[1:]]))
+            rows_per_chunk = max(1, cells_per_chunk // row_size)
+            for start in range(0, data_array.sizes[cell_dims[0]], rows_per_chunk):
+                chunk = data_array.isel(
+                    {cell_dims[0]: slice(start, start + rows_per_chunk)}
+                ).transpose(*cell_dims, "months_since_war")
+                yield (
+                    np.ravel(chunk["TLAT"].transpose(*cell_dims).values),
+                    np.ravel(chunk["TLONG"].transpose(*cell_dims).values),
+                    chunk.values.reshape(-1, len(months_since_war)),
+                    months_since_war,
+                )
+        return
+    if isinstance(source, str):
+        source = pd.read_pickle(source)
+    months_since_war = np.asarray(source.columns)
+    lats = source.index.get_level_values(0).values
+    lons = source.index.get_level_values(1).values
+    for start in range(0, len(source), cells_per_chunk):
+        stop = start + cells_per_chunk
+        yield (
+            lats[start:stop],
+            lons[start:stop],
+            source.values[start:stop],
+            months_since_war,
+        )
+
+
+def window_columns(months_since_war, window):
+    """
+    Finds the columns of a window of months
+    Arguments:
+        months_since_war: the months since war of the columns
+        window: a tuple of the first and last month since war, all if None
+    Returns:
+        a boolean numpy array, True for the columns in the window
+    """
+    months_since_war = np.asarray(months_since_war)
+    if window is None:
+        return np.ones(len(months_since_war), dtype=bool)
+    first, last = window
+    in_window = (months_since_war >= first) & (months_since_war <= last)
+    assert in_window.any(), "No months between {} and {}".format(first, last)
+    return in_window
+
+
+def top_cells(
+    source,
+    k=10,
+    metric="mean",
+    window=None,
+    parameter="seaweed_growth_rate",
+    cells_per_chunk=10000,
+):
+    """
+    Finds the k cells with the highest score in one scenario
+    Arguments:
+        source: the growth rate, see iterate_chunks
+        k: the number of cells to find
+        metric: one of the keys of METRICS
+        window: a tuple of the first and last month since war, all if None
+        parameter: the parameter to read from a netCDF file
+        cells_per_chunk: the number of cells scored at once
+    Returns:
+        a series of the scores of the best cells, sorted from the best
+        cell, with the cells as index
+    """
+    assert metric in METRICS, "metric has to be one of {}".format(list(METRICS))
+    top = TopK(k)
+    for lats, lons, values, months_since_war in iterate_chunks(
+        source, parameter, cells_per_chunk
+    ):
+        columns = window_columns(months_since_war, window)
+        scores = METRICS[metric](values[:, columns], months_since_war[columns])
+        top.add(scores, lats, lons)
+    return top.result()
+
+
+def robust_top_cells(
+    sources,
+    k=10,
+    min_rank=100,
+    metric="mean",
+    window=None,
+    parameter="seaweed_growth_rate",
+    cells_per_chunk=10000,
+):
+    """
+    Finds the k cells that are among the best min_rank cells in every
+    scenario, ranked by their lowest score over all scenarios
+    Arguments:
+        sources: a dictionary with the scenarios as keys and the
+            growth rate as values, see iterate_chunks. All scenarios
+            have to be on the same grid
+        k: the number of cells to find
+        min_rank: the rank every cell has to reach in every scenario
+        metric: one of the keys of METRICS
+        window: a tuple of the first and last month since war, all if None
+        parameter: the parameter to read from a netCDF file
+        cells_per_chunk: the number of cells scored at once
+    Returns:
+        a dataframe of the best cells, sorted from the best cell, with
+        the cells as index, the score of every scenario as columns
+        and the lowest score of all scenarios as column "score"
+    """
+    assert min_rank >= k, "min_rank has to be at least k"
+    scores = {
+        scenario: top_cells(
+            source, min_rank, metric, window, parameter, cells_per_chunk
+        )
+        for scenario, source in sources.items()
+    }
+    # Only the cells that are in the top of every scenario are left
+    ranking = pd.concat(scores, axis=1, join="inner")
+    ranking["score"] = ranking.min(axis=1)
+    return ranking.sort_values("score", ascending=False, kind="stable").iloc[:k]
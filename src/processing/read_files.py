@@ -4,24 +4,126 @@ Reads in the ocean data after nuclear war provided by Cherryl Harrison
 import os
 import pickle
 
+import numpy as np
 import pandas as pd
 
+from src.processing.grid_index import GridIndex
+
+# The data starts three months before the nuclear war
+FIRST_MONTH_SINCE_WAR = -3
+
+# Names of all variables in the climate model output and in the seaweed model
+RAW_VARIABLES = {
+    "NO3": "nitrate",
+    "NH4": "ammonium",
+    "PAR_avg": "illumination",
+    "PO4": "phosphate",
+    "SALT": "salinity",
+    "TEMP": "temperature",
+    "Fe": "iron",
+}
+
+# The environmental variables every factor of the model depends on
+FACTOR_VARIABLES = {
+    "salinity_factor": ["salinity"],
+    "temp_factor": ["temperature"],
+    "nutrient_factor": ["nitrate", "ammonium", "phosphate"],
+    "illumination_factor": ["illumination"],
+}
+
+# The environmental variables used by the model
+MODEL_VARIABLES = [
+    variable for variables in FACTOR_VARIABLES.values() for variable in variables
+]
+
+# The columns every cell of the gridded data has besides the variables
+GRID_COLUMNS = ["TLONG", "TLAT", "months_since_war"]
+
+
+def needed_variables(factors=None, extra_variables=None):
+    """
+    Finds the environmental variables that have to be read and stored.
+    Variables that no factor uses (e.g. iron) are skipped, unless they
+    are explicitly kept, e.g. for research
+    Arguments:
+        factors: the factors to calculate, all factors of the model if None
+        extra_variables: a list of further variables to keep
+    Returns:
+        a list of the variables, in the order of RAW_VARIABLES
+    """
+    if factors is None:
+        factors = list(FACTOR_VARIABLES)
+    unknown = set(factors) - set(FACTOR_VARIABLES)
+    assert not unknown, "Unknown factors {}".format(sorted(unknown))
+    needed = {variable for factor in factors for variable in FACTOR_VARIABLES[factor]}
+    if extra_variables is not None:
+        unknown = set(extra_variables) - set(RAW_VARIABLES.values())
+        assert not unknown, "Unknown variables {}".format(sorted(unknown))
+        needed |= set(extra_variables)
+    return [variable for variable in RAW_VARIABLES.values() if variable in needed]
+
+
+def select_months(months, number_of_months):
+    """
+    Finds the rows of the data that belong to a selection of months.
+    The months are counted since the beginning of the nuclear war and the
+    data starts at FIRST_MONTH_SINCE_WAR
+    Arguments:
+        months: None for all months, an iterable of months since war
+            (e.g. range(0, 12) for the first year) or a boolean mask
+            with one entry per month in the data
+        number_of_months: the number of months in the data
+    Returns:
+        positions: numpy array of the row positions of the selected months
+        months_since_war: list of the selected months since war
+    """
+    all_months = np.arange(
+        FIRST_MONTH_SINCE_WAR, FIRST_MONTH_SINCE_WAR + number_of_months
+    )
+    if months is None:
+        positions = np.arange(number_of_months)
+    else:
+        months = np.asarray(list(months))
+        if months.dtype == bool:
+            assert (
+                len(months) == number_of_months
+            ), "The mask has {} entries, but the data has {} months".format(
+                len(months), number_of_months
+            )
+            positions = np.flatnonzero(months)
+        else:
+            assert np.isin(
+                months, all_months
+            ).all(), "The data only covers the months {} to {}".format(
+                all_months[0], all_months[-1]
+            )
+            positions = np.searchsorted(all_months, np.unique(months))
+    assert len(positions) > 0, "No months selected"
+    return positions, all_months[positions].tolist()
+
 
 class DataLME:
     """
     Creates a data object for the LME
     Meant to only read in the data once
-    and provide the data for each LME as needed
+    and provide the data for each LME as needed.
+    Optionally only keeps a selection of months
+    and converts the data to another floating point type
     """
 
-    def __init__(self, file):
+    def __init__(self, file, months=None, dtype=None):
         assert file is not None
         self.file = file
         self.lme_data = None
         self.lme_dict = {}
+        self.months_since_war = None
         # Prepare the data
         self.read_data_lme()
         self.sort_data_lme()
+        self.select_months(months)
+        if dtype is not None:
+            for lme_number, lme_df in self.lme_dict.items():
+                self.lme_dict[lme_number] = lme_df.astype(dtype)
 
     def read_data_lme(self):
         """
@@ -66,6 +168,22 @@ class DataLME:
             # Set those to 0
             self.lme_dict[i]["nitrate"] = self.lme_dict[i]["nitrate"].clip(lower=0)
 
+    def select_months(self, months=None):
+        """
+        Removes all months from the data that are not selected
+        Arguments:
+            months: None for all months, an iterable of months since war
+                or a boolean mask with one entry per month
+        Returns:
+            None
+        """
+        number_of_months = len(next(iter(self.lme_dict.values())))
+        positions, self.months_since_war = select_months(months, number_of_months)
+        if months is None:
+            return
+        for lme_number, lme_df in self.lme_dict.items():
+            self.lme_dict[lme_number] = lme_df.iloc[positions]
+
     def provide_data_lme(self, lme_number):
         """
         Provides the data for a given LME
@@ -76,26 +194,78 @@ class DataLME:
         """
         return self.lme_dict[lme_number]
 
+    def provide_data_arrays(self, variables):
+        """
+        Provides the data of all LMEs as arrays, so they can
+        be used for vectorized calculations
+        Arguments:
+            variables: a list of the environmental variables to provide
+        Returns:
+            a dictionary with one numpy array with the axes (lme, month)
+            per variable. The LMEs are in the order of their numbers
+        """
+        return {
+            variable: np.stack(
+                [lme_df[variable].values for lme_df in self.lme_dict.values()]
+            )
+            for variable in variables
+        }
+
 
 class DataGrid:
     """
     Creates a data object for the gridded data
     Meant to only read in the data once
-    and provide the data for each grid cell as needed
+    and provide the data for each grid cell as needed.
+    Optionally only keeps the cells within a bounding box,
+    a list of cell ids or a polygon and a selection of months.
+    The data is stored in single precision by the preprocessing,
+    but can be converted to another floating point type.
+    Cells without any data (e.g. land) are dropped, as they can never
+    produce a value. Cells with some months missing are kept and the
+    missing months are tracked in a mask.
+    Only the variables the model uses are kept, further variables
+    in the file have to be asked for with extra_variables.
     """
 
-    def __init__(self, file):
+    def __init__(
+        self,
+        file,
+        bbox=None,
+        cell_ids=None,
+        polygon=None,
+        months=None,
+        dtype=None,
+        drop_missing=True,
+        extra_variables=None,
+    ):
         assert file is not None
         self.file = file
+        self.variables = needed_variables(extra_variables=extra_variables)
         self.grid_dict = {}
+        self.grid_index = None
+        self.months_since_war = None
+        # All selected cells, including the ones without data
+        self.full_grid = []
+        # The cells that were dropped, as they do not have any data
+        self.dropped_cells = []
+        # The missing months of the cells that only have some months missing
+        self.missing_mask = {}
         # Prepare the data
         self.read_data_grid()
         # The gridded data does not have to be sorted
         # As it is already sorted in prep_data.py
+        self.select_cells(bbox, cell_ids, polygon)
+        self.select_months(months)
+        self.mask_missing_data(drop_missing)
+        if dtype is not None:
+            self.convert_dtype(dtype)
 
     def read_data_grid(self):
         """
-        Reads in the gridded data
+        Reads in the gridded data and removes the variables that are
+        not needed. Files written by an older preprocessing still
+        contain all variables, which are removed after reading
         Arguments:
             None
         Returns:
@@ -103,6 +273,103 @@ class DataGrid:
         """
         with open(self.file, "rb") as handle:
             self.grid_dict = pickle.load(handle)
+        # All cells have the same columns
+        columns = list(next(iter(self.grid_dict.values())).columns)
+        missing = set(self.variables) - set(columns)
+        assert not missing, "The file does not contain {}".format(sorted(missing))
+        keep = [
+            column
+            for column in columns
+            if column in GRID_COLUMNS or column in self.variables
+        ]
+        if len(keep) < len(columns):
+            for lat_lon, cell_df in self.grid_dict.items():
+                self.grid_dict[lat_lon] = cell_df[keep]
+
+    def select_cells(self, bbox=None, cell_ids=None, polygon=None):
+        """
+        Removes all grid cells that do not match the selection and
+        builds the spatial index over the remaining cells
+        Arguments:
+            bbox: a tuple of (lat_min, lat_max, lon_min, lon_max)
+            cell_ids: a list of lat_lon tuples
+            polygon: a shapely (multi)polygon with longitudes from -180 to 180
+        Returns:
+            None
+        """
+        self.grid_index = GridIndex(self.grid_dict.keys())
+        if bbox is None and cell_ids is None and polygon is None:
+            return
+        selected = self.grid_index.select(bbox, cell_ids, polygon)
+        self.grid_dict = {lat_lon: self.grid_dict[lat_lon] for lat_lon in selected}
+        self.grid_index = GridIndex(selected)
+
+    def select_months(self, months=None):
+        """
+        Removes all months from the data that are not selected
+        Arguments:
+            months: None for all months, an iterable of months since war
+                or a boolean mask with one entry per month
+        Returns:
+            None
+        """
+        number_of_months = len(next(iter(self.grid_dict.values())))
+        positions, self.months_since_war = select_months(months, number_of_months)
+        if months is None:
+            return
+        for lat_lon, cell_df in self.grid_dict.items():
+            self.grid_dict[lat_lon] = cell_df.iloc[positions]
+
+    def mask_missing_data(self, drop_missing=True):
+        """
+        Finds the cells and months for which any of the environmental variables
+        is missing. Cells where a variable is missing in all months are dropped,
+        for all other cells with missing data the missing months are kept
+        in self.missing_mask
+        Arguments:
+            drop_missing: if False, the cells without data are kept
+        Returns:
+            None
+        """
+        self.full_grid = list(self.grid_index.lat_lons)
+        missing = np.zeros(
+            (len(self.full_grid), len(self.months_since_war)), dtype=bool
+        )
+        all_missing = np.zeros(len(self.full_grid), dtype=bool)
+        # One variable at a time, so only one array of the whole grid is in memory
+        for variable in MODEL_VARIABLES:
+            variable_missing = np.isnan(self.provide_data_arrays([variable])[variable])
+            missing |= variable_missing
+            all_missing |= variable_missing.all(axis=1)
+        partially_missing = missing.any(axis=1) & ~all_missing
+        self.missing_mask = {
+            self.full_grid[i]: missing[i] for i in np.nonzero(partially_missing)[0]
+        }
+        if not drop_missing or not all_missing.any():
+            return
+        self.dropped_cells = [self.full_grid[i] for i in np.nonzero(all_missing)[0]]
+        for lat_lon in self.dropped_cells:
+            del self.grid_dict[lat_lon]
+        self.grid_index = GridIndex(
+            [
+                lat_lon
+                for lat_lon, dropped in zip(self.full_grid, all_missing)
+                if not dropped
+            ]
+        )
+
+    def convert_dtype(self, dtype):
+        """
+        Converts the environmental variables to another floating point type
+        Arguments:
+            dtype: the floating point type, e.g. np.float32
+        Returns:
+            None
+        """
+        for lat_lon, cell_df in self.grid_dict.items():
+            self.grid_dict[lat_lon] = cell_df.astype(
+                {variable: dtype for variable in self.variables}
+            )
 
     def provide_data_grid(self, lat_lon):
         """
@@ -115,6 +382,47 @@ class DataGrid:
         """
         return self.grid_dict[lat_lon]
 
+    def provide_data_arrays(self, variables):
+        """
+        Provides the data of all grid cells as arrays, so they can
+        be used for vectorized calculations
+        Arguments:
+            variables: a list of the environmental variables to provide
+        Returns:
+            a dictionary with one numpy array with the axes (cell, month)
+            per variable. The cells are in the order of the grid index
+        """
+        return {
+            variable: np.stack(
+                [
+                    self.grid_dict[lat_lon][variable].values
+                    for lat_lon in self.grid_index.lat_lons
+                ]
+            )
+            for variable in variables
+        }
+
+    def update_data_arrays(self, arrays, lat_lons):
+        """
+        Writes arrays as provided by provide_data_arrays back to some grid
+        cells, e.g. after the values out of range were clipped or masked
+        Arguments:
+            arrays: a dictionary with one numpy array with the axes (cell, month)
+                per variable. The cells are in the order of the grid index
+            lat_lons: the lat_lon tuples of the cells to update
+        Returns:
+            None
+        """
+        positions = {
+            lat_lon: position
+            for position, lat_lon in enumerate(self.grid_index.lat_lons)
+        }
+        for lat_lon in lat_lons:
+            cell_df = self.grid_dict[lat_lon].copy()
+            for variable, values in arrays.items():
+                cell_df[variable] = values[positions[lat_lon]]
+            self.grid_dict[lat_lon] = cell_df
+
 
 def read_area_file(path, file):
     """
@@ -130,3 +438,31 @@ def read_area_file(path, file):
         pd.read_csv(path + os.sep + file, sep=";", index_col=[0, 1])
     )
     return area_data
+
+
+def match_areas(areas, lat_lons):
+    """
+    Finds the area of every grid cell
+    Arguments:
+        areas: a dataframe with the index TLONG, TLAT and the column TAREA
+            as read by read_area_file
+        lat_lons: a list of lat_lon tuples
+    Returns:
+        a numpy array with the area of every cell, nan for cells without an area
+    """
+    areas_reset = areas.reset_index()
+    # Round the lat lon values to 4 decimals to make sure they match
+    area_lookup = pd.Series(
+        areas_reset["TAREA"].values,
+        index=pd.MultiIndex.from_arrays(
+            [areas_reset["TLAT"].round(4), areas_reset["TLONG"].round(4)]
+        ),
+    )
+    area_lookup = area_lookup[~area_lookup.index.duplicated()]
+    grid_cells = pd.MultiIndex.from_arrays(
+        [
+            np.round([lat for lat, _ in lat_lons], 4),
+            np.round([lon for _, lon in lat_lons], 4),
+        ]
+    )
+    return area_lookup.reindex(grid_cells).values
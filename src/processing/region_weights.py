@@ -0,0 +1,251 @@
+"""
+Aggregates the model output to regions defined by polygons, e.g. countries,
+admin-1 units, LMEs or EEZs. The grid cells are intersected with the polygons
+once and the result is kept as a sparse matrix with one row per region and
+one column per cell, holding the area of every cell that lies in the region.
+The area weighted time series of all regions are then one sparse matrix
+product with the (cell, month) values of a parameter. The matrix can be
+saved and loaded, so the polygons only have to be intersected once per grid.
+
+A cell belongs as a whole to every region its center lies in. The outlines
+of the cells of the curvilinear grid are not known, only their centers, so
+the fraction of a cell that overlaps a region is not calculated. Cells on
+the border of a region are therefore either fully in or fully out of it.
+"""
+import hashlib
+import os
+import warnings
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from src.processing.grid_index import GridIndex
+
+# The polygon sets shipped with the repository and the column
+# that holds the unique name of every region
+POLYGON_SETS = {
+    "countries": (
+        "data/geospatial_information/Countries/ne_50m_admin_0_countries.shp",
+        "ADMIN",
+    ),
+    "admin_1": (
+        "data/geospatial_information/Countries_Admin_1/"
+        "ne_50m_admin_1_states_provinces.shp",
+        "adm1_code",
+    ),
+}
+
+
+def read_polygons(polygon_set):
+    """
+    Reads one of the polygon sets shipped with the repository
+    Arguments:
+        polygon_set: one of the keys of POLYGON_SETS
+    Returns:
+        a GeoSeries of the polygons with the region names as index
+    """
+    file, name_column = POLYGON_SETS[polygon_set]
+    polygons = gpd.read_file(file)
+    return gpd.GeoSeries(
+        polygons.geometry.values, index=polygons[name_column].values, crs=polygons.crs
+    )
+
+
+def source_hash(polygons, areas=None):
+    """
+    Hashes the inputs of the weights besides the grid, to check the cache
+    Arguments:
+        polygons: a GeoSeries of polygons with the region names as index
+        areas: a numpy array with the area of every cell, or None
+    Returns:
+        the hex digest of the region names, the geometries and the areas
+    """
+    digest = hashlib.sha1()
+    digest.update("\n".join(str(region) for region in polygons.index).encode())
+    for geometry in polygons.to_crs("EPSG:4326").to_wkb():
+        digest.update(geometry)
+    if areas is not None:
+        digest.update(np.ascontiguousarray(areas, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+class RegionWeights:
+    """
+    The sparse cell to region weight matrix of one grid and one set
+    of polygons. Meant to be built once and then used to aggregate
+    any number of parameters
+    """
+
+    def __init__(self, matrix, regions, lat_lons, buffer=0, source=None):
+        # The weights with the regions as rows and the cells as columns
+        self.matrix = sparse.csr_matrix(matrix, dtype=float)
+        self.regions = list(regions)
+        self.lat_lons = list(lat_lons)
+        # The buffer the polygons were extended by and the hash of
+        # the polygons and areas (see source_hash), to check the cache
+        self.buffer = buffer
+        self.source = source
+        assert self.matrix.shape == (len(self.regions), len(self.lat_lons))
+        self.cell_index = pd.MultiIndex.from_tuples(self.lat_lons)
+        # Most cells are in no region, so only the others are read
+        self.used_cells = np.unique(self.matrix.indices)
+        self.used_matrix = self.matrix[:, self.used_cells]
+
+    @classmethod
+    def from_polygons(cls, grid_index, polygons, areas=None, buffer=0):
+        """
+        Intersects the cells with the polygons. A cell belongs to every
+        region its center lies in and is weighted by its area
+        Arguments:
+            grid_index: the GridIndex of the cells
+            polygons: a GeoSeries of polygons in EPSG:4326 with the region
+                names as index
+            areas: a numpy array with the area of every cell. If None,
+                all cells are weighted equally
+            buffer: the distance in degrees by which the polygons are extended.
+                The grid only has ocean cells, so land polygons like countries
+                need a buffer to include their coastal waters
+        Returns:
+            the RegionWeights
+        """
+        assert polygons.index.is_unique, "The region names have to be unique"
+        geometry = polygons.to_crs("EPSG:4326").reset_index(drop=True)
+        if buffer:
+            # Buffering in degrees is intended, the distances are small
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                geometry = geometry.buffer(buffer)
+        points = gpd.GeoDataFrame(
+            geometry=gpd.points_from_xy(grid_index.lons, grid_index.lats),
+            crs="EPSG:4326",
+        )
+        # The spatial join only tests the polygons whose bounds contain the cell
+        joined = gpd.sjoin(
+            points, gpd.GeoDataFrame(geometry=geometry), predicate="within"
+        )
+        cells = joined.index.values
+        regions = joined["index_right"].values
+        weights = np.ones(len(grid_index)) if areas is None else areas
+        matrix = sparse.csr_matrix(
+            (np.asarray(weights, dtype=float)[cells], (regions, cells)),
+            shape=(len(polygons), len(grid_index)),
+        )
+        return cls(
+            matrix,
+            polygons.index,
+            grid_index.lat_lons,
+            buffer,
+            source_hash(polygons, areas),
+        )
+
+    def save(self, file):
+        """
+        Saves the weights as compressed numpy file
+        Arguments:
+            file: the path of the file, ending in .npz
+        Returns:
+            None
+        """
+        coordinates = np.array(self.lat_lons, dtype=float).reshape(-1, 2)
+        np.savez_compressed(
+            file,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.array(self.matrix.shape),
+            regions=np.array(self.regions, dtype=str),
+            lats=coordinates[:, 0],
+            lons=coordinates[:, 1],
+            buffer=self.buffer,
+            source=str(self.source),
+        )
+
+    @classmethod
+    def load(cls, file):
+        """
+        Loads weights saved with save
+        Arguments:
+            file: the path of the file
+        Returns:
+            the RegionWeights
+        """
+        with np.load(file) as saved:
+            matrix = sparse.csr_matrix(
+                (saved["data"], saved["indices"], saved["indptr"]),
+                shape=tuple(saved["shape"]),
+            )
+            lat_lons = list(zip(saved["lats"].tolist(), saved["lons"].tolist()))
+            # Weights saved by older versions have no source hash
+            source = str(saved["source"]) if "source" in saved.files else None
+            return cls(
+                matrix,
+                saved["regions"].tolist(),
+                lat_lons,
+                float(saved["buffer"]),
+                source,
+            )
+
+    def aggregate(self, parameter_df):
+        """
+        Calculates the area weighted mean of every region and month.
+        Cells that are nan in a month are left out of the mean of that month
+        Arguments:
+            parameter_df: a dataframe with the cells as index and the
+                months since war as columns, with the cells of the weights
+        Returns:
+            a dataframe with the regions as index and the months as columns,
+            nan for regions without cells with data
+        """
+        if parameter_df.index.equals(self.cell_index):
+            values = parameter_df.values[self.used_cells]
+        else:
+            values = parameter_df.reindex(self.cell_index[self.used_cells]).values
+        has_data = ~np.isnan(values)
+        totals = self.used_matrix @ np.where(has_data, values, 0)
+        weights = self.used_matrix @ has_data.astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = totals / weights
+        return pd.DataFrame(means, index=self.regions, columns=parameter_df.columns)
+
+    def cells_per_region(self):
+        """
+        Counts the cells of every region
+        Arguments:
+            None
+        Returns:
+            a series with the number of cells of every region
+        """
+        return pd.Series(np.diff(self.matrix.indptr), index=self.regions)
+
+
+def load_or_build(file, lat_lons, polygons, areas=None, buffer=0):
+    """
+    Loads the weights from a file, or builds and saves them if the file
+    does not exist or was built for a different grid, polygons or areas
+    Arguments:
+        file: the path of the cache file, ending in .npz
+        lat_lons: a list of the lat_lon tuples of the cells
+        polygons: a GeoSeries of polygons with the region names as index
+        areas: a numpy array with the area of every cell, or None
+        buffer: the distance in degrees by which the polygons are extended
+    Returns:
+        the RegionWeights
+    """
+    lat_lons = list(lat_lons)
+    if os.path.isfile(file):
+        region_weights = RegionWeights.load(file)
+        if (
+            region_weights.lat_lons == lat_lons
+            and region_weights.regions == list(polygons.index)
+            and region_weights.buffer == buffer
+            and region_weights.source == source_hash(polygons, areas)
+        ):
+            return region_weights
+        print("The cached region weights do not match, rebuilding")
+    region_weights = RegionWeights.from_polygons(
+        GridIndex(lat_lons), polygons, areas, buffer
+    )
+    region_weights.save(file)
+    return region_weights
@@ -0,0 +1,71 @@
+"""
+Country and region studies as views of the global run. A region is defined
+by a mask over the cells of the global grid, e.g. a bounding box or a
+polygon. The factors and growth rate of a cell do not depend on the other
+cells, so the parameters of a region are simply sliced from the global
+output instead of being preprocessed and calculated again. Only the steps
+that depend on the region, like the clustering, have to be run for it.
+"""
+from src.processing import results_store
+from src.processing.grid_index import GridIndex
+
+# The regions that can be derived from the global run. Every region is
+# defined by the arguments of GridIndex.select, e.g. a bounding box of
+# (lat_min, lat_max, lon_min, lon_max) or a shapely polygon
+REGIONS = {
+    # The same cells as the US test dataset
+    "US": {"bbox": (17, 54.1, 225, 298.1)},
+    # The same cells as the Australian test dataset, crossing the antimeridian
+    "AUS": {"bbox": (-47.2, -3.3, 101, 184.5)},
+}
+
+
+def region_positions(lat_lons, region):
+    """
+    Finds the positions of the cells of a region in the global grid
+    Arguments:
+        lat_lons: the lat_lon tuples of the global grid
+        region: one of the keys of REGIONS or a dictionary of
+            the arguments of GridIndex.select
+    Returns:
+        a sorted numpy array of the positions of the cells of the region
+    """
+    selection = REGIONS[region] if isinstance(region, str) else region
+    grid_index = GridIndex(lat_lons)
+    return grid_index.query_cell_ids(grid_index.select(**selection))
+
+
+def slice_region(path, parameters, region, name=None, source="global"):
+    """
+    Saves the parameters of a region by slicing them from the output
+    of the global run. Only the cells of the region are read. The results
+    file is the same as if the region had been calculated on its own
+    Arguments:
+        path: the path of the output of the global run
+        parameters: a list of the parameters to slice
+        region: one of the keys of REGIONS or a dictionary of
+            the arguments of GridIndex.select
+        name: the name of the region in the file names, the key of
+            REGIONS if None
+        source: the region of the output to slice from
+    Returns:
+        the number of cells of the region
+    """
+    if name is None:
+        assert isinstance(region, str), "A region given by its selection needs a name"
+        name = region
+    source_file = results_store.open_results(path, source, parameters)
+    # All parameters have the same cells, so they are only selected once
+    positions = region_positions(results_store.read_cells(source_file), region)
+    assert len(positions) > 0, "No cells in region {}".format(name)
+    results_store.save_results(
+        results_store.results_file(path, name),
+        (
+            (
+                parameter,
+                results_store.read_parameter(source_file, parameter, cells=positions),
+            )
+            for parameter in parameters
+        ),
+    )
+    return len(positions)
@@ -0,0 +1,326 @@
+"""
+The output of the model for one scenario and region in a single file,
+instead of one pickle per parameter plus a clustered copy of every pickle.
+The file is a compressed netCDF file in the layout of the output of
+chunked_model.run_chunked: every parameter is a variable with the
+dimensions (months_since_war, cell), with TLAT and TLONG as coordinates
+of the cells. The cluster labels are stored once, as a variable of the cells.
+
+The parameters are stored in chunks of months and cells, so readers only
+read and decompress the chunks of the parameter, months and cells they ask
+for. read_parameter returns the same dataframes as the pickles did.
+"""
+import os
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# The size of the chunks the parameters are stored and compressed in
+MONTHS_PER_CHUNK = 12
+CELLS_PER_CHUNK = 4096
+
+# The zlib compression level, from 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = 4
+
+# The label of the cells that could not be clustered
+NO_CLUSTER = -1
+
+
+def results_file(path, global_or_country):
+    """
+    Finds the results file of a region
+    Arguments:
+        path: the path of the output of the scenario
+        global_or_country: the region
+    Returns:
+        the path of the file
+    """
+    return path + os.sep + "results_" + global_or_country + ".nc"
+
+
+def write_parameter(file, parameter, parameter_df):
+    """
+    Writes a parameter to a results file. The first parameter creates the
+    file, all further parameters have to have the same cells and months
+    Arguments:
+        file: the path of the results file
+        parameter: the name of the parameter
+        parameter_df: a dataframe with the cells as index and
+            the months since war as columns
+    Returns:
+        None
+    """
+    months_since_war = np.asarray(parameter_df.columns, dtype=int)
+    lats = parameter_df.index.get_level_values(0).values.astype(float)
+    lons = parameter_df.index.get_level_values(1).values.astype(float)
+    if os.path.isfile(file):
+        with xr.open_dataset(file) as data_set:
+            assert parameter not in data_set, "{} is already in {}".format(
+                parameter, file
+            )
+            assert np.array_equal(
+                data_set["months_since_war"].values, months_since_war
+            ), "{} has other months than {}".format(parameter, file)
+            assert np.array_equal(data_set["TLAT"].values, lats) and np.array_equal(
+                data_set["TLONG"].values, lons
+            ), "{} has other cells than {}".format(parameter, file)
+        mode = "a"
+    else:
+        mode = "w"
+    data_set = xr.Dataset(
+        {parameter: (("months_since_war", "cell"), parameter_df.values.T)},
+        coords={
+            "months_since_war": months_since_war,
+            "TLAT": ("cell", lats),
+            "TLONG": ("cell", lons),
+        },
+    )
+    if mode == "a":
+        # The coordinates are already in the file
+        data_set = data_set.drop_vars(["months_since_war", "TLAT", "TLONG"])
+    encoding = {
+        parameter: {
+            "zlib": True,
+            "complevel": COMPRESSION_LEVEL,
+            "chunksizes": (
+                min(MONTHS_PER_CHUNK, len(months_since_war)),
+                min(CELLS_PER_CHUNK, len(lats)),
+            ),
+        }
+    }
+    data_set.to_netcdf(file, mode=mode, encoding=encoding)
+
+
+def save_results(file, parameter_dfs, cluster_labels=None):
+    """
+    Saves all parameters of a run to a results file. The file is written
+    atomically, by first writing a temporary file and then replacing the
+    final file with it
+    Arguments:
+        file: the path of the results file
+        parameter_dfs: an iterable of tuples of the name and the dataframe
+            of every parameter, e.g. a generator, so only one parameter
+            has to be in memory at once
+        cluster_labels: a numpy array with the cluster of every cell, or None
+    Returns:
+        None
+    """
+    temporary_file = file + ".tmp"
+    if os.path.isfile(temporary_file):
+        os.remove(temporary_file)
+    for parameter, parameter_df in parameter_dfs:
+        write_parameter(temporary_file, parameter, parameter_df)
+    assert os.path.isfile(temporary_file), "No parameters given"
+    if cluster_labels is not None:
+        save_cluster_labels(temporary_file, cluster_labels)
+    os.replace(temporary_file, file)
+
+
+def save_cluster_labels(file, labels):
+    """
+    Saves the cluster labels of the cells to a results file,
+    replacing the labels that are already in it
+    Arguments:
+        file: the path of the results file
+        labels: a numpy array with the cluster of every cell
+    Returns:
+        None
+    """
+    with netCDF4.Dataset(file, "a") as data_set:
+        assert len(labels) == len(
+            data_set.dimensions["cell"]
+        ), "Expected {} labels".format(len(data_set.dimensions["cell"]))
+        if "cluster" not in data_set.variables:
+            data_set.createVariable("cluster", "i4", ("cell",), zlib=True)
+        data_set.variables["cluster"][:] = np.asarray(labels, dtype=np.int32)
+
+
+def stored_parameters(file):
+    """
+    Lists the parameters in a results file
+    Arguments:
+        file: the path of the results file
+    Returns:
+        a list of the names of the parameters
+    """
+    with xr.open_dataset(file) as data_set:
+        return [
+            name
+            for name, variable in data_set.data_vars.items()
+            if variable.dims == ("months_since_war", "cell")
+        ]
+
+
+def read_cells(file):
+    """
+    Reads the cells of a results file
+    Arguments:
+        file: the path of the results file
+    Returns:
+        a list of the lat_lon tuples of the cells
+    """
+    with xr.open_dataset(file) as data_set:
+        return list(
+            zip(data_set["TLAT"].values.tolist(), data_set["TLONG"].values.tolist())
+        )
+
+
+def has_cluster_labels(file):
+    """
+    Checks if the cells of a results file are clustered
+    Arguments:
+        file: the path of the results file
+    Returns:
+        True if the file has cluster labels
+    """
+    with netCDF4.Dataset(file) as data_set:
+        return "cluster" in data_set.variables
+
+
+def read_cluster_labels(file, cells=None):
+    """
+    Reads the cluster labels of the cells
+    Arguments:
+        file: the path of the results file
+        cells: a sorted numpy array of the positions of the cells, all if None
+    Returns:
+        a numpy array with the cluster of every cell
+    """
+    with xr.open_dataset(file) as data_set:
+        assert "cluster" in data_set, "{} is not clustered yet".format(file)
+        return select_cells(data_set["cluster"], cells).values
+
+
+def select_cells(data_array, cells):
+    """
+    Selects cells of a data array. Only the range between the first and
+    the last cell is read from the file
+    Arguments:
+        data_array: a data array with the dimension cell
+        cells: a sorted numpy array of the positions of the cells, all if None
+    Returns:
+        the data array of the cells
+    """
+    if cells is None:
+        return data_array
+    cells = np.asarray(cells)
+    if len(cells) == 0:
+        return data_array.isel(cell=cells)
+    data_array = data_array.isel(cell=slice(cells[0], cells[-1] + 1)).load()
+    return data_array.isel(cell=cells - cells[0])
+
+
+def read_parameter(file, parameter, months=None, cells=None, with_clusters=False):
+    """
+    Reads a parameter from a results file. Only the chunks with the
+    selected months and cells are read
+    Arguments:
+        file: the path of the results file
+        parameter: the name of the parameter
+        months: a tuple of the first and last month since war, all if None
+        cells: a sorted numpy array of the positions of the cells, all if None
+        with_clusters: if True, the cluster labels are added as column
+            "cluster", like in the clustered pickles of older versions
+    Returns:
+        a dataframe with the cells as index and the months since war as columns
+    """
+    with xr.open_dataset(file) as data_set:
+        assert parameter in data_set, "{} is not in {}".format(parameter, file)
+        data_array = data_set[parameter]
+        if months is not None:
+            data_array = data_array.sel(months_since_war=slice(*months))
+        data_array = select_cells(data_array, cells)
+        parameter_df = pd.DataFrame(
+            data_array.values.T,
+            index=pd.MultiIndex.from_arrays(
+                [data_array["TLAT"].values, data_array["TLONG"].values]
+            ),
+            columns=pd.Index(
+                data_array["months_since_war"].values, name="months_since_war"
+            ),
+        )
+    if with_clusters:
+        parameter_df["cluster"] = read_cluster_labels(file, cells)
+    return parameter_df
+
+
+def pickle_file(path, global_or_country, parameter):
+    """
+    Finds the pickle of a parameter written by older versions
+    Arguments:
+        path: the path of the output of the scenario
+        global_or_country: the region
+        parameter: the name of the parameter
+    Returns:
+        the path of the pickle
+    """
+    return path + os.sep + parameter + "_" + global_or_country + ".pkl"
+
+
+def has_pickles(path, global_or_country, parameters):
+    """
+    Checks if the pickles of older versions exist for all parameters
+    Arguments:
+        path: the path of the output of the scenario
+        global_or_country: the region
+        parameters: the names of the parameters
+    Returns:
+        True if all pickles exist
+    """
+    return all(
+        os.path.isfile(pickle_file(path, global_or_country, parameter))
+        for parameter in parameters
+    )
+
+
+def convert_pickles(path, global_or_country, parameters):
+    """
+    Converts the pickles of a region written by older versions to a
+    results file. The cluster labels are taken from the clustered
+    pickle of the growth rate, if it exists
+    Arguments:
+        path: the path of the output of the scenario
+        global_or_country: the region
+        parameters: the names of the parameters
+    Returns:
+        the path of the results file
+    """
+    file = results_file(path, global_or_country)
+    labels = None
+    clustered_file = (
+        path + os.sep + "seaweed_growth_rate_clustered_" + global_or_country + ".pkl"
+    )
+    if os.path.isfile(clustered_file):
+        labels = pd.read_pickle(clustered_file)["cluster"].values
+    save_results(
+        file,
+        (
+            (parameter, pd.read_pickle(pickle_file(path, global_or_country, parameter)))
+            for parameter in parameters
+        ),
+        labels,
+    )
+    return file
+
+
+def open_results(path, global_or_country, parameters):
+    """
+    Finds the results file of a region, which is converted from the
+    pickles of older versions if it does not exist yet
+    Arguments:
+        path: the path of the output of the scenario
+        global_or_country: the region
+        parameters: the names of the parameters, used for the conversion
+    Returns:
+        the path of the results file
+    """
+    file = results_file(path, global_or_country)
+    if not os.path.isfile(file):
+        assert has_pickles(
+            path, global_or_country, parameters
+        ), "Neither {} nor the pickles of older versions exist".format(file)
+        print("Converting the pickles of {} to {}".format(global_or_country, file))
+        convert_pickles(path, global_or_country, parameters)
+    return file
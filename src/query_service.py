@@ -0,0 +1,405 @@
+"""
+A long-lived local service that keeps the model output of one scenario and
+region in memory and answers queries about it. This way looking up a few
+cells or months does not mean loading the results file or running the model again.
+
+The service listens on a socket on localhost. Every request is one line of
+JSON and is answered by one line of JSON. The requests are handled
+asynchronously, so several clients can be connected at the same time.
+Regional summaries are cached, so repeated queries are answered from memory.
+
+Requests:
+    {"query": "info"}
+    {"query": "cell", "lat": 17.47, "lon": 296.96, "month": 5,
+     "parameters": ["seaweed_growth_rate"]}
+    {"query": "points", "lats": [17.5, 18.2], "lons": [-63, 296.9],
+     "parameter": "seaweed_growth_rate"}
+    {"query": "region", "bbox": [17, 20, -65, -60], "months": [0, 11],
+     "parameter": "seaweed_growth_rate"}
+    {"query": "summary", "bbox": [17, 20, -65, -60], "months": [0, 11],
+     "parameter": "seaweed_growth_rate", "statistic": "mean"}
+The months are months since war, "months" gives the first and last month.
+"parameters", "bbox" and "months" are optional and default to everything.
+Coordinates do not have to match a cell, the nearest cell is used. Points
+farther than "max_distance" km (default MAX_DISTANCE) from any cell are
+answered with an error.
+
+Start it with python -m src.query_service <scenario> <region>
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import socket
+
+import numpy as np
+
+from src.model.seaweed_model import PARAMETERS
+from src.processing import results_store
+from src.processing.grid_index import GridIndex
+
+DEFAULT_PORT = 8765
+
+# The largest distance in km a point can have from the center of its nearest
+# cell, about the diagonal of a 1° cell at the equator
+MAX_DISTANCE = 160
+
+# The statistics a regional summary can be calculated with, all ignore nan
+STATISTICS = {
+    "mean": np.nanmean,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "median": np.nanmedian,
+}
+
+
+class ResultStore:
+    """
+    Holds the output of the model for one scenario and region in memory
+    and answers the queries. Meant to be created once per service
+    """
+
+    def __init__(self, path, global_or_country, parameters=None, cache_size=256):
+        if parameters is None:
+            parameters = PARAMETERS
+        self.values = {}
+        file = results_store.open_results(path, global_or_country, parameters)
+        for parameter in parameters:
+            parameter_df = results_store.read_parameter(file, parameter)
+            if not self.values:
+                self.grid_index = GridIndex(parameter_df.index)
+                self.months_since_war = parameter_df.columns.tolist()
+            # All parameters are stored in the same cell and month order
+            self.values[parameter] = parameter_df.reindex(
+                index=self.grid_index.lat_lons, columns=self.months_since_war
+            ).values
+        # The summaries are cached, as they are the expensive queries
+        self.summary = functools.lru_cache(maxsize=cache_size)(self.calculate_summary)
+
+    def month_slice(self, months=None):
+        """
+        Finds the columns of a range of months
+        Arguments:
+            months: a list of the first and last month since war, all if None
+        Returns:
+            a slice of the columns of the months
+        """
+        if months is None:
+            return slice(None)
+        first, last = months
+        start = np.searchsorted(self.months_since_war, first, side="left")
+        stop = np.searchsorted(self.months_since_war, last, side="right")
+        assert start < stop, "No data between month {} and {}".format(first, last)
+        return slice(start, stop)
+
+    def month_position(self, month):
+        """
+        Finds the column of a month
+        Arguments:
+            month: the month since war
+        Returns:
+            the position of the month in the data
+        """
+        assert month in self.months_since_war, "No data for month {}".format(month)
+        return self.months_since_war.index(month)
+
+    def nearest_positions(self, lats, lons, max_distance=MAX_DISTANCE):
+        """
+        Finds the positions of the cells nearest to a list of points
+        Arguments:
+            lats: a list of the latitudes of the points
+            lons: a list of the longitudes of the points, in either convention
+            max_distance: the largest distance in km to the nearest cell
+        Returns:
+            positions: a numpy array of the positions of the nearest cells
+            distances: a numpy array of the distances in km to these cells
+        """
+        assert len(lats) == len(lons), "lats and lons need the same length"
+        positions, distances = self.grid_index.query_nearest(lats, lons)
+        for lat, lon, distance in zip(lats, lons, distances):
+            assert distance <= max_distance, "No cell within {} km of {}, {}".format(
+                max_distance, lat, lon
+            )
+        return positions, distances
+
+    def cell_positions(self, bbox=None):
+        """
+        Finds the positions of all cells in a bounding box
+        Arguments:
+            bbox: a list of (lat_min, lat_max, lon_min, lon_max), all if None
+        Returns:
+            a numpy array of the positions of the cells
+        """
+        if bbox is None:
+            return np.arange(len(self.grid_index))
+        return self.grid_index.query_bbox(*bbox)
+
+    def query_cell(self, lat, lon, month, parameters=None, max_distance=MAX_DISTANCE):
+        """
+        Looks up the parameters of the cell nearest to a point in one month
+        Arguments:
+            lat: the latitude of the point
+            lon: the longitude of the point
+            month: the month since war
+            parameters: a list of the parameters, all if None
+            max_distance: the largest distance in km to the nearest cell
+        Returns:
+            a dictionary with the cell, its distance, the month
+            and the value of every parameter
+        """
+        positions, distances = self.nearest_positions([lat], [lon], max_distance)
+        cell = positions[0]
+        column = self.month_position(month)
+        if parameters is None:
+            parameters = list(self.values)
+        return {
+            "cell": list(self.grid_index.lat_lons[cell]),
+            "distance": float(distances[0]),
+            "month": month,
+            "values": {
+                parameter: float(self.values[parameter][cell, column])
+                for parameter in parameters
+            },
+        }
+
+    def query_points(
+        self, parameter, lats, lons, months=None, max_distance=MAX_DISTANCE
+    ):
+        """
+        Looks up the time series of one parameter at the cells nearest to a
+        list of points. All points are looked up in the tree and fetched
+        from the data at once
+        Arguments:
+            parameter: the parameter to look up
+            lats: a list of the latitudes of the points
+            lons: a list of the longitudes of the points
+            months: a list of the first and last month since war, all if None
+            max_distance: the largest distance in km to the nearest cell
+        Returns:
+            a dictionary with the cells, their distances, the months and the
+            values with the points as rows and the months as columns
+        """
+        cells, distances = self.nearest_positions(lats, lons, max_distance)
+        columns = self.month_slice(months)
+        return {
+            "cells": [list(self.grid_index.lat_lons[cell]) for cell in cells],
+            "distances": distances.tolist(),
+            "months": self.months_since_war[columns],
+            "values": self.values[parameter][cells, columns].tolist(),
+        }
+
+    def query_region(self, parameter, bbox=None, months=None):
+        """
+        Looks up the values of one parameter for all cells
+        in a bounding box and a range of months
+        Arguments:
+            parameter: the parameter to look up
+            bbox: a list of (lat_min, lat_max, lon_min, lon_max), all if None
+            months: a list of the first and last month since war, all if None
+        Returns:
+            a dictionary with the cells, the months and the values
+            with the cells as rows and the months as columns
+        """
+        cells = self.cell_positions(bbox)
+        columns = self.month_slice(months)
+        return {
+            "cells": [list(self.grid_index.lat_lons[cell]) for cell in cells],
+            "months": self.months_since_war[columns],
+            "values": self.values[parameter][cells, columns].tolist(),
+        }
+
+    def calculate_summary(self, parameter, statistic, bbox=None, months=None):
+        """
+        Calculates a statistic over all cells in a bounding box for every month.
+        Is called through self.summary, which caches the results
+        Arguments:
+            parameter: the parameter to summarize
+            statistic: one of the keys of STATISTICS
+            bbox: a tuple of (lat_min, lat_max, lon_min, lon_max), all if None
+            months: a tuple of the first and last month since war, all if None
+        Returns:
+            a dictionary with the months, the number of cells and the statistic
+        """
+        assert statistic in STATISTICS, "statistic has to be one of {}".format(
+            list(STATISTICS)
+        )
+        cells = self.cell_positions(bbox)
+        assert len(cells) > 0, "No cells in {}".format(bbox)
+        columns = self.month_slice(months)
+        values = self.values[parameter][cells, columns]
+        return {
+            "months": self.months_since_war[columns],
+            "cells": len(cells),
+            statistic: STATISTICS[statistic](values, axis=0).tolist(),
+        }
+
+    def handle(self, request):
+        """
+        Answers one request
+        Arguments:
+            request: a dictionary as described in the module docstring
+        Returns:
+            a dictionary with the answer, or with an error message
+        """
+        if not isinstance(request, dict):
+            return {"error": "A request has to be a JSON object"}
+        try:
+            query = request.get("query")
+            if query == "info":
+                cache = self.summary.cache_info()
+                return {
+                    "parameters": list(self.values),
+                    "months": self.months_since_war,
+                    "cells": len(self.grid_index),
+                    "cache_hits": cache.hits,
+                    "cache_misses": cache.misses,
+                }
+            if query == "cell":
+                return self.query_cell(
+                    request["lat"],
+                    request["lon"],
+                    request["month"],
+                    request.get("parameters"),
+                    request.get("max_distance", MAX_DISTANCE),
+                )
+            if query == "points":
+                return self.query_points(
+                    request["parameter"],
+                    request["lats"],
+                    request["lons"],
+                    request.get("months"),
+                    request.get("max_distance", MAX_DISTANCE),
+                )
+            if query == "region":
+                return self.query_region(
+                    request["parameter"], request.get("bbox"), request.get("months")
+                )
+            if query == "summary":
+                # The arguments have to be hashable to be cached
+                bbox = request.get("bbox")
+                months = request.get("months")
+                return self.summary(
+                    request["parameter"],
+                    request.get("statistic", "mean"),
+                    None if bbox is None else tuple(bbox),
+                    None if months is None else tuple(months),
+                )
+            return {"error": "Unknown query {}".format(query)}
+        except (AssertionError, KeyError, TypeError, ValueError) as error:
+            return {"error": "{}: {}".format(type(error).__name__, error)}
+
+
+async def handle_connection(store, reader, writer):
+    """
+    Answers all requests of one client, one line of JSON per request
+    Arguments:
+        store: the ResultStore to answer the requests with
+        reader: the stream to read the requests from
+        writer: the stream to write the answers to
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as error:
+                response = {"error": "Invalid JSON: {}".format(error)}
+            else:
+                # Large queries are answered in a thread, so they do
+                # not block the other clients
+                response = await loop.run_in_executor(None, store.handle, request)
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_server(store, port=DEFAULT_PORT):
+    """
+    Starts the service on localhost
+    Arguments:
+        store: the ResultStore to answer the requests with
+        port: the port to listen on, 0 for any free port
+    Returns:
+        the asyncio server
+    """
+    return await asyncio.start_server(
+        functools.partial(handle_connection, store), "127.0.0.1", port
+    )
+
+
+class QueryClient:
+    """
+    A simple blocking client for the service, e.g. for notebooks
+    """
+
+    def __init__(self, port=DEFAULT_PORT):
+        self.connection = socket.create_connection(("127.0.0.1", port))
+        self.stream = self.connection.makefile("rwb")
+
+    def request(self, **request):
+        """
+        Sends one request and waits for the answer
+        Arguments:
+            request: the fields of the request, e.g. query="info"
+        Returns:
+            the answer as dictionary
+        """
+        self.stream.write(json.dumps(request).encode() + b"\n")
+        self.stream.flush()
+        return json.loads(self.stream.readline())
+
+    def close(self):
+        """
+        Closes the connection
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        self.stream.close()
+        self.connection.close()
+
+
+async def serve(store, port=DEFAULT_PORT):
+    """
+    Runs the service until it is interrupted
+    Arguments:
+        store: the ResultStore to answer the requests with
+        port: the port to listen on
+    Returns:
+        None
+    """
+    server = await start_server(store, port)
+    print("Serving on port {}".format(server.sockets[0].getsockname()[1]))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """
+    Loads the output of a scenario and region and serves it
+    Arguments:
+        None
+    Returns:
+        None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("scenario", help="e.g. 150tg")
+    parser.add_argument("region", help="e.g. US or global")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    path = "data" + os.sep + "interim_data" + os.sep + args.scenario
+    print("Loading the output of {} {}".format(args.scenario, args.region))
+    store = ResultStore(path, args.region)
+    asyncio.run(serve(store, args.port))
+
+
+if __name__ == "__main__":
+    main()
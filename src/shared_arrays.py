@@ -0,0 +1,198 @@
+"""
+Shares numpy arrays between processes without copying them. The arrays
+are published once in shared memory and the worker processes only receive
+small handles, which they attach to read-only. This way parallel stages
+can use all cores without every worker holding a pickled copy of the data.
+"""
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# The shared memory created by this process, by name. Arrays in it are
+# used without attaching again, which includes forked worker processes,
+# as they inherit the memory of the owner
+OWNED = {}
+
+# The handles of the current worker process, set by the pool initializer
+WORKER_HANDLES = {}
+
+
+class SharedArrayHandle:
+    """
+    A small picklable description of an array in shared memory.
+    Sending it to a worker process costs a few bytes, regardless
+    of the size of the array
+    """
+
+    def __init__(self, memory_name, shape, dtype, writeable=False):
+        self.memory_name = memory_name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.writeable = writeable
+
+    def attach(self, opened):
+        """
+        Attaches to the shared memory of the array. Memory owned by this
+        process is used directly, other memory is opened and has to be
+        closed with detach_all once the array is not used anymore
+        Arguments:
+            opened: a dictionary of the shared memory opened so far,
+                to which newly opened memory is added
+        Returns:
+            a numpy array backed by the shared memory, which is
+            read-only unless the handle is writeable
+        """
+        memory = OWNED.get(self.memory_name, opened.get(self.memory_name))
+        if memory is None:
+            memory = shared_memory.SharedMemory(name=self.memory_name)
+            opened[self.memory_name] = memory
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=memory.buf)
+        array.flags.writeable = self.writeable
+        return array
+
+
+class SharedArrays:
+    """
+    Owns a set of arrays in shared memory. The arrays are copied into
+    shared memory once, afterwards the handles can be sent to any number
+    of worker processes. The shared memory is freed by close or
+    when the object is used as context manager
+    """
+
+    def __init__(self, arrays=None, outputs=None):
+        # The shared memory of all arrays, by name of the array
+        self.memories = {}
+        # The arrays in the shared memory, writeable by the owner
+        self.arrays = {}
+        # The handles to send to the workers
+        self.handles = {}
+        for name, array in (arrays or {}).items():
+            array = np.asarray(array)
+            self.add(name, array.shape, array.dtype)[...] = array
+        # Outputs are empty arrays the workers can write to
+        for name, (shape, dtype) in (outputs or {}).items():
+            self.add(name, shape, dtype, writeable=True)
+
+    def add(self, name, shape, dtype, writeable=False):
+        """
+        Adds an empty array to the shared memory
+        Arguments:
+            name: the name of the array
+            shape: the shape of the array
+            dtype: the type of the array
+            writeable: if True, the workers can write to the array
+        Returns:
+            the array in shared memory
+        """
+        assert name not in self.arrays, "{} is already shared".format(name)
+        dtype = np.dtype(dtype)
+        # Shared memory cannot be empty
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        memory = shared_memory.SharedMemory(create=True, size=size)
+        self.memories[name] = memory
+        OWNED[memory.name] = memory
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        self.handles[name] = SharedArrayHandle(memory.name, shape, dtype, writeable)
+        return self.arrays[name]
+
+    def close(self):
+        """
+        Frees the shared memory. The arrays cannot be used afterwards
+        Arguments:
+            None
+        Returns:
+            None
+        """
+        self.arrays = {}
+        for memory in self.memories.values():
+            OWNED.pop(memory.name, None)
+            memory.close()
+            memory.unlink()
+        self.memories = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_all(handles, opened):
+    """
+    Attaches to all arrays of a dictionary of handles
+    Arguments:
+        handles: a dictionary with the names and handles of the arrays
+        opened: a dictionary of the shared memory opened so far,
+            to which newly opened memory is added
+    Returns:
+        a dictionary with the names and the attached arrays
+    """
+    return {name: handle.attach(opened) for name, handle in handles.items()}
+
+
+def detach_all(opened):
+    """
+    Closes the shared memory opened by attach_all. The arrays
+    attached to it cannot be used afterwards
+    Arguments:
+        opened: the dictionary of the opened shared memory
+    Returns:
+        None
+    """
+    for memory in opened.values():
+        memory.close()
+    opened.clear()
+
+
+def initialize_worker(handles):
+    """
+    Keeps the handles of the shared arrays in a worker process,
+    so they are not sent again with every task
+    Arguments:
+        handles: a dictionary with the names and handles of the arrays
+    Returns:
+        None
+    """
+    WORKER_HANDLES.clear()
+    WORKER_HANDLES.update(handles)
+
+
+def run_task(function_and_task):
+    """
+    Runs one task in a worker process on the shared arrays. Memory that
+    is not inherited from the owner is attached for the task and closed
+    again afterwards, so the result must not be a view of a shared array
+    Arguments:
+        function_and_task: a tuple of the function and its task
+    Returns:
+        the result of the function
+    """
+    function, task = function_and_task
+    opened = {}
+    arrays = attach_all(WORKER_HANDLES, opened)
+    try:
+        return function(arrays, task)
+    finally:
+        del arrays
+        detach_all(opened)
+
+
+def parallel_map(function, handles, tasks, processes=None):
+    """
+    Runs a function for every task in a pool of worker processes, which
+    all read the same shared arrays. Only the handles and the tasks
+    are sent to the workers
+    Arguments:
+        function: a function at module level, which is called with a
+            dictionary of the attached arrays and a task
+        handles: a dictionary with the names and handles of the arrays
+        tasks: a list of the tasks, e.g. slices of the cells
+        processes: the number of worker processes, all cores if None
+    Returns:
+        a list with the result of every task
+    """
+    with multiprocessing.Pool(
+        processes, initializer=initialize_worker, initargs=(handles,)
+    ) as pool:
+        return pool.map(run_task, [(function, task) for task in tasks])
@@ -3,6 +3,7 @@ This files contains a collection of functions that are used in the main file,
 but are not directly related to the main functionality of the program.
 """
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from shapely.geometry import Point
 from statsmodels.stats.weightstats import DescrStatsW
@@ -52,3 +53,63 @@ def weighted_quantile(data: pd.Series, weights: pd.Series, quantile: float) -> f
     wq = DescrStatsW(data=data, weights=weights)
     quantile = wq.quantile(probs=quantile, return_pandas=False)
     return quantile
+
+
+def weighted_quantile_array(data, weights, quantile, axis: int = 0):
+    """
+    Calculates the weighted quantile along one axis of an array in one
+    vectorized pass. Gives the same result as weighted_quantile for every
+    slice along the axis, but does not have to loop over the slices.
+    Nan values are ignored.
+    Arguments:
+        data: numpy.ndarray - the values to calculate the quantile for
+        weights: numpy.ndarray - one weight per entry along the axis
+        quantile: float or list of floats - the quantile(s) to calculate.
+            Several quantiles only sort the data once
+        axis: int - the axis to calculate the quantile along
+    Returns:
+        numpy.ndarray - the weighted quantiles, with the axis removed. For a
+        list of quantiles, the first axis is the quantile
+    """
+    data = np.moveaxis(np.asarray(data, dtype=float), axis, 0)
+    weights = np.asarray(weights, dtype=float)
+    # Ensure that the data and weights have the same length
+    assert data.shape[0] == len(weights), "The input must have the same length"
+    quantiles = quantile if isinstance(quantile, (list, tuple)) else [quantile]
+    for single_quantile in quantiles:
+        # Ensure that the quantile is between 0 and 1
+        assert isinstance(single_quantile, float), "The quantile must be a float"
+        assert 0 <= single_quantile <= 1, "The quantile must be between 0 and 1"
+    other_shape = data.shape[1:]
+    data = data.reshape(data.shape[0], -1)
+    # Sort the values of every column, nan values are sorted to the end
+    # and get a weight of 0, so they do not count
+    order = np.argsort(data, axis=0, kind="stable")
+    sorted_data = np.take_along_axis(data, order, axis=0)
+    sorted_weights = np.where(np.isnan(sorted_data), 0, weights[order])
+    cumulative_weights = np.cumsum(sorted_weights, axis=0)
+    columns = np.arange(data.shape[1])
+    number_valid = (~np.isnan(sorted_data)).sum(axis=0)
+    results = []
+    for single_quantile in quantiles:
+        targets = single_quantile * cumulative_weights[-1]
+        # Find the first value where the cumulative weight reaches the target
+        positions = (cumulative_weights < targets).sum(axis=0)
+        positions = np.minimum(positions, np.maximum(number_valid - 1, 0))
+        result = sorted_data[positions, columns]
+        # Ties are handled like one value with the summed weight, so the value
+        # after a tie is the first one that is larger than the found value
+        next_positions = (sorted_data <= result).sum(axis=0)
+        end_of_tie = np.maximum(next_positions - 1, 0)
+        # If the target is hit exactly, use the mean with the next value
+        exact_hit = np.abs(targets - cumulative_weights[end_of_tie, columns]) < 1e-10
+        exact_hit &= next_positions < number_valid
+        next_values = sorted_data[
+            np.minimum(next_positions, data.shape[0] - 1), columns
+        ]
+        result = np.where(exact_hit, (result + next_values) / 2, result)
+        result = np.where(number_valid > 0, result, np.nan)
+        results.append(result.reshape(other_shape))
+    if isinstance(quantile, (list, tuple)):
+        return np.stack(results)
+    return results[0]
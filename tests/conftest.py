@@ -0,0 +1,22 @@
+"""
+Prepares the gridded test data, which is generated from the shipped raw
+test dataset instead of being stored in the repository
+"""
+import os
+
+import pytest
+
+from src.processing.preprocessing import prepare_gridded_data
+
+GRID_FILE = "data/interim_data/150tg/data_gridded_all_parameters_US.pkl"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def gridded_test_data():
+    """
+    Preprocesses the US test dataset once, if it was not done yet
+    """
+    if not os.path.isfile(GRID_FILE):
+        prepare_gridded_data(
+            ".", "gridded_data_test_dataset_US_only", "150tg", "36_months_150tg", "US"
+        )
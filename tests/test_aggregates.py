@@ -0,0 +1,97 @@
+"""
+Tests the temporal aggregates of the model output
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.processing import aggregates
+from src.utilities import weighted_quantile
+
+
+def create_parameter_df():
+    """
+    Creates a small parameter dataframe with three cells and 30 months
+    """
+    rng = np.random.default_rng(0)
+    parameter_df = pd.DataFrame(
+        rng.random((3, 30)),
+        index=pd.MultiIndex.from_tuples([(10.0, 200.0), (11.0, 201.0), (12.0, 202.0)]),
+        columns=pd.Index(range(-3, 27), name="months_since_war"),
+    )
+    parameter_df.iloc[1, 5] = np.nan
+    return parameter_df
+
+
+def test_period_labels():
+    """
+    Tests that the years and quarters are counted from the start of the data
+    """
+    labels = aggregates.period_labels(range(-3, 27), "annual")
+    assert list(labels[:12]) == [1] * 12
+    assert list(labels[12:24]) == [2] * 12
+    assert list(labels[24:]) == [3] * 6
+    labels = aggregates.period_labels(range(-3, 27), "quarterly")
+    assert list(labels[:6]) == [1, 1, 1, 2, 2, 2]
+    with pytest.raises(AssertionError):
+        aggregates.period_labels(range(-3, 27), "weekly")
+
+
+def test_aggregate_cells():
+    """
+    Tests that the cell aggregates match a loop over the years
+    """
+    parameter_df = create_parameter_df()
+    cell_aggregates = aggregates.aggregate_cells(parameter_df, "annual")
+    assert list(cell_aggregates["mean"].columns) == [1, 2, 3]
+    for year, start in enumerate(range(-3, 27, 12)):
+        months = parameter_df.loc[:, start : start + 11]
+        assert np.allclose(cell_aggregates["mean"][year + 1], months.mean(axis=1))
+        assert np.allclose(cell_aggregates["min"][year + 1], months.min(axis=1))
+        assert np.allclose(cell_aggregates["max"][year + 1], months.max(axis=1))
+
+
+def test_aggregate_region():
+    """
+    Tests the weighted region aggregates
+    """
+    parameter_df = create_parameter_df()
+    weights = np.array([1.0, 2.0, np.nan])
+    cell_aggregates = aggregates.aggregate_cells(parameter_df, "quarterly")
+    region = aggregates.aggregate_region(cell_aggregates, weights)
+    means = cell_aggregates["mean"].iloc[:2]
+    assert np.allclose(region["mean"], (means.iloc[0] + 2 * means.iloc[1]) / 3)
+    assert np.allclose(region["min"], cell_aggregates["min"].iloc[:2].min())
+    for quarter in region.index:
+        assert region.loc[quarter, 0.5] == weighted_quantile(
+            means[quarter].reset_index(drop=True), pd.Series([1.0, 2.0]), 0.5
+        )
+
+
+def test_has_alignment(tmp_path):
+    """
+    Tests that aggregates of older versions are recognized
+    """
+    cell_aggregates, _ = aggregates.aggregate(create_parameter_df())
+    file = tmp_path / "aggregates.pkl"
+    cell_aggregates.to_pickle(file)
+    assert aggregates.has_alignment(file)
+    cell_aggregates.attrs = {}
+    cell_aggregates.to_pickle(file)
+    assert not aggregates.has_alignment(file)
+
+
+def test_aggregate():
+    """
+    Tests that all period types are aggregated at once
+    """
+    parameter_df = create_parameter_df()
+    cell_aggregates, region_aggregates = aggregates.aggregate(parameter_df)
+    assert list(cell_aggregates.columns.levels[0]) == ["annual", "quarterly"]
+    assert len(cell_aggregates["annual"]["mean"].columns) == 3
+    assert len(cell_aggregates["quarterly"]["mean"].columns) == 10
+    assert len(region_aggregates.loc["annual"]) == 3
+    assert len(region_aggregates.loc["quarterly"]) == 10
+    # The stored aggregates describe how the periods are aligned
+    for aggregates_df in [cell_aggregates, region_aggregates]:
+        assert aggregates_df.attrs == aggregates.ALIGNMENT
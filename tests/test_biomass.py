@@ -0,0 +1,89 @@
+"""
+Tests the calculation of the biomass from the growth rate
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model import biomass as bm
+
+
+def simulate_cell(growth_rates, initial_density, harvest_density):
+    """
+    Simulates the biomass of one cell harvest by harvest,
+    as reference for the vectorized calculation
+    """
+    density = initial_density
+    biomass = []
+    harvest = []
+    for growth_rate in growth_rates:
+        daily_growth = np.log1p(growth_rate * bm.OPTIMAL_GROWTH_RATE / 100)
+        day = 0.0
+        number_of_harvests = 0
+        while daily_growth > 0:
+            days_to_harvest = np.log(harvest_density / density) / daily_growth
+            if day + days_to_harvest > bm.DAYS_PER_MONTH:
+                break
+            day += days_to_harvest
+            density = initial_density
+            number_of_harvests += 1
+        density = density * np.exp(daily_growth * (bm.DAYS_PER_MONTH - day))
+        biomass.append(density)
+        harvest.append(number_of_harvests * (harvest_density - initial_density))
+    return biomass, harvest
+
+
+def test_biomass_without_harvest():
+    """
+    Tests that the biomass grows by the compounded daily growth
+    """
+    growth_rate = np.array([[0.0, 0.5, 1.0], [0.1, 0.1, 0.1]])
+    biomass, harvest = bm.biomass_trajectory(growth_rate, 2.0)
+    expected = 2.0 * np.cumprod((1 + growth_rate * 0.3) ** 30, axis=1)
+    assert np.allclose(biomass, expected)
+    assert (harvest == 0).all()
+
+
+def test_biomass_with_harvest():
+    """
+    Tests that the vectorized harvest matches a simulation cell by cell
+    """
+    rng = np.random.default_rng(1)
+    growth_rate = rng.random((20, 24)) * 0.5
+    growth_rate[3] = 0
+    biomass, harvest = bm.biomass_trajectory(growth_rate, 1.0, 4.0)
+    for cell in range(20):
+        expected_biomass, expected_harvest = simulate_cell(growth_rate[cell], 1.0, 4.0)
+        assert np.allclose(biomass[cell], expected_biomass)
+        assert np.allclose(harvest[cell], expected_harvest)
+    # Without growth nothing is harvested
+    assert (harvest[3] == 0).all()
+    assert (biomass < 4.0).all()
+    with pytest.raises(AssertionError):
+        bm.biomass_trajectory(growth_rate, 4.0, 1.0)
+
+
+def test_days_to_density():
+    """
+    Tests the days to reach the target density
+    """
+    growth_rate = np.array([[0.1] * 12, [0.0] * 12, [0.0, 0.5] + [0.0] * 10])
+    days = bm.days_to_density(growth_rate, 1.0, 10.0)
+    assert days[0] == pytest.approx(np.log(10) / np.log(1.03))
+    assert np.isnan(days[1])
+    assert days[2] == pytest.approx(30 + np.log(10) / np.log(1.15))
+
+
+def test_biomass_from_growth_df():
+    """
+    Tests that the outputs keep the layout of the growth dataframe
+    """
+    growth_df = pd.DataFrame(
+        [[0.1, 0.2, 0.3], [0.0, 0.0, 0.0]],
+        index=pd.MultiIndex.from_tuples([(1.0, 2.0), (3.0, 4.0)]),
+        columns=[-1, 0, 1],
+    )
+    biomass_df, harvest_df, days = bm.biomass_from_growth_df(growth_df, 1.0, 5.0)
+    assert biomass_df.index.equals(growth_df.index)
+    assert list(harvest_df.columns) == [-1, 0, 1]
+    assert days.notna().tolist() == [True, False]
@@ -0,0 +1,83 @@
+"""
+Tests the checkpoints of long runs
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from src.processing.checkpoint import Checkpoint, is_up_to_date, save_atomic
+
+
+def test_checkpoint_resume(tmp_path):
+    """
+    Tests that a new checkpoint object continues where the last one stopped
+    """
+    directory = str(tmp_path / "checkpoint")
+    checkpoint = Checkpoint(directory, file="grid.pkl", cells_per_chunk=10)
+    checkpoint.save("chunk_0", pd.DataFrame({"a": [1, 2]}))
+    checkpoint.mark_done("chunk_0")
+    resumed = Checkpoint(directory, file="grid.pkl", cells_per_chunk=10)
+    assert resumed.is_done("chunk_0")
+    assert not resumed.is_done("chunk_1")
+    assert resumed.load("chunk_0")["a"].tolist() == [1, 2]
+    resumed.remove("chunk_0")
+    assert not os.path.isfile(os.path.join(directory, "chunk_0.pkl"))
+    # No temporary files are left behind
+    assert sorted(os.listdir(directory)) == ["manifest.json"]
+
+
+def test_checkpoint_different_settings(tmp_path):
+    """
+    Tests that a checkpoint cannot be resumed with different settings
+    """
+    directory = str(tmp_path / "checkpoint")
+    Checkpoint(directory, file="grid.pkl", cells_per_chunk=10)
+    with pytest.raises(AssertionError):
+        Checkpoint(directory, file="grid.pkl", cells_per_chunk=20)
+
+
+def test_checkpoint_outputs(tmp_path):
+    """
+    Tests that a step is only done while its outputs exist
+    and that a changed input starts the checkpoint over
+    """
+    directory = str(tmp_path / "checkpoint")
+    input_file = str(tmp_path / "grid.pkl")
+    save_atomic(pd.DataFrame({"a": [1.0]}), input_file)
+    checkpoint = Checkpoint(directory, inputs=[input_file], cells_per_chunk=10)
+    checkpoint.save("chunk_0", pd.DataFrame({"a": [1, 2]}))
+    checkpoint.mark_done("chunk_0")
+    assert checkpoint.is_done("chunk_0", checkpoint.file("chunk_0"))
+    checkpoint.remove("chunk_0")
+    assert checkpoint.is_done("chunk_0")
+    assert not checkpoint.is_done("chunk_0", checkpoint.file("chunk_0"))
+    save_atomic(pd.DataFrame({"a": [1.0, 2.0]}), input_file)
+    resumed = Checkpoint(directory, inputs=[input_file], cells_per_chunk=10)
+    assert not resumed.is_done("chunk_0")
+    resumed.clear()
+    assert not os.path.isdir(directory)
+
+
+def test_is_up_to_date(tmp_path):
+    """
+    Tests that outputs are only up to date if they are newer than the input
+    """
+    input_file = str(tmp_path / "input.pkl")
+    output_file = str(tmp_path / "output.pkl")
+    save_atomic(1, input_file)
+    assert not is_up_to_date([output_file], input_file)
+    save_atomic(2, output_file)
+    assert is_up_to_date([output_file], input_file)
+    os.utime(input_file, ns=(0, os.stat(output_file).st_mtime_ns + 10**9))
+    assert not is_up_to_date([output_file], input_file)
+
+
+def test_save_atomic(tmp_path):
+    """
+    Tests that the data is saved and can be read with pandas
+    """
+    file = str(tmp_path / "data.pkl")
+    save_atomic(pd.DataFrame({"a": [1.0]}), file)
+    assert pd.read_pickle(file)["a"].tolist() == [1.0]
+    assert not os.path.isfile(file + ".tmp")
@@ -0,0 +1,108 @@
+"""
+Tests the out of core execution with xarray and dask
+"""
+import numpy as np
+import pytest
+import xarray as xr
+
+from src.model import seaweed_growth as sg
+from src.model.chunked_model import (
+    add_months_since_war,
+    calculate_growth,
+    dataset_from_pickles,
+    run_chunked,
+)
+from src.model.seaweed_model import SeaweedModel
+
+
+def create_test_dataset():
+    """
+    Creates a small chunked dataset in the time/nlat/nlon layout
+    of the climate model output
+    """
+    rng = np.random.default_rng(42)
+    shape = (12, 4, 6)
+    data_set = xr.Dataset(
+        {
+            "nitrate": (("time", "nlat", "nlon"), rng.uniform(-0.1, 10, shape)),
+            "ammonium": (("time", "nlat", "nlon"), rng.uniform(0, 1, shape)),
+            "phosphate": (("time", "nlat", "nlon"), rng.uniform(0, 1, shape)),
+            "illumination": (("time", "nlat", "nlon"), rng.uniform(0, 150, shape)),
+            "salinity": (("time", "nlat", "nlon"), rng.uniform(20, 40, shape)),
+            "temperature": (("time", "nlat", "nlon"), rng.uniform(-2, 35, shape)),
+        },
+        coords={
+            "TLAT": (("nlat", "nlon"), rng.uniform(-80, 80, shape[1:])),
+            "TLONG": (("nlat", "nlon"), rng.uniform(0, 360, shape[1:])),
+        },
+    )
+    return add_months_since_war(data_set.chunk({"time": -1, "nlat": 2, "nlon": 3}))
+
+
+def test_calculate_growth():
+    """
+    Tests that the chunked calculation gives the same result as the arrays
+    """
+    data_set = create_test_dataset()
+    growth = calculate_growth(data_set)
+    # Nothing is computed yet
+    assert growth["seaweed_growth_rate"].chunks is not None
+    growth = growth.compute()
+    expected = sg.growth_factor_combination_array(
+        sg.illumination_array(data_set["illumination"].values),
+        sg.temperature_array(data_set["temperature"].values),
+        sg.nutrient_array(
+            data_set["nitrate"].values.clip(min=0),
+            data_set["ammonium"].values,
+            data_set["phosphate"].values,
+        )[0],
+        sg.salinity_array(data_set["salinity"].values),
+    )
+    assert np.allclose(growth["seaweed_growth_rate"].values, expected)
+
+
+def test_run_chunked(tmp_path):
+    """
+    Tests that the results are written to disk
+    """
+    output_file = tmp_path / "growth.nc"
+    run_chunked(create_test_dataset(), output_file, num_workers=2)
+    growth = xr.open_dataset(output_file)
+    assert list(growth["months_since_war"].values) == list(range(-3, 9))
+    assert growth["seaweed_growth_rate"].shape == (12, 4, 6)
+    assert float(growth["seaweed_growth_rate"].max()) <= 1
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_dataset_from_pickles(tmp_path, cached):
+    """
+    Tests that the pickles of the US test dataset give the same
+    growth rate as the model on the preprocessed data
+    """
+    cache_file = str(tmp_path / "cache.nc") if cached else None
+    data_set = dataset_from_pickles(
+        ".",
+        "gridded_data_test_dataset_US_only",
+        "150tg",
+        "36_months_150tg",
+        500,
+        cache_file,
+    )
+    assert data_set["temperature"].chunks[1][0] == 500
+    growth = calculate_growth(data_set).compute()
+    model = SeaweedModel()
+    model.add_data_by_grid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    model.calculate_factors()
+    model.calculate_growth_rate()
+    model.create_section_dfs()
+    model_df = model.construct_df_for_parameter("seaweed_growth_rate")
+    lat_lons = list(zip(growth["TLAT"].values, growth["TLONG"].values))
+    positions = [lat_lons.index(lat_lon) for lat_lon in model_df.columns]
+    assert np.allclose(
+        growth["seaweed_growth_rate"].values[:, positions],
+        model_df.values,
+        equal_nan=True,
+    )
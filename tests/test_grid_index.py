@@ -0,0 +1,77 @@
+"""
+Tests the spatial index over the grid cells
+"""
+import pytest
+from shapely.geometry import Polygon
+
+from src.processing.grid_index import GridIndex, convert_longitude
+
+
+def create_test_grid_index():
+    """
+    Creates a small grid index with longitudes in the 0-360 convention
+    """
+    lat_lons = [(10.0, 10.0), (20.0, 20.0), (-10.0, 350.0), (30.0, 190.0), (0.0, 170.0)]
+    return GridIndex(lat_lons)
+
+
+def test_convert_longitude():
+    """
+    Tests the conversion of longitudes to -180 to 180
+    """
+    assert convert_longitude(350) == -10
+    assert convert_longitude(180) == 180
+    assert convert_longitude(10) == 10
+
+
+def test_query_bbox():
+    """
+    Tests the selection of cells by bounding box
+    """
+    grid_index = create_test_grid_index()
+    assert list(grid_index.query_bbox(-15, 15, -20, 15)) == [0, 2]
+    # Longitudes in the 0-360 convention give the same result
+    assert list(grid_index.query_bbox(-15, 15, 340, 15)) == [0, 2]
+    # Boxes can cross the antimeridian
+    assert list(grid_index.query_bbox(-90, 90, 160, -160)) == [3, 4]
+
+
+def test_query_polygon():
+    """
+    Tests the selection of cells by polygon
+    """
+    grid_index = create_test_grid_index()
+    polygon = Polygon([(-20, -20), (25, -20), (25, 25), (-20, 25)])
+    assert list(grid_index.query_polygon(polygon)) == [0, 1, 2]
+
+
+def test_select():
+    """
+    Tests the combination of several criteria and the failure
+    for cells that are not in the grid
+    """
+    grid_index = create_test_grid_index()
+    selected = grid_index.select(
+        bbox=(-15, 25, -20, 25), cell_ids=[(20.0, 20.0), (-10.0, 350.0)]
+    )
+    assert selected == [(20.0, 20.0), (-10.0, 350.0)]
+    assert len(grid_index.select()) == 5
+    with pytest.raises(AssertionError):
+        grid_index.select(cell_ids=[(1.0, 1.0)])
+
+
+def test_query_nearest():
+    """
+    Tests the nearest cells and their distances, also
+    across the antimeridian and for both longitude conventions
+    """
+    grid_index = create_test_grid_index()
+    positions, distances = grid_index.query_nearest(
+        [10, 30, -9, 0], [10, -171, 351, -178]
+    )
+    assert list(positions) == [0, 3, 2, 4]
+    assert distances[0] == pytest.approx(0, abs=1e-6)
+    # One degree of longitude at 30° latitude
+    assert distances[1] == pytest.approx(96.3, abs=0.5)
+    # 12° along the equator, across the antimeridian
+    assert distances[3] == pytest.approx(1334.3, abs=0.5)
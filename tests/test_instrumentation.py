@@ -0,0 +1,125 @@
+"""
+Tests the instrumentation of the model runs
+"""
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from src import instrumentation
+from src.model.seaweed_model import SeaweedModel
+
+
+def test_stage_writes_records(tmp_path):
+    """
+    Tests that every stage of a model run is recorded in the metrics file
+    """
+    metrics_file = str(tmp_path / "metrics.jsonl")
+    instrumentation.configure(metrics_file=metrics_file)
+    try:
+        model = SeaweedModel()
+        model.add_data_by_grid(
+            "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+            bbox=(17, 20, -65, -60),
+        )
+        model.calculate_factors()
+        model.calculate_growth_rate()
+        model.create_section_dfs()
+    finally:
+        instrumentation.configure()
+    with open(metrics_file) as handle:
+        records = [json.loads(line) for line in handle]
+    assert [record["stage"] for record in records] == [
+        "load",
+        "validate",
+        "calculate_factors",
+        "calculate_growth_rate",
+        "create_section_dfs",
+    ]
+    for record in records:
+        assert record["cells"] == len(model.sections)
+        assert record["wall_time"] >= 0
+        assert record["cpu_time"] >= 0
+        assert record["memory_before_mb"] > 0
+        assert record["memory_change_mb"] == pytest.approx(
+            record["memory_after_mb"] - record["memory_before_mb"]
+        )
+        assert record["peak_memory_mb"] >= record["memory_after_mb"]
+
+
+def test_stage_profile(tmp_path):
+    """
+    Tests that the chosen stage is profiled and the others are not
+    """
+    profile_file = str(tmp_path / "stage.prof")
+    instrumentation.configure(profile_stage="profiled", profile_file=profile_file)
+    try:
+        with instrumentation.stage("not_profiled"):
+            pass
+        assert not os.path.isfile(profile_file)
+        with instrumentation.stage("profiled", cells=10) as record:
+            sum(range(1000))
+    finally:
+        instrumentation.configure()
+    assert os.path.isfile(profile_file)
+    assert record["cells"] == 10
+    assert instrumentation.RECORDS[-1] is record
+
+
+def test_stage_memory():
+    """
+    Tests that the memory of a stage is measured for the stage alone
+    and that only the last records are kept
+    """
+    with instrumentation.stage("allocate") as large:
+        data = np.ones(50_000_000)
+    del data
+    with instrumentation.stage("small") as small:
+        pass
+    assert large["memory_change_mb"] > 300
+    assert abs(small["memory_change_mb"]) < 50
+    for _ in range(instrumentation.MAX_RECORDS + 10):
+        with instrumentation.stage("many"):
+            pass
+    assert len(instrumentation.RECORDS) == instrumentation.MAX_RECORDS
+
+
+def allocate_and_free():
+    """
+    Allocates about 400 MB for a moment and frees it again
+    """
+    data = np.ones(50_000_000)
+    time.sleep(0.1)
+    del data
+
+
+def test_stage_peak_memory():
+    """
+    Tests that the peak memory of a stage includes memory that was freed
+    within the stage, also for nested stages
+    """
+    with instrumentation.stage("outer") as outer:
+        allocate_and_free()
+        with instrumentation.stage("inner") as inner:
+            pass
+    if outer["peak_memory_mb"] is None:
+        pytest.skip("The memory cannot be measured on this platform")
+    assert abs(outer["memory_change_mb"]) < 50
+    assert outer["peak_memory_mb"] - outer["memory_before_mb"] > 300
+    # The peak of the inner stage does not include the freed memory
+    assert inner["peak_memory_mb"] - inner["memory_before_mb"] < 50
+    assert instrumentation.OPEN_PEAKS == []
+
+
+def test_stage_peak_memory_sampled(monkeypatch):
+    """
+    Tests that the peak memory is sampled if the peak cannot be reset
+    """
+    monkeypatch.setattr(instrumentation, "reset_peak_memory", lambda: False)
+    with instrumentation.stage("sampled") as record:
+        allocate_and_free()
+    if record["peak_memory_mb"] is None:
+        pytest.skip("The memory cannot be measured on this platform")
+    assert record["peak_memory_mb"] - record["memory_before_mb"] > 300
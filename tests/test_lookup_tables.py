@@ -0,0 +1,73 @@
+"""
+Tests the lookup tables of the single variable factors
+"""
+import numpy as np
+import pytest
+
+from src.model import lookup_tables
+from src.model import seaweed_growth as sg
+from src.model.validation import VALID_RANGES
+
+
+@pytest.mark.parametrize(
+    "variable, single_value",
+    [
+        ("illumination", sg.illumination_single_value),
+        ("temperature", sg.temperature_single_value),
+        ("salinity", sg.salinity_single_value),
+    ],
+)
+def test_table_error_bound(variable, single_value):
+    """
+    Tests that the table stays within the reported error of the exact function
+    """
+    table = lookup_tables.FactorTable(variable, max_error=1e-5)
+    assert table.max_error <= 1e-5
+    lower, upper = VALID_RANGES[variable]
+    values = np.random.default_rng(0).uniform(lower, upper, 2000)
+    exact = np.array([single_value(value) for value in values])
+    assert np.abs(table.lookup(values) - exact).max() <= table.max_error + 1e-12
+    # The kinks and the edges of the range are exact
+    assert table.lookup(np.array([lower]))[0] == pytest.approx(single_value(lower))
+    assert table.lookup(np.array([upper]))[0] == pytest.approx(
+        single_value(upper), abs=table.max_error
+    )
+
+
+def test_kink_distances(monkeypatch):
+    """
+    Tests that the kinks of changed default parameters stay table entries
+    """
+    assert lookup_tables.kink_distance("illumination") == pytest.approx(21.9)
+    assert lookup_tables.kink_distance("temperature") == 2
+    monkeypatch.setitem(sg.DEFAULT_PARAMETERS, "temperature_lower", 25.5)
+    assert lookup_tables.kink_distance("temperature") == 0.5
+    monkeypatch.setitem(sg.DEFAULT_PARAMETERS, "salinity_upper", 35.3)
+    distance = lookup_tables.kink_distance("salinity")
+    assert distance == pytest.approx(0.1)
+    for kink in [24, 35.3]:
+        assert kink / distance == pytest.approx(round(kink / distance))
+
+
+def test_factor_array():
+    """
+    Tests that nan is kept and that the exact function is used by default
+    """
+    temperature = np.array([[np.nan, 10.0], [24.0, 33.0]])
+    exact = lookup_tables.factor_array("temperature", temperature)
+    assert np.array_equal(exact, sg.temperature_array(temperature), equal_nan=True)
+    looked_up = lookup_tables.factor_array(
+        "temperature", temperature, np.float32, max_error=1e-6
+    )
+    assert looked_up.dtype == np.float32
+    assert np.isnan(looked_up[0, 0])
+    assert np.allclose(looked_up, exact, atol=1e-6, equal_nan=True)
+
+
+def test_error_report():
+    """
+    Tests that the error report lists every table
+    """
+    report = lookup_tables.error_report(1e-4)
+    assert list(report.index) == ["illumination", "temperature", "salinity"]
+    assert (report["max_error"] <= 1e-4).all()
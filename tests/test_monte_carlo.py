@@ -0,0 +1,106 @@
+"""
+Tests the Monte Carlo propagation of the uncertainty of the data
+"""
+import numpy as np
+import pytest
+
+from src.model import seaweed_growth as sg
+from src.model.monte_carlo import (
+    VARIABLES,
+    GrowthRateHistogram,
+    monte_carlo_growth_rate,
+    perturb,
+)
+from src.processing.read_files import DataGrid, DataLME
+
+FILE = "data/interim_data/150tg/data_gridded_all_parameters_US.pkl"
+LME_FILE = "data/lme_data/seaweed_environment_data_in_nuclear_war.csv"
+
+
+def create_test_data():
+    """
+    Reads the data of a part of the US grid
+    """
+    data_grid = DataGrid(FILE, bbox=(17, 20, -65, -60))
+    return data_grid.provide_data_arrays(VARIABLES)
+
+
+def test_histogram_quantiles():
+    """
+    Tests that the quantiles of the histogram are within one bin
+    of the exact quantiles and that nan values are ignored
+    """
+    rng = np.random.default_rng(1)
+    values = rng.beta(2, 5, (2000, 3, 4))
+    values[:, 0, 0] = np.nan
+    values[:100, 1, 1] = np.nan
+    histogram = GrowthRateHistogram((3, 4), bins=1000)
+    for start in range(0, 2000, 300):
+        histogram.add(values[start : start + 300])
+    # Every value is counted once, the nan values in the last bin
+    assert histogram.counts.sum() == values.size
+    assert histogram.counts[0, 0, -1] == 2000
+    quantiles = histogram.quantiles([0.05, 0.5, 0.95])
+    assert np.isnan(quantiles[:, 0, 0]).all()
+    assert np.isnan(histogram.mean()[0, 0])
+    exact = np.quantile(values[:, 1:, :], [0.05, 0.5, 0.95], axis=0)
+    exact[:, 0, 1] = np.quantile(values[100:, 1, 1], [0.05, 0.5, 0.95])
+    assert np.abs(quantiles[:, 1:, :] - exact).max() <= 1e-3
+    assert histogram.mean()[1:, :] == pytest.approx(
+        np.nanmean(values[:, 1:, :], axis=0)
+    )
+
+
+def test_perturb():
+    """
+    Tests that the realizations stay within the valid range
+    """
+    rng = np.random.default_rng(1)
+    realizations = perturb(np.array([0.0, 1.0]), "nitrate", ("normal", 5), 100, rng)
+    assert realizations.shape == (100, 2)
+    assert realizations.min() == 0
+    with pytest.raises(ValueError):
+        perturb(np.array([1.0]), "nitrate", ("uniform", 1), 10, rng)
+
+
+def test_monte_carlo_growth_rate():
+    """
+    Tests that the results without errors are the deterministic growth rate
+    and that the results do not depend on the number of processes
+    """
+    data = create_test_data()
+    growth_rate = sg.growth_factor_combination_array(
+        sg.illumination_array(data["illumination"]),
+        sg.temperature_array(data["temperature"]),
+        sg.nutrient_array(data["nitrate"], data["ammonium"], data["phosphate"])[0],
+        sg.salinity_array(data["salinity"]),
+    )
+    quantiles, mean = monte_carlo_growth_rate(data, realizations=20, error_models={})
+    assert quantiles.shape == (3,) + growth_rate.shape
+    assert np.allclose(mean, growth_rate, equal_nan=True)
+    assert np.nanmax(np.abs(quantiles - growth_rate)) <= 1e-3
+    single, single_mean = monte_carlo_growth_rate(
+        data, realizations=30, cells_per_task=16
+    )
+    parallel, parallel_mean = monte_carlo_growth_rate(
+        data, realizations=30, cells_per_task=16, processes=2
+    )
+    assert np.array_equal(single, parallel, equal_nan=True)
+    assert np.array_equal(single_mean, parallel_mean, equal_nan=True)
+    # The uncertainty spreads the growth rate
+    assert np.nanmean(single[2] - single[0]) > 0
+    other_seed, _ = monte_carlo_growth_rate(
+        data, realizations=30, cells_per_task=16, seed=1
+    )
+    assert not np.array_equal(single, other_seed, equal_nan=True)
+
+
+def test_monte_carlo_lme():
+    """
+    Tests the Monte Carlo simulation on the LME data
+    """
+    data = DataLME(LME_FILE).provide_data_arrays(VARIABLES)
+    assert data["nitrate"].shape[0] == 66
+    quantiles, mean = monte_carlo_growth_rate(data, realizations=10)
+    assert quantiles.shape == (3,) + data["nitrate"].shape
+    assert np.nanmax(quantiles) <= 1
@@ -0,0 +1,74 @@
+"""
+Tests the sweeps over sets of the empirical constants
+"""
+import numpy as np
+import pytest
+
+from src.model import seaweed_growth as sg
+from src.model.parameter_sets import (
+    sample_parameter_sets,
+    stack_parameter_sets,
+    sweep_growth_rate,
+)
+from src.model.seaweed_ensemble import SeaweedEnsemble
+
+FILE = "data/interim_data/150tg/data_gridded_all_parameters_US.pkl"
+BBOX = (17, 20, -65, -60)
+
+
+def growth_rate_of_set(data, parameters):
+    """
+    Calculates the growth rate for a single parameter set
+    """
+    return sg.growth_factor_combination_array(
+        sg.illumination_array(data["illumination"], parameters=parameters),
+        sg.temperature_array(data["temperature"], parameters=parameters),
+        sg.nutrient_array(
+            data["nitrate"], data["ammonium"], data["phosphate"], parameters=parameters
+        )[0],
+        sg.salinity_array(data["salinity"], parameters=parameters),
+    )
+
+
+def test_stack_parameter_sets():
+    """
+    Tests that missing constants get their default and invalid sets fail
+    """
+    stacked = stack_parameter_sets([{"kt1": 0.02}, {"kno3": 0.5}])
+    assert stacked.shape == (2, len(sg.DEFAULT_PARAMETERS))
+    assert stacked["kt1"].tolist() == [0.02, sg.DEFAULT_PARAMETERS["kt1"]]
+    assert stacked["kno3"].tolist() == [sg.DEFAULT_PARAMETERS["kno3"], 0.5]
+    with pytest.raises(AssertionError):
+        stack_parameter_sets([{"unknown": 1}])
+    with pytest.raises(AssertionError):
+        stack_parameter_sets([{"temperature_lower": 31}])
+
+
+def test_sweep_growth_rate():
+    """
+    Tests that every set of a sweep gives the same growth rate
+    as calculating it with this set alone
+    """
+    ensemble = SeaweedEnsemble()
+    ensemble.add_data_by_grid({"a": FILE}, bbox=BBOX)
+    ensemble.calculate_factors()
+    ensemble.calculate_growth_rate()
+    sets = sample_parameter_sets(5, names=["kt1", "kno3", "illumination_upper"])
+    sets.loc[0] = sg.DEFAULT_PARAMETERS
+    growth_rates = ensemble.sweep_growth_rate(sets, sets_per_chunk=2)
+    assert growth_rates.shape == (5,) + ensemble.data["salinity"].shape
+    # The default set gives the growth rate of the model
+    assert np.array_equal(
+        growth_rates[0], ensemble.parameters["seaweed_growth_rate"], equal_nan=True
+    )
+    for number, parameters in sets.iterrows():
+        expected = growth_rate_of_set(ensemble.data, parameters.to_dict())
+        assert np.allclose(growth_rates[number], expected, equal_nan=True)
+    # The chunks are reduced separately
+    means = sweep_growth_rate(
+        ensemble.data,
+        sets,
+        sets_per_chunk=3,
+        reduce=lambda growth_rate: np.nanmean(growth_rate, axis=(1, 2, 3)),
+    )
+    assert np.allclose(means, np.nanmean(growth_rates, axis=(1, 2, 3)))
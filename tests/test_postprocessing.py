@@ -1,7 +1,8 @@
+import numpy as np
 import pandas as pd
 import pytest
 
-from src.utilities import weighted_quantile
+from src.utilities import weighted_quantile, weighted_quantile_array
 
 
 def test_weighted_quantile():
@@ -33,3 +34,29 @@ def test_weighted_quantile():
         weighted_quantile([0, 1], s4, 0)
     with pytest.raises(AssertionError):
         weighted_quantile(s1, s2.iloc[2:], 0)
+
+
+def test_weighted_quantile_array():
+    """
+    Tests that the vectorized weighted quantile gives the same
+    result as the weighted quantile for every column
+    """
+    data = np.array([[1, 1], [2, 9], [3, 3.2], [4, 4], [5, 2]])
+    weights = np.array([0.5, 1.5, 2, 0.5, 1])
+    for quantile in [0.0, 0.1, 0.5, 0.9, 1.0]:
+        result = weighted_quantile_array(data, weights, quantile)
+        for column in range(data.shape[1]):
+            assert result[column] == weighted_quantile(
+                pd.Series(data[:, column]), pd.Series(weights), quantile
+            )
+    # Several quantiles at once give the same result as one at a time
+    quantiles = [0.0, 0.1, 0.5, 0.9, 1.0]
+    results = weighted_quantile_array(data, weights, quantiles)
+    assert results.shape == (5, 2)
+    for quantile, result in zip(quantiles, results):
+        assert (result == weighted_quantile_array(data, weights, quantile)).all()
+    # Nan values are ignored
+    data[0, 0] = np.nan
+    assert weighted_quantile_array(data, weights, 0.0)[0] == 2
+    with pytest.raises(AssertionError):
+        weighted_quantile_array(data, weights[1:], 0.5)
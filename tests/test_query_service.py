@@ -0,0 +1,100 @@
+"""
+Tests the query service for the model output
+"""
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.query_service import ResultStore, start_server
+
+PARAMETERS = ["seaweed_growth_rate", "temp_factor"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    """
+    Creates a store with two parameters of a part of the US data
+    """
+    for parameter in PARAMETERS:
+        parameter_df = pd.read_pickle(
+            "data/interim_data/150tg/" + parameter + "_US.pkl"
+        ).iloc[:50]
+        parameter_df.to_pickle(tmp_path / (parameter + "_US.pkl"))
+    return ResultStore(str(tmp_path), "US", PARAMETERS)
+
+
+def test_store_queries(store):
+    """
+    Tests the answers of the store
+    """
+    growth_df = pd.read_pickle("data/interim_data/150tg/seaweed_growth_rate_US.pkl")
+    lat, lon = growth_df.index[3]
+    answer = store.handle({"query": "cell", "lat": lat, "lon": lon, "month": 5})
+    assert answer["values"]["seaweed_growth_rate"] == pytest.approx(
+        growth_df.iloc[3][5]
+    )
+    assert set(answer["values"]) == set(PARAMETERS)
+    answer = store.handle(
+        {"query": "region", "parameter": "temp_factor", "months": [0, 11]}
+    )
+    assert answer["months"] == list(range(0, 12))
+    assert np.array(answer["values"]).shape == (50, 12)
+    request = {
+        "query": "summary",
+        "parameter": "seaweed_growth_rate",
+        "bbox": [17, 20, -65, -60],
+        "statistic": "max",
+    }
+    first = store.handle(request)
+    assert first == store.handle(request)
+    info = store.handle({"query": "info"})
+    assert info["cache_hits"] == 1
+    assert info["cache_misses"] == 1
+    # Points are answered with the nearest cell
+    answer = store.handle(
+        {"query": "cell", "lat": lat + 0.1, "lon": lon - 360.1, "month": 5}
+    )
+    assert answer["cell"] == [lat, lon]
+    assert 0 < answer["distance"] < 20
+    answer = store.handle(
+        {
+            "query": "points",
+            "parameter": "seaweed_growth_rate",
+            "lats": [lat, growth_df.index[7][0]],
+            "lons": [lon, growth_df.index[7][1]],
+        }
+    )
+    assert np.array(answer["values"]) == pytest.approx(
+        growth_df.iloc[[3, 7]].values, nan_ok=True
+    )
+    assert "error" in store.handle({"query": "cell", "lat": 0, "lon": 0, "month": 0})
+    assert "error" in store.handle({"query": "unknown"})
+
+
+def test_service(store):
+    """
+    Tests that the service answers requests over the socket
+    """
+
+    async def query():
+        server = await start_server(store, port=0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        answers = []
+        for line in [json.dumps({"query": "info"}), json.dumps("info"), "{"]:
+            writer.write(line.encode() + b"\n")
+            await writer.drain()
+            answers.append(json.loads(await reader.readline()))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    info, not_an_object, invalid = asyncio.run(query())
+    assert info["cells"] == 50
+    assert info["parameters"] == PARAMETERS
+    assert "error" in not_an_object
+    assert invalid["error"].startswith("Invalid JSON")
@@ -0,0 +1,131 @@
+"""
+Tests the streaming top-k ranking of the cells
+"""
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.processing.ranking import (
+    METRICS,
+    TopK,
+    robust_top_cells,
+    top_cells,
+    worst_year,
+)
+
+GROWTH_FILE = "data/interim_data/150tg/seaweed_growth_rate_US.pkl"
+
+
+def full_sort(growth_df, k, metric, window=None):
+    """
+    Ranks the cells by sorting the scores of all cells with pandas
+    """
+    if window is not None:
+        growth_df = growth_df.loc[:, window[0] : window[1]]
+    if metric == "mean":
+        scores = growth_df.mean(axis=1)
+    elif metric == "worst_month":
+        scores = growth_df.min(axis=1)
+    else:
+        years = (np.asarray(growth_df.columns) + 3) // 12
+        scores = growth_df.T.groupby(years).mean().T.min(axis=1)
+    return scores.dropna().sort_values(ascending=False, kind="stable").iloc[:k]
+
+
+def test_top_k():
+    """
+    Tests that the accumulator keeps the best scores over several chunks
+    """
+    rng = np.random.default_rng(42)
+    scores = rng.uniform(0, 1, 1000)
+    scores[::7] = np.nan
+    top = TopK(25)
+    cells = np.arange(1000)
+    for start in range(0, 1000, 64):
+        chunk = slice(start, start + 64)
+        top.add(scores[chunk], cells[chunk], np.zeros(1000)[chunk])
+        assert len(top.scores) <= 25
+    result = top.result()
+    expected = np.sort(scores[~np.isnan(scores)])[::-1][:25]
+    assert np.array_equal(result.values, expected)
+    assert np.array_equal(
+        scores[result.index.get_level_values("lat").astype(int)], expected
+    )
+
+
+@pytest.mark.parametrize("metric", list(METRICS))
+def test_top_cells(metric):
+    """
+    Tests that the streaming ranking finds the same cells as a full sort
+    """
+    growth_df = pd.read_pickle(GROWTH_FILE)
+    for window in [None, (0, 23)]:
+        result = top_cells(growth_df, 20, metric, window, cells_per_chunk=100)
+        expected = full_sort(growth_df, 20, metric, window)
+        assert np.allclose(result.values, expected.values)
+        assert set(result.index) == set(expected.index)
+
+
+def test_worst_year():
+    """
+    Tests that the worst year ignores the missing months
+    """
+    values = np.array([[0.5] * 12 + [0.2, np.nan] + [0.4] * 10])
+    assert np.allclose(worst_year(values, np.arange(-3, 21)), [0.2 / 11 + 4 / 11])
+
+
+def test_netcdf(tmp_path):
+    """
+    Tests that the output of the chunked model is ranked like the tables
+    """
+    growth_df = pd.read_pickle(GROWTH_FILE).iloc[:300]
+    cells = growth_df.index
+    data_set = xr.Dataset(
+        {
+            "seaweed_growth_rate": (
+                ("months_since_war", "nlat", "nlon"),
+                growth_df.values.T.reshape(-1, 30, 10),
+            )
+        },
+        coords={
+            "months_since_war": growth_df.columns,
+            "TLAT": (
+                ("nlat", "nlon"),
+                cells.get_level_values(0).values.reshape(30, 10),
+            ),
+            "TLONG": (
+                ("nlat", "nlon"),
+                cells.get_level_values(1).values.reshape(30, 10),
+            ),
+        },
+    )
+    data_set.to_netcdf(tmp_path / "growth.nc")
+    result = top_cells(str(tmp_path / "growth.nc"), 15, cells_per_chunk=45)
+    expected = top_cells(growth_df, 15)
+    pd.testing.assert_series_equal(result, expected)
+
+
+def test_robust_top_cells():
+    """
+    Tests that only cells in the top of every scenario are ranked,
+    by their worst score
+    """
+    growth_df = pd.read_pickle(GROWTH_FILE)
+    rng = np.random.default_rng(42)
+    sources = {
+        scenario: growth_df * rng.uniform(0.8, 1, (len(growth_df), 1))
+        for scenario in ["0tg", "150tg", "5tg"]
+    }
+    result = robust_top_cells(sources, 10, 200, cells_per_chunk=500)
+    assert len(result) == 10
+    assert list(result.columns) == ["0tg", "150tg", "5tg", "score"]
+    assert result["score"].is_monotonic_decreasing
+    for scenario_df in sources.values():
+        best = full_sort(scenario_df, 200, "mean")
+        assert set(result.index) <= set(best.index)
+    # The cells are ranked by their worst score
+    worst = pd.concat([df.mean(axis=1) for df in sources.values()], axis=1).min(axis=1)
+    assert np.allclose(result["score"], worst.loc[result.index])
+    with pytest.raises(AssertionError):
+        robust_top_cells(sources, 10, 5)
@@ -0,0 +1,67 @@
+"""
+Tests drawing the cells as raster image
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from src.plotting.raster import RasterMapping, load_or_build
+from src.processing.grid_index import GridIndex
+
+GROWTH_FILE = "data/interim_data/150tg/seaweed_growth_rate_US.pkl"
+EXTENT = (-130, -65, 18, 55)
+
+
+def test_from_grid():
+    """
+    Tests that every pixel shows its nearest cell, if it is close enough
+    """
+    lat_lons = [(0.5, 0.5), (0.5, 1.5), (1.5, 359.5)]
+    mapping = RasterMapping.from_grid(
+        GridIndex(lat_lons), (-1, 2, 0, 2), resolution=0.5, max_distance=60
+    )
+    assert mapping.pixels.shape == (4, 6)
+    assert mapping.resolution == 0.5
+    # The first row is the south, the first column the west
+    assert list(mapping.pixels[0]) == [-1, -1, 0, 0, 1, 1]
+    assert list(mapping.pixels[3]) == [2, 2, -1, -1, -1, -1]
+    raster = mapping.fill([1.0, np.nan, 3.0])
+    assert list(raster[0].filled(0)) == [0, 0, 1, 1, 0, 0]
+    assert raster[0].mask.tolist() == [True, True, False, False, True, True]
+    assert raster[3, 0] == 3
+
+
+def test_all_cells_drawn():
+    """
+    Tests that all cells of the test dataset are drawn
+    """
+    growth_df = pd.read_pickle(GROWTH_FILE)
+    grid_index = GridIndex(growth_df.index)
+    mapping = RasterMapping.from_grid(grid_index, EXTENT)
+    # Every cell within the extent is shown by at least one pixel
+    inside = grid_index.query_bbox(EXTENT[2], EXTENT[3], EXTENT[0], EXTENT[1])
+    assert np.isin(inside, mapping.pixels).all()
+    fig, ax = plt.subplots()
+    image = mapping.draw(ax, growth_df[0].values, vmin=0, vmax=1)
+    assert image.get_array().shape == mapping.pixels.shape
+    assert image.get_extent() == list(EXTENT)
+    plt.close(fig)
+
+
+def test_load_or_build(tmp_path):
+    """
+    Tests that the mapping is cached and rebuilt for another grid
+    """
+    growth_df = pd.read_pickle(GROWTH_FILE)
+    file = tmp_path / "raster.npz"
+    mapping = load_or_build(file, growth_df.index, EXTENT)
+    cached = load_or_build(file, growth_df.index, EXTENT)
+    assert np.array_equal(cached.pixels, mapping.pixels)
+    assert cached.lat_lons == mapping.lat_lons
+    assert cached.extent == mapping.extent
+    smaller = load_or_build(file, growth_df.index[:100], EXTENT, resolution=0.5)
+    assert smaller.pixels.max() < 100
+    assert smaller.pixels.shape == (74, 130)
+    assert load_or_build(file, growth_df.index[:100], EXTENT, 0.5).lat_lons == list(
+        growth_df.index[:100]
+    )
@@ -1,9 +1,17 @@
 """
 Tests the reading and writing of files
 """
+import numpy as np
 import pandas as pd
+import pytest
 
-from src.processing.read_files import DataGrid, DataLME
+from src.processing.read_files import (
+    MODEL_VARIABLES,
+    DataGrid,
+    DataLME,
+    needed_variables,
+    select_months,
+)
 
 
 def test_read_file_by_lme():
@@ -37,5 +45,147 @@ def test_read_file_by_grid():
     # Make sure the data is correct
     for df in data_grid.grid_dict.values():
         assert isinstance(df, pd.DataFrame)
-        # 6 parameters + lat + lon
-        assert df.shape[1] == 10
+        # 6 parameters + lat + lon + months since war, iron is not needed
+        assert df.shape[1] == 9
+        assert "iron" not in df.columns
+
+
+def test_needed_variables():
+    """
+    Tests that only the variables of the factors are needed,
+    unless further variables are asked for
+    """
+    assert needed_variables() == [
+        "nitrate",
+        "ammonium",
+        "illumination",
+        "phosphate",
+        "salinity",
+        "temperature",
+    ]
+    assert set(needed_variables()) == set(MODEL_VARIABLES)
+    assert needed_variables(["temp_factor"]) == ["temperature"]
+    assert needed_variables(["temp_factor"], ["iron"]) == ["temperature", "iron"]
+    with pytest.raises(AssertionError):
+        needed_variables(extra_variables=["zinc"])
+    with pytest.raises(AssertionError):
+        needed_variables(["growth_factor"])
+
+
+def test_extra_variables(tmp_path):
+    """
+    Tests that further variables are only kept when asked for
+    and that the model variables have to be in the file
+    """
+    data_grid = DataGrid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    # A file prepared with the iron as extra variable
+    file = tmp_path / "grid_iron.pkl"
+    pd.to_pickle(
+        {
+            lat_lon: df.assign(iron=np.float32(1.0))
+            for lat_lon, df in data_grid.grid_dict.items()
+        },
+        file,
+    )
+    assert "iron" not in next(iter(DataGrid(file).grid_dict.values())).columns
+    data_grid = DataGrid(file, extra_variables=["iron"])
+    for df in data_grid.grid_dict.values():
+        assert "iron" in df.columns
+    data_grid.convert_dtype(np.float64)
+    assert next(iter(data_grid.grid_dict.values()))["iron"].dtype == np.float64
+    grid_dict = {
+        lat_lon: df.drop(columns="salinity")
+        for lat_lon, df in data_grid.grid_dict.items()
+    }
+    pd.to_pickle(grid_dict, tmp_path / "grid.pkl")
+    with pytest.raises(AssertionError):
+        DataGrid(tmp_path / "grid.pkl")
+
+
+def test_update_data_arrays():
+    """
+    Tests that changed arrays are only written back to the given cells
+    """
+    data_grid = DataGrid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    arrays = data_grid.provide_data_arrays(["temperature"])
+    arrays["temperature"] = arrays["temperature"] + 1
+    first, second = data_grid.grid_index.lat_lons[:2]
+    old_second = data_grid.provide_data_grid(second)["temperature"].copy()
+    data_grid.update_data_arrays(arrays, [first])
+    assert np.array_equal(
+        data_grid.provide_data_grid(first)["temperature"].values,
+        arrays["temperature"][0],
+    )
+    pd.testing.assert_series_equal(
+        data_grid.provide_data_grid(second)["temperature"], old_second
+    )
+
+
+def test_select_months():
+    """
+    Tests the selection of months by range and by mask
+    """
+    positions, months = select_months(range(0, 12), 36)
+    assert list(positions) == list(range(3, 15))
+    assert months == list(range(0, 12))
+    mask = np.zeros(36, dtype=bool)
+    mask[[0, 5]] = True
+    positions, months = select_months(mask, 36)
+    assert list(positions) == [0, 5]
+    assert months == [-3, 2]
+    positions, months = select_months(None, 36)
+    assert len(positions) == 36
+    with pytest.raises(AssertionError):
+        select_months(range(30, 40), 36)
+    with pytest.raises(AssertionError):
+        select_months(mask[:10], 36)
+
+
+def test_read_file_by_lme_months():
+    """
+    Tests that DataLME only keeps the selected months
+    """
+    data_LME = DataLME(
+        "data/lme_data/seaweed_environment_data_in_nuclear_war.csv", months=range(0, 12)
+    )
+    assert data_LME.months_since_war == list(range(0, 12))
+    for df in data_LME.lme_dict.values():
+        assert df.shape == (12, 6)
+
+
+def test_read_file_by_grid_missing_data(tmp_path):
+    """
+    Tests that cells without data are dropped and partially
+    missing months are tracked, while the full grid is kept
+    """
+    data_grid = DataGrid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    grid_dict = dict(data_grid.grid_dict)
+    land_cell, partial_cell = list(grid_dict.keys())[:2]
+    grid_dict[land_cell] = grid_dict[land_cell].copy()
+    grid_dict[land_cell]["salinity"] = np.nan
+    grid_dict[partial_cell] = grid_dict[partial_cell].copy()
+    grid_dict[partial_cell].iloc[
+        [0, 4], grid_dict[partial_cell].columns.get_loc("nitrate")
+    ] = np.nan
+    file = tmp_path / "grid.pkl"
+    pd.to_pickle(grid_dict, file)
+    masked_grid = DataGrid(file)
+    assert masked_grid.dropped_cells == [land_cell]
+    assert land_cell not in masked_grid.grid_dict
+    assert land_cell not in masked_grid.grid_index.lat_lons
+    assert land_cell in masked_grid.full_grid
+    assert len(masked_grid.full_grid) == len(grid_dict)
+    assert list(masked_grid.missing_mask.keys()) == [partial_cell]
+    assert list(np.flatnonzero(masked_grid.missing_mask[partial_cell])) == [0, 4]
+    # Without dropping, all cells are kept
+    unmasked_grid = DataGrid(file, drop_missing=False)
+    assert len(unmasked_grid.grid_dict) == len(grid_dict)
@@ -0,0 +1,77 @@
+"""
+Tests the aggregation of the model output to regions
+"""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from src.processing.grid_index import GridIndex
+from src.processing.region_weights import RegionWeights, load_or_build
+
+
+def create_test_data():
+    """
+    Creates a parameter dataframe of four cells and three months
+    and two overlapping regions
+    """
+    lat_lons = [(0.5, 0.5), (0.5, 1.5), (1.5, 359.5), (10.5, 10.5)]
+    parameter_df = pd.DataFrame(
+        [[1.0, 2.0, 3.0], [3.0, 4.0, np.nan], [5.0, 6.0, 7.0], [9.0, 9.0, 9.0]],
+        index=pd.MultiIndex.from_tuples(lat_lons),
+        columns=pd.Index([-3, -2, -1], name="months_since_war"),
+    )
+    polygons = gpd.GeoSeries(
+        [box(0, 0, 2, 1), box(-1, 0, 1, 2), box(50, 50, 51, 51)],
+        index=["east", "west", "empty"],
+        crs="EPSG:4326",
+    )
+    return parameter_df, polygons
+
+
+def test_aggregate():
+    """
+    Tests the area weighted means of the regions, the handling of
+    nan and of cells in the 0-360 longitude convention
+    """
+    parameter_df, polygons = create_test_data()
+    areas = np.array([1.0, 3.0, 1.0, 1.0])
+    weights = RegionWeights.from_polygons(
+        GridIndex(parameter_df.index), polygons, areas
+    )
+    assert weights.cells_per_region().tolist() == [2, 2, 0]
+    means = weights.aggregate(parameter_df)
+    assert means.loc["east"].tolist() == pytest.approx([2.5, 3.5, 3.0])
+    assert means.loc["west"].tolist() == pytest.approx([3.0, 4.0, 5.0])
+    assert means.loc["empty"].isna().all()
+    # A buffer extends the regions to the cell further away
+    buffered = RegionWeights.from_polygons(
+        GridIndex(parameter_df.index), polygons, areas, buffer=15
+    )
+    assert buffered.cells_per_region()["east"] == 4
+
+
+def test_load_or_build(tmp_path):
+    """
+    Tests that the weights are cached and rebuilt for another grid
+    """
+    parameter_df, polygons = create_test_data()
+    file = str(tmp_path / "weights.npz")
+    built = load_or_build(file, parameter_df.index, polygons)
+    loaded = load_or_build(file, parameter_df.index, polygons)
+    assert (built.matrix != loaded.matrix).nnz == 0
+    assert loaded.regions == built.regions
+    pd.testing.assert_frame_equal(
+        built.aggregate(parameter_df), loaded.aggregate(parameter_df)
+    )
+    rebuilt = load_or_build(file, parameter_df.index[:3], polygons)
+    assert rebuilt.matrix.shape == (3, 3)
+    # Other areas or polygons with the same names are not taken from the cache
+    areas = np.array([1.0, 3.0, 1.0, 1.0])
+    weighted = load_or_build(file, parameter_df.index, polygons, areas)
+    assert weighted.matrix.sum() == pytest.approx(6.0)
+    moved = polygons.copy()
+    moved["east"] = box(0, 0, 1, 1)
+    moved_weights = load_or_build(file, parameter_df.index, moved, areas)
+    assert moved_weights.cells_per_region()["east"] == 1
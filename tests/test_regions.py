@@ -0,0 +1,50 @@
+"""
+Tests deriving regions from the output of a larger run
+"""
+import pandas as pd
+import pytest
+
+from src.processing.regions import region_positions, slice_region
+from src.processing.results_store import read_parameter, results_file
+
+PARAMETERS = ["seaweed_growth_rate", "temp_factor"]
+
+
+def test_region_positions():
+    """
+    Tests that the region definitions select exactly the cells of the
+    test datasets out of a grid that also has the cells of the other one
+    """
+    indices = {
+        region: pd.read_pickle(
+            "data/interim_data/150tg/seaweed_growth_rate_" + region + ".pkl"
+        ).index
+        for region in ["US", "AUS"]
+    }
+    lat_lons = list(indices["US"]) + list(indices["AUS"])
+    for region, index in indices.items():
+        positions = region_positions(lat_lons, region)
+        assert {lat_lons[position] for position in positions} == set(index)
+
+
+def test_slice_region(tmp_path):
+    """
+    Tests that the parameters of a region are the cells of the larger run
+    """
+    for parameter in PARAMETERS:
+        pd.read_pickle("data/interim_data/150tg/" + parameter + "_US.pkl").to_pickle(
+            tmp_path / (parameter + "_global.pkl")
+        )
+    selection = {"bbox": (17, 25, 280, 298.1)}
+    cells = slice_region(str(tmp_path), PARAMETERS, selection, name="caribbean")
+    region_file = results_file(str(tmp_path), "caribbean")
+    for parameter in PARAMETERS:
+        global_df = pd.read_pickle(tmp_path / (parameter + "_global.pkl"))
+        region_df = read_parameter(region_file, parameter)
+        assert len(region_df) == cells
+        lats = global_df.index.get_level_values(0)
+        lons = global_df.index.get_level_values(1)
+        expected = global_df[(lats <= 25) & (lons >= 280)]
+        pd.testing.assert_frame_equal(region_df, expected)
+    with pytest.raises(AssertionError):
+        slice_region(str(tmp_path), PARAMETERS, {"bbox": (-10, 0, 0, 10)}, name="a")
@@ -0,0 +1,126 @@
+"""
+Tests the results file that holds the output of a run
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model.seaweed_ensemble import SeaweedEnsemble
+from src.processing.ranking import top_cells
+from src.processing.results_store import (
+    has_cluster_labels,
+    open_results,
+    read_cells,
+    read_cluster_labels,
+    read_parameter,
+    results_file,
+    save_results,
+    stored_parameters,
+    write_parameter,
+)
+
+PATH = "data/interim_data/150tg"
+PARAMETERS = ["seaweed_growth_rate", "temp_factor"]
+
+
+@pytest.fixture
+def pickle_path(tmp_path):
+    """
+    Copies the pickles of the US test data to a temporary directory
+    """
+    for parameter in PARAMETERS:
+        shutil.copy(
+            PATH + os.sep + parameter + "_US.pkl",
+            tmp_path / (parameter + "_US.pkl"),
+        )
+    shutil.copy(
+        PATH + os.sep + "seaweed_growth_rate_clustered_US.pkl",
+        tmp_path / "seaweed_growth_rate_clustered_US.pkl",
+    )
+    return str(tmp_path)
+
+
+def test_round_trip(pickle_path):
+    """
+    Tests that the pickles are converted without changing the values
+    """
+    file = open_results(pickle_path, "US", PARAMETERS)
+    assert file == results_file(pickle_path, "US")
+    assert stored_parameters(file) == PARAMETERS
+    for parameter in PARAMETERS:
+        parameter_df = pd.read_pickle(PATH + os.sep + parameter + "_US.pkl")
+        pd.testing.assert_frame_equal(read_parameter(file, parameter), parameter_df)
+    assert read_cells(file) == list(parameter_df.index)
+    clustered_df = pd.read_pickle(
+        PATH + os.sep + "seaweed_growth_rate_clustered_US.pkl"
+    )
+    pd.testing.assert_frame_equal(
+        read_parameter(file, "seaweed_growth_rate", with_clusters=True),
+        clustered_df,
+        check_dtype=False,
+    )
+    assert has_cluster_labels(file)
+    # An existing file is not converted again
+    os.remove(pickle_path + os.sep + "temp_factor_US.pkl")
+    assert open_results(pickle_path, "US", PARAMETERS) == file
+
+
+def test_selection(pickle_path):
+    """
+    Tests reading a part of the months and cells
+    """
+    file = open_results(pickle_path, "US", PARAMETERS)
+    growth_df = pd.read_pickle(PATH + os.sep + "seaweed_growth_rate_US.pkl")
+    cells = np.array([3, 10, 11, 250])
+    selected_df = read_parameter(
+        file, "seaweed_growth_rate", months=(12, 23), cells=cells
+    )
+    pd.testing.assert_frame_equal(selected_df, growth_df.iloc[cells].loc[:, 12:23])
+    clustered_df = pd.read_pickle(
+        PATH + os.sep + "seaweed_growth_rate_clustered_US.pkl"
+    )
+    assert np.array_equal(
+        read_cluster_labels(file, cells), clustered_df["cluster"].values[cells]
+    )
+
+
+def test_write_mismatch(tmp_path):
+    """
+    Tests that all parameters of a file need the same cells and months
+    """
+    growth_df = pd.read_pickle(PATH + os.sep + "seaweed_growth_rate_US.pkl")
+    file = str(tmp_path / "results_US.nc")
+    save_results(file, [("seaweed_growth_rate", growth_df)])
+    with pytest.raises(AssertionError):
+        write_parameter(file, "seaweed_growth_rate", growth_df)
+    with pytest.raises(AssertionError):
+        write_parameter(file, "temp_factor", growth_df.iloc[1:])
+    with pytest.raises(AssertionError):
+        write_parameter(file, "temp_factor", growth_df.iloc[:, 1:])
+    assert not has_cluster_labels(file)
+    with pytest.raises(AssertionError):
+        # The file has no cluster labels
+        read_cluster_labels(file)
+
+
+def test_readers(pickle_path):
+    """
+    Tests the ensemble and the ranking on a results file
+    """
+    file = open_results(pickle_path, "US", PARAMETERS)
+    growth_df = pd.read_pickle(PATH + os.sep + "seaweed_growth_rate_US.pkl")
+    ensemble = SeaweedEnsemble()
+    ensemble.add_parameter_by_scenario(
+        "seaweed_growth_rate",
+        {"results": file, "pickle": PATH + os.sep + "seaweed_growth_rate_US.pkl"},
+    )
+    results_df = ensemble.construct_df_for_parameter("seaweed_growth_rate", "results")
+    pickle_df = ensemble.construct_df_for_parameter("seaweed_growth_rate", "pickle")
+    assert np.allclose(results_df.values, pickle_df.values, equal_nan=True)
+    pd.testing.assert_series_equal(
+        top_cells(file, k=5, cells_per_chunk=100),
+        top_cells(growth_df, k=5),
+    )
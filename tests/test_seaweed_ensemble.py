@@ -0,0 +1,118 @@
+"""
+Tests the ensemble of several scenarios
+"""
+import numpy as np
+import pandas as pd
+
+from src.model.seaweed_ensemble import SeaweedEnsemble
+from src.model.seaweed_model import SeaweedModel
+
+FILE = "data/interim_data/150tg/data_gridded_all_parameters_US.pkl"
+BBOX = (17, 20, -65, -60)
+
+
+def create_test_ensemble():
+    """
+    Creates an ensemble with the US test data used for two scenarios
+    """
+    ensemble = SeaweedEnsemble()
+    ensemble.add_data_by_grid({"a": FILE, "b": FILE}, bbox=BBOX)
+    ensemble.calculate_factors()
+    ensemble.calculate_growth_rate()
+    return ensemble
+
+
+def test_ensemble_matches_model():
+    """
+    Tests that the ensemble gives the same result as the model
+    """
+    ensemble = create_test_ensemble()
+    number_cells = len(ensemble.grid_index)
+    assert ensemble.data["salinity"].shape == (2, number_cells, 36)
+    model = SeaweedModel()
+    model.add_data_by_grid(FILE, bbox=BBOX)
+    model.calculate_factors()
+    model.calculate_growth_rate()
+    model.create_section_dfs()
+    for parameter in ["nutrient_factor", "seaweed_growth_rate"]:
+        model_df = model.construct_df_for_parameter(parameter).transpose()
+        ensemble_df = ensemble.construct_df_for_parameter(parameter, "b")
+        assert np.allclose(model_df.loc[ensemble_df.index].values, ensemble_df.values)
+
+
+def test_ensemble_statistics():
+    """
+    Tests the weighted quantile and the reductions over the scenario axis
+    """
+    ensemble = create_test_ensemble()
+    lat_lons = ensemble.grid_index.lat_lons
+    areas = pd.DataFrame(
+        {
+            "TLONG": [lon for _, lon in lat_lons],
+            "TLAT": [lat for lat, _ in lat_lons],
+            "TAREA": np.ones(len(lat_lons)),
+        }
+    ).set_index(["TLONG", "TLAT"])
+    ensemble.add_areas(areas)
+    medians = ensemble.weighted_quantile("seaweed_growth_rate", 0.5)
+    assert list(medians.columns) == ["a", "b"]
+    assert list(medians.index) == list(range(-3, 33))
+    # Both scenarios have the same data
+    assert np.allclose(medians["a"], medians["b"])
+    growth = ensemble.construct_df_for_parameter("seaweed_growth_rate", "a")
+    assert np.allclose(ensemble.scenario_statistic("seaweed_growth_rate", "max"), growth)
+    assert np.allclose(ensemble.scenario_statistic("seaweed_growth_rate", "std"), 0)
+
+
+def test_ensemble_parallel_factors():
+    """
+    Tests that the factors calculated in worker processes
+    are the same as the ones calculated in one process
+    """
+    ensemble = create_test_ensemble()
+    parallel_ensemble = SeaweedEnsemble()
+    parallel_ensemble.add_data_by_grid({"a": FILE, "b": FILE}, bbox=BBOX)
+    parallel_ensemble.calculate_factors(processes=2)
+    parallel_ensemble.calculate_growth_rate()
+    for parameter, values in ensemble.parameters.items():
+        assert np.array_equal(
+            parallel_ensemble.parameters[parameter], values, equal_nan=True
+        )
+
+
+def test_ensemble_biomass():
+    """
+    Tests that the biomass is calculated for all scenarios and cells
+    """
+    ensemble = create_test_ensemble()
+    ensemble.calculate_biomass(1.0, harvest_density=4.0)
+    shape = ensemble.parameters["seaweed_growth_rate"].shape
+    assert ensemble.parameters["biomass"].shape == shape
+    assert ensemble.parameters["harvest"].shape == shape
+    assert ensemble.days_to_target.shape == shape[:2]
+    assert (ensemble.parameters["biomass"] < 4.0).all()
+
+
+def test_ensemble_lookup_tables():
+    """
+    Tests that the lookup tables stay within their error of the exact factors
+    """
+    ensemble = create_test_ensemble()
+    lookup_ensemble = SeaweedEnsemble(lookup_error=1e-6)
+    lookup_ensemble.add_data_by_grid({"a": FILE, "b": FILE}, bbox=BBOX)
+    lookup_ensemble.calculate_factors()
+    for factor in ["illumination_factor", "temp_factor", "salinity_factor"]:
+        deviation = lookup_ensemble.parameters[factor] - ensemble.parameters[factor]
+        assert np.abs(deviation).max() <= 1e-6
+
+
+def test_ensemble_monte_carlo():
+    """
+    Tests that the Monte Carlo simulation gives the same
+    distribution for two scenarios with the same data
+    """
+    ensemble = create_test_ensemble()
+    quantiles, mean = ensemble.monte_carlo(realizations=20, quantiles=[0.1, 0.9])
+    assert quantiles.shape == (2,) + ensemble.parameters["seaweed_growth_rate"].shape
+    assert (quantiles[0] <= quantiles[1] + 1e-3).all()
+    assert np.abs(mean[0] - mean[1]).max() < 0.1
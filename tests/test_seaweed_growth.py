@@ -1,6 +1,7 @@
 """
 Tests the growth functions
 """
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -11,6 +12,7 @@ from src.model.seaweed_growth import (
     calculate_temperature_factor,
     growth_factor_combination,
     growth_factor_combination_single_value,
+    illumination_array,
     illumination_single_value,
     salinity_single_value,
     temperature_single_value,
@@ -118,6 +120,19 @@ def test_calculate_illumination_factor_unreasonable_values():
         )
 
 
+def test_illumination_array_single_precision():
+    """
+    Tests that the illumination factor stays between 0 and 1
+    and close to double precision when calculated in single precision
+    """
+    illumination = np.linspace(0, 200, 200001)
+    factor_32 = illumination_array(illumination, np.float32)
+    factor_64 = illumination_array(illumination)
+    assert factor_32.dtype == np.float32
+    assert factor_32.max() <= 1
+    assert np.abs(factor_32 - factor_64).max() < 1e-6
+
+
 def test_temperature_single_value():
     """
     Tests the temperature_single_value function
@@ -1,7 +1,11 @@
 """
 Test the whole model
 """
+import numpy as np
+import pandas as pd
+
 from src.model.seaweed_model import SeaweedModel
+from src.processing.read_files import DataGrid
 
 
 def test_create_model_instance():
@@ -48,6 +52,77 @@ def test_grid_data():
     assert section_1.seaweed_growth_rate is not None
 
 
+def test_grid_data_subset():
+    """
+    Test that only the cells in the bounding box are added to the model
+    """
+    model = SeaweedModel()
+    model.add_data_by_grid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    assert 0 < len(model.sections.keys()) < 2259
+    assert (17.474949344648152, 296.9649842693172) in model.sections
+    for lat, lon in model.sections.keys():
+        assert 17 <= lat <= 20
+        assert 295 <= lon <= 300
+
+
+def test_grid_data_months():
+    """
+    Test that only the selected months are computed and returned
+    """
+    model = SeaweedModel()
+    model.add_data_by_grid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+        months=range(0, 12),
+    )
+    model.calculate_factors()
+    model.calculate_growth_rate()
+    model.create_section_dfs()
+    parameter_df = model.construct_df_for_parameter("seaweed_growth_rate")
+    assert list(parameter_df.index) == list(range(0, 12))
+
+
+def test_grid_data_from_data_grid():
+    """
+    Test that a loaded grid can be split into several models
+    """
+    data_grid = DataGrid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    lat_lons = list(data_grid.grid_dict.keys())
+    first_model = SeaweedModel()
+    first_model.add_data_by_data_grid(data_grid, lat_lons[:2])
+    second_model = SeaweedModel()
+    second_model.add_data_by_data_grid(data_grid, lat_lons[2:])
+    assert list(first_model.sections.keys()) == lat_lons[:2]
+    assert list(second_model.sections.keys()) == lat_lons[2:]
+
+
+def test_grid_data_single_precision():
+    """
+    Test that the model can calculate in single precision
+    with results close to double precision
+    """
+    growth_rates = {}
+    for dtype in [np.float64, np.float32]:
+        model = SeaweedModel(dtype)
+        model.add_data_by_grid(
+            "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+            bbox=(17, 20, -65, -60),
+        )
+        model.calculate_factors()
+        model.calculate_growth_rate()
+        model.create_section_dfs()
+        growth_rates[dtype] = model.construct_df_for_parameter("seaweed_growth_rate")
+    assert (growth_rates[np.float32].dtypes == np.float32).all()
+    deviation = (growth_rates[np.float32] - growth_rates[np.float64]).abs()
+    assert deviation.max().max() < 1e-6
+
+
 def test_calculating_factors_lme():
     """
     Test the calculation of factors
@@ -116,3 +191,30 @@ def test_construct_df_for_parameter():
     # 3 is the number of sections
     assert len(parameter_df.index) == 240
     assert len(parameter_df.columns) == 3
+
+
+def test_grid_data_without_data(tmp_path):
+    """
+    Test that the cells without data are not calculated
+    and are left out of the output
+    """
+    data_grid = DataGrid(
+        "data/interim_data/150tg/data_gridded_all_parameters_US.pkl",
+        bbox=(17, 20, -65, -60),
+    )
+    grid_dict = dict(data_grid.grid_dict)
+    land_cell = list(grid_dict.keys())[0]
+    grid_dict[land_cell] = grid_dict[land_cell].copy()
+    grid_dict[land_cell]["temperature"] = np.nan
+    file = tmp_path / "grid.pkl"
+    pd.to_pickle(grid_dict, file)
+    model = SeaweedModel()
+    model.add_data_by_grid(file)
+    assert land_cell not in model.sections
+    model.calculate_factors()
+    model.calculate_growth_rate()
+    model.create_section_dfs()
+    growth_df = model.construct_df_for_parameter("seaweed_growth_rate")
+    assert land_cell not in growth_df.columns
+    assert len(growth_df.columns) == len(grid_dict) - 1
+    assert growth_df.notna().all().all()
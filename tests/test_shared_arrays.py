@@ -0,0 +1,80 @@
+"""
+Tests the sharing of arrays between processes
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+from src import shared_arrays
+from src.shared_arrays import SharedArrays, detach_all, parallel_map
+
+
+def sum_rows(arrays, task):
+    """
+    Sums up a range of rows of the shared data and writes it to the output
+    """
+    start, stop = task
+    arrays["sums"][start:stop] = arrays["data"][start:stop].sum(axis=1)
+    return stop - start
+
+
+def write_to_data(arrays, task):
+    """
+    Tries to write to the read-only data
+    """
+    arrays["data"][0] = 0
+
+
+def test_handles_are_small_and_read_only():
+    """
+    Tests that the handles do not contain the data and attach read-only
+    """
+    data = np.arange(100000, dtype=np.float32).reshape(1000, 100)
+    with SharedArrays({"data": data}) as shared:
+        handle = shared.handles["data"]
+        assert len(pickle.dumps(handle)) < 1000
+        opened = {}
+        attached = handle.attach(opened)
+        assert np.array_equal(attached, data)
+        with pytest.raises(ValueError):
+            attached[0, 0] = 1
+        # The owner does not attach to its own memory again
+        assert opened == {}
+
+
+def test_attach_other_process():
+    """
+    Tests that memory of another process is opened once and closed again
+    """
+    data = np.arange(10, dtype=float)
+    with SharedArrays({"data": data}) as shared:
+        handle = shared.handles["data"]
+        # Act as if another process owned the memory
+        del shared_arrays.OWNED[handle.memory_name]
+        opened = {}
+        first = handle.attach(opened)
+        second = handle.attach(opened)
+        assert list(opened) == [handle.memory_name]
+        assert np.array_equal(first, data) and np.array_equal(second, data)
+        memory = opened[handle.memory_name]
+        del first, second
+        detach_all(opened)
+        assert opened == {}
+        assert memory.buf is None
+    assert shared_arrays.OWNED == {}
+
+
+def test_parallel_map():
+    """
+    Tests that the workers read the shared data and write to the outputs
+    """
+    data = np.arange(1000, dtype=float).reshape(100, 10)
+    with SharedArrays({"data": data}, {"sums": ((100,), float)}) as shared:
+        rows = parallel_map(
+            sum_rows, shared.handles, [(0, 30), (30, 60), (60, 100)], processes=2
+        )
+        assert rows == [30, 30, 40]
+        assert np.array_equal(shared.arrays["sums"], data.sum(axis=1))
+        with pytest.raises(ValueError):
+            parallel_map(write_to_data, shared.handles, [None], processes=1)
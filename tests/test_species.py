@@ -0,0 +1,50 @@
+"""
+Tests the registry of species
+"""
+import numpy as np
+import pytest
+
+from src.model import species as sp
+from src.model.seaweed_ensemble import SeaweedEnsemble
+
+FILE = "data/interim_data/150tg/data_gridded_all_parameters_US.pkl"
+BBOX = (17, 20, -65, -60)
+
+
+def test_register_species(monkeypatch):
+    """
+    Tests that species are registered with the defaults for missing constants
+    """
+    monkeypatch.setattr(sp, "SPECIES", dict(sp.SPECIES))
+    sp.register_species("cold_water", {"temperature_lower": 10, "kt1": 0.01})
+    parameters = sp.species_parameters()
+    assert list(parameters.index) == ["gracilaria_tikvahiae", "cold_water"]
+    assert parameters.loc["cold_water", "temperature_lower"] == 10
+    assert parameters.loc["cold_water", "kno3"] == parameters["kno3"].iloc[0]
+    with pytest.raises(AssertionError):
+        sp.register_species("cold_water", {"kt1": 0.02})
+    with pytest.raises(AssertionError):
+        sp.register_species("invalid", {"salinity_upper": 1})
+    with pytest.raises(AssertionError):
+        sp.species_parameters(["unknown"])
+
+
+def test_evaluate_species(monkeypatch):
+    """
+    Tests that all species are evaluated on the same data and that
+    Gracilaria gives the growth rate of the model
+    """
+    monkeypatch.setattr(sp, "SPECIES", dict(sp.SPECIES))
+    sp.register_species("cold_water", {"temperature_lower": 10})
+    ensemble = SeaweedEnsemble()
+    ensemble.add_data_by_grid({"a": FILE}, bbox=BBOX)
+    ensemble.calculate_factors()
+    ensemble.calculate_growth_rate()
+    growth_rate, species = sp.evaluate_species(ensemble.data)
+    assert species == ["gracilaria_tikvahiae", "cold_water"]
+    assert growth_rate.shape == (2,) + ensemble.data["salinity"].shape
+    assert np.array_equal(
+        growth_rate[0], ensemble.parameters["seaweed_growth_rate"], equal_nan=True
+    )
+    # A wider optimal range can only increase the growth
+    assert (growth_rate[1] >= growth_rate[0]).all()
@@ -0,0 +1,98 @@
+"""
+Tests the validation of the environmental data
+"""
+import numpy as np
+import pytest
+
+from src.model.seaweed_model import SeaweedModel
+from src.model.validation import ValidationError, validate_arrays
+
+
+def create_test_arrays():
+    """
+    Creates arrays with the axes (cell, month) and a few unreasonable values
+    """
+    temperature = np.full((3, 4), 20.0)
+    temperature[1, 2] = 60
+    temperature[2, 0] = np.nan
+    salinity = np.full((3, 4), 30.0)
+    salinity[0, 3] = -5
+    return {"temperature": temperature, "salinity": salinity, "iron": -np.ones((3, 4))}
+
+
+def test_validate_arrays_strict():
+    """
+    Tests that the strict policy raises an error that is also an AssertionError
+    """
+    with pytest.raises(ValidationError):
+        validate_arrays(create_test_arrays())
+    with pytest.raises(AssertionError):
+        validate_arrays(create_test_arrays(), "strict")
+
+
+def test_validate_arrays_clip():
+    """
+    Tests that the clip policy clips the values and reports their location
+    """
+    arrays = create_test_arrays()
+    validated, report = validate_arrays(
+        arrays, "clip", [("cell", ["a", "b", "c"]), ("month", [0, 1, 2, 3])]
+    )
+    assert validated["temperature"][1, 2] == 50
+    assert validated["salinity"][0, 3] == 0
+    # nan is kept and variables without a range are not checked
+    assert np.isnan(validated["temperature"][2, 0])
+    assert validated["iron"] is arrays["iron"]
+    assert len(report) == 2
+    temperature_row = report[report["variable"] == "temperature"].iloc[0]
+    assert temperature_row["cell"] == "b"
+    assert temperature_row["month"] == 2
+    assert temperature_row["value"] == 60
+
+
+def test_validate_arrays_mask():
+    """
+    Tests that the mask policy sets the values to nan
+    """
+    validated, report = validate_arrays(create_test_arrays(), "mask")
+    assert np.isnan(validated["temperature"][1, 2])
+    assert np.isnan(validated["salinity"][0, 3])
+    assert np.isnan(validated["temperature"]).sum() == 2
+    assert list(report["axis_0"]) == [1, 0]
+
+
+def test_model_validation_policy():
+    """
+    Tests that the model applies the policy to the sections
+    """
+    model = SeaweedModel()
+    model.add_data_by_lme(
+        [1, 2],
+        "data/lme_data/seaweed_environment_data_in_nuclear_war.csv",
+    )
+    model.sections[2].temperature.iloc[5] = 100
+    with pytest.raises(ValidationError):
+        model.calculate_factors()
+    model.calculate_factors(policy="clip")
+    assert len(model.validation_report) == 1
+    assert model.validation_report["section"].iloc[0] == 2
+    assert model.sections[2].temperature.iloc[5] == 50
+    assert model.sections[2].temp_factor.notna().all()
+
+
+def test_strict_report():
+    """
+    Tests that the error of the strict policy has the full report
+    """
+    with pytest.raises(ValidationError) as error:
+        validate_arrays(create_test_arrays())
+    assert len(error.value.report) == 2
+
+
+def test_empty_model_validation():
+    """
+    Tests that an empty model is validated without an error
+    """
+    model = SeaweedModel()
+    model.calculate_factors()
+    assert len(model.validation_report) == 0